@@ -4,10 +4,16 @@ import json
 import boto3
 import boto3.dynamodb
 import sys
+import time
 import logger
+from answer_cache import AnswerCache, DynamoDBCacheBackend
+from content_dedupe import (CHUNK_SIZE, DynamoDBContentHashIndex, build_metadata_attributes, compute_content_hash,
+                            format_scope, normalize_content_hash, parse_scope, to_checksum_sha256)
+from ingestion import get_document_key, get_s3_objects, get_section_name, read_shared_sections
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Union
 from aws_lambda_powertools.event_handler import content_types
 from aws_lambda_powertools.event_handler.api_gateway import APIGatewayRestResolver, CORSConfig, Response
 from aws_lambda_powertools.event_handler.exceptions import BadRequestError, InternalServerError
@@ -19,12 +25,38 @@ from botocore.exceptions import ClientError
 AWS_REGION = os.environ.get('AWS_REGION', 'ap-northeast-1')  # デフォルト値を設定
 ALLOW_ORIGINS = os.environ.get("ALLOW_ORIGINS", "*")
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'default-bucket-name')
+# Search Lambdaと共有する検索結果キャッシュのテーブル名（未設定の場合は無効化しない）
+# Ingestion Lambdaを使用しない構成で、S3のイベントでキャッシュを無効化する場合に設定する
+ANSWER_CACHE_TABLE_NAME = os.environ.get('ANSWER_CACHE_TABLE_NAME', '')
+# 内容のハッシュで重複排除する場合の、ハッシュと正規のキーのテーブル名（未設定の場合は重複排除しない）
+CONTENT_HASH_TABLE_NAME = os.environ.get('CONTENT_HASH_TABLE_NAME', '')
+# アップロード用のpresigned URLの有効期限（秒）
+UPLOAD_URL_EXPIRES_IN = 600
+# 一括アップロードで1リクエストに指定できるファイル数の上限と、署名・メタデータ書き込みの並列数
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '1000'))
+MAX_PARALLEL_UPLOADS = int(os.environ.get('MAX_PARALLEL_UPLOADS', '16'))
+# マルチパートアップロードのパートサイズ（バイト）と、パートのpresigned URLの有効期限（秒）
+MULTIPART_PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE', str(16 * 1024 * 1024)))
+MULTIPART_URL_EXPIRES_IN = int(os.environ.get('MULTIPART_URL_EXPIRES_IN', '3600'))
+# 1リクエストで発行するパートのpresigned URLの上限
+MAX_PRESIGNED_PARTS = int(os.environ.get('MAX_PRESIGNED_PARTS', '1000'))
+# S3のマルチパートアップロードの制約（最小パートサイズ・最大パート数）
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+# 共有したメタデータファイルの書き込みを、インデックスの最新のスコープと一致するまで繰り返す最大回数
+SHARED_METADATA_MAX_WRITES = 5
 
 # CORSの設定
 cors_config = CORSConfig(allow_origin=ALLOW_ORIGINS)
 app = APIGatewayRestResolver(cors=cors_config)
 s3_client = boto3.client('s3', region_name=AWS_REGION)
 tracer = Tracer()
+answer_cache = AnswerCache(
+    DynamoDBCacheBackend(boto3.client('dynamodb', region_name=AWS_REGION), ANSWER_CACHE_TABLE_NAME)
+) if ANSWER_CACHE_TABLE_NAME else None
+content_hash_index = DynamoDBContentHashIndex(
+    boto3.client('dynamodb', region_name=AWS_REGION), CONTENT_HASH_TABLE_NAME
+) if CONTENT_HASH_TABLE_NAME else None
 
 def create_get_presigned_url(file_key: str) -> str:
     """
@@ -35,49 +67,45 @@ def create_get_presigned_url(file_key: str) -> str:
         Params={'Bucket': BUCKET_NAME, 'Key': file_key},
         ExpiresIn=600)
 
-def create_presigned_url(file_key: str, content_type: str) -> str:
+def create_presigned_url(file_key: str, content_type: str, content_hash: str = None) -> str:
     """
     S3へのアップロード用のpresigned URLを生成する関数.
+    content_hashを指定した場合は、内容のSHA-256が一致しないアップロードをS3が拒否する.
     """
+    params = {'Bucket': BUCKET_NAME, 'Key': file_key, 'ContentType': content_type}
+    if content_hash:
+        params['ChecksumSHA256'] = to_checksum_sha256(content_hash)
     return s3_client.generate_presigned_url(
         'put_object',
-        Params={'Bucket': BUCKET_NAME, 'Key': file_key, 'ContentType': content_type},
-        ExpiresIn=600)
-
-def upload_file(file_key: str, file_path: str, content_type: str):
-    """
-    S3にファイルをアップロードする関数.
-    """
-    s3_client.upload_file(file_path, BUCKET_NAME, file_key, ExtraArgs={'ContentType': content_type})
+        Params=params,
+        ExpiresIn=UPLOAD_URL_EXPIRES_IN)
 
-def upload_metadata_file(file_key: str, section_name: str, category_name: str, file_name: str):
+def create_metadata_body(section_name: str, category_name: str, scopes: List[str] = ()) -> bytes:
     """
-    メタデータJSONファイルを生成してS3にアップロードする関数.
+    メタデータJSONファイルの内容を生成する関数.
+    scopesには、重複排除で同じ内容がアップロードされた全てのセクション・カテゴリを指定する.
     """
-    # メタデータの作成
     metadata = {
         "metadataAttributes": {
-            "section": section_name,
-            "category": category_name,
+            **build_metadata_attributes(section_name, category_name, scopes),
             "year": datetime.now().year
         }
     }
+    return json.dumps(metadata, ensure_ascii=False).encode('utf-8')
 
-    # メタデータJSONを一時ファイルに書き込む
-    temp_dir = "/tmp"  # Lambdaで書き込み可能な一時ディレクトリ
-    metadata_file_path = f"{temp_dir}/{file_name}.metadata.json"
-
+def upload_metadata_file(file_key: str, section_name: str, category_name: str, file_name: str):
+    """
+    メタデータJSONファイルを生成してS3にアップロードする関数.
+    一時ファイルを経由せず、メモリ上の内容をput_objectで書き込む.
+    """
+    metadata_key = f"{file_key}.metadata.json"
     try:
-        os.makedirs(os.path.dirname(metadata_file_path), exist_ok=True)
-        with open(metadata_file_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-
-        # メタデータファイルをS3にアップロード
-        metadata_key = f"{file_key}.metadata.json"
-        upload_file(metadata_key, metadata_file_path, 'application/json')
-        # 一時ファイルの削除
-        os.remove(metadata_file_path)
-
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=metadata_key,
+            Body=create_metadata_body(section_name, category_name),
+            ContentType='application/json',
+        )
         logger.info(f"メタデータファイルをアップロードしました: {metadata_key}")
         return metadata_key
 
@@ -85,6 +113,208 @@ def upload_metadata_file(file_key: str, section_name: str, category_name: str, f
         logger.error(f"メタデータファイルのアップロードに失敗しました: {str(e)}")
         raise e
 
+def upload_metadata_files(sidecars: List[Dict[str, str]]) -> Dict[str, str]:
+    """
+    複数のメタデータJSONファイルを並列にS3にアップロードする関数.
+
+    Args:
+        sidecars (list): fileKey・sectionName・categoryNameを持つ辞書のリスト
+
+    Returns:
+        dict: アップロードに失敗したファイルのfileKeyとエラー内容
+    """
+    def put(sidecar: Dict[str, str]):
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=f"{sidecar['fileKey']}.metadata.json",
+            Body=create_metadata_body(sidecar['sectionName'], sidecar['categoryName']),
+            ContentType='application/json',
+        )
+
+    errors = {}
+    if not sidecars:
+        return errors
+    max_workers = max(1, min(MAX_PARALLEL_UPLOADS, len(sidecars)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {sidecar['fileKey']: executor.submit(put, sidecar) for sidecar in sidecars}
+        for file_key, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"メタデータファイルのアップロードに失敗しました: {file_key}: {str(e)}")
+                errors[file_key] = str(e)
+    logger.info(f"メタデータファイルを一括アップロードしました: {len(sidecars) - len(errors)}件成功, {len(errors)}件失敗")
+    return errors
+
+def invalidate_answer_cache(section_name: str) -> None:
+    """
+    ドキュメントが更新されたセクションの検索結果キャッシュを無効化する関数.
+    """
+    if answer_cache is None:
+        return
+    try:
+        answer_cache.invalidate_section(section_name)
+    except Exception as e:
+        # キャッシュの無効化に失敗しても処理は継続する（キャッシュはTTLで失効する）
+        logger.warning(f"検索結果キャッシュの無効化に失敗しました: {str(e)}")
+
+def handle_s3_records(records: list) -> dict:
+    """
+    S3のイベント（SQS経由を含む）で、ドキュメントが作成・削除されたセクションの検索結果キャッシュを無効化する関数.
+    presigned URLの発行時点ではドキュメントは未アップロードのため、アップロードの完了後に無効化する.
+    Ingestion Lambdaを使用する構成では取り込み完了時に無効化するため、このイベントは設定しない.
+    重複排除で共有されたドキュメントは、メタデータファイルに記録した全てのセクションを無効化する.
+    """
+    objects = get_s3_objects(records)
+    sections = {get_section_name(key) for key in filter(None, (get_document_key(key) for _, key in objects))}
+    sections = sorted(sections.union(*read_shared_sections(s3_client, objects).values()))
+    for section_name in sections:
+        invalidate_answer_cache(section_name)
+    return {"sections": sections}
+
+def get_canonical_state(entry: dict, content_hash: str) -> str:
+    """
+    ハッシュのインデックスの正規のキーのオブジェクトの状態を返す関数.
+
+    Returns:
+        str: valid（同じ内容）/ uploading（アップロード中）/ missing（アップロードされないまま有効期限切れ）/
+             overwritten（別の内容で上書き済み）
+    """
+    try:
+        response = s3_client.head_object(Bucket=BUCKET_NAME, Key=entry['canonicalKey'], ChecksumMode='ENABLED')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        return 'uploading' if time.time() - entry['createdAt'] <= UPLOAD_URL_EXPIRES_IN else 'missing'
+    checksum = response.get('ChecksumSHA256')
+    # チェックサム無しでアップロードされた場合と、マルチパートアップロードのチェックサム（パートごとの合成）は比較できない
+    if not checksum or '-' in checksum or checksum == to_checksum_sha256(content_hash):
+        return 'valid'
+    return 'overwritten'
+
+def register_content_hash(file_key: str, content_hash: str, section_name: str, category_name: str) -> dict:
+    """
+    内容のハッシュをインデックスに登録し、正規のキーとスコープを返す関数.
+    同じ内容が登録済みの場合は、正規のキーにセクション・カテゴリを追加する.
+    正規のキーが無効になっている場合は、追加済みのスコープを引き継いでfile_keyを新しい正規のキーとする.
+    """
+    scope = format_scope(section_name, category_name)
+    created, entry = content_hash_index.register(content_hash, file_key, scope, time.time())
+    if created:
+        return entry
+    state = get_canonical_state(entry, content_hash) if entry['canonicalKey'] != file_key else 'valid'
+    if state in ('missing', 'overwritten'):
+        logger.info(f"正規のキーを置き換えます（{state}）: {entry['canonicalKey']} -> {file_key}")
+        if content_hash_index.replace_canonical(content_hash, entry['canonicalKey'], file_key, scope, time.time()) \
+                and state == 'missing':
+            # ドキュメントの無いメタデータファイルが取り込まれないよう削除する
+            s3_client.delete_object(Bucket=BUCKET_NAME, Key=f"{entry['canonicalKey']}.metadata.json")
+        entry = content_hash_index.get(content_hash)
+    if scope not in entry['scopes']:
+        entry = content_hash_index.add_scope(content_hash, scope)
+    return entry
+
+def write_shared_metadata(content_hash: str, entry: dict) -> None:
+    """
+    正規のキーのメタデータJSONファイルに、同じ内容がアップロードされた全てのスコープを書き込む関数.
+    同時に別のスコープが追加された場合に備え、インデックスの最新のスコープと一致するまで書き直す.
+    """
+    for _ in range(SHARED_METADATA_MAX_WRITES):
+        section_name, category_name = parse_scope(entry['canonicalScope'])
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=f"{entry['canonicalKey']}.metadata.json",
+            Body=create_metadata_body(section_name, category_name, sorted(entry['scopes'])),
+            ContentType='application/json',
+        )
+        latest = content_hash_index.get(content_hash)
+        if latest is None or (latest['canonicalKey'], latest['scopes']) == (entry['canonicalKey'], entry['scopes']):
+            return
+        entry = latest
+    logger.warning(f"共有したメタデータファイルが最新のスコープと一致しません: {entry['canonicalKey']}")
+
+def validate_upload(file: Any) -> Union[str, None]:
+    """
+    1ファイル分の入力を検証し、不正な場合はエラー内容を返す関数.
+    """
+    if not isinstance(file, dict):
+        return "ファイルの指定が不正です"
+    if not all([file.get('fileName'), file.get('contentType'), file.get('sectionName'), file.get('categoryName')]):
+        return "必須パラメータが不足しています"
+    return None
+
+def prepare_upload(file: dict) -> dict:
+    """
+    検証済みの1ファイル分の入力から、presigned URLを発行する関数.
+    失敗した場合は例外を送出せず、エラー内容を結果に含める.
+    """
+    file_name = file['fileName']
+    file_key = f"docs/{file['sectionName']}/{file_name}"
+    content_type = file['contentType']
+    try:
+        presigned_url = create_presigned_url(file_key, content_type)
+    except Exception as e:
+        logger.error(f"presigned URL生成に失敗しました: {file_key}: {str(e)}")
+        return {"fileName": file_name, "fileKey": file_key, "error": str(e)}
+    return {"fileName": file_name, "fileKey": file_key, "uploadUrl": presigned_url}
+
+@app.post('/document/presigned-urls')
+@tracer.capture_method
+def upload_documents():
+    """
+    複数ファイルのS3へのアップロード用のpresigned URLを一括で発行する関数.
+    メタデータファイルのアップロードは並列に行い、結果はファイルごとに返す.
+    """
+    request_body: dict = app.current_event.json_body
+    files = request_body.get('files')
+    if not isinstance(files, list) or not files:
+        raise BadRequestError("filesを指定してください")
+    if len(files) > MAX_BATCH_FILES:
+        raise BadRequestError(f"1回に指定できるファイルは{MAX_BATCH_FILES}件までです")
+
+    # 入力を検証してからファイルパスを構築し、同じファイルパスが複数指定された場合は最初の指定のみを処理する
+    results = [None] * len(files)
+    targets = {}
+    for index, file in enumerate(files):
+        error = validate_upload(file)
+        if error:
+            results[index] = {"fileName": file.get('fileName'), "error": error} if isinstance(file, dict) else {"error": error}
+            continue
+        file_key = f"docs/{file['sectionName']}/{file['fileName']}"
+        if file_key in targets:
+            results[index] = {"fileName": file.get('fileName'), "fileKey": file_key, "error": "ファイルが重複しています"}
+            continue
+        targets[file_key] = index
+
+    # 署名はCPUのみで完結するため順番に行い、メタデータファイルの書き込みをまとめて並列に行う
+    for index in targets.values():
+        results[index] = prepare_upload(files[index])
+    signed = [index for index in targets.values() if "uploadUrl" in results[index]]
+    errors = upload_metadata_files([
+        {
+            "fileKey": results[index]["fileKey"],
+            "sectionName": files[index]["sectionName"],
+            "categoryName": files[index]["categoryName"],
+        }
+        for index in signed
+    ])
+    for index in signed:
+        error = errors.get(results[index]["fileKey"])
+        if error:
+            results[index] = {"fileName": results[index]["fileName"], "fileKey": results[index]["fileKey"], "error": error}
+
+    failed = sum(1 for result in results if "error" in result)
+    logger.info(f"presigned URLを一括発行しました: {len(results) - failed}件成功, {failed}件失敗")
+    return Response(
+        status_code=HTTPStatus.OK,
+        content_type=content_types.APPLICATION_JSON,
+        body=json.dumps({
+            "results": results,
+            "total": len(results),
+            "failed": failed,
+        })
+    )
+
 @app.post('/document/presigned-url')
 @tracer.capture_method
 def upload_document():
@@ -105,6 +335,11 @@ def upload_document():
         # ファイルパスの構築
         file_key = f"docs/{section_name}/{file_name}"
 
+        # 内容のハッシュが指定された場合は重複排除する
+        content_hash = request_body.get('contentHash')
+        if content_hash and content_hash_index is not None:
+            return upload_deduplicated_document(file_key, content_type, section_name, category_name, content_hash)
+
         # presigned URLの生成（有効期限10分）
         presigned_url = create_presigned_url(file_key, content_type)
         get_presigned_url = create_get_presigned_url(file_key)
@@ -129,13 +364,277 @@ def upload_document():
         logger.error(f"予期しないエラー: {str(e)}")
         raise InternalServerError(f"presigned URL生成に失敗しました: {str(e)}")
 
+def upload_deduplicated_document(file_key: str, content_type: str, section_name: str, category_name: str,
+                                 content_hash: str):
+    """
+    内容のハッシュで重複排除してpresigned URLを発行する関数.
+    同じ内容が登録済みの場合はpresigned URLを発行せず、正規のキーのメタデータにセクション・カテゴリを追加する.
+    """
+    try:
+        content_hash = normalize_content_hash(content_hash)
+    except ValueError as e:
+        raise BadRequestError(str(e))
+
+    entry = register_content_hash(file_key, content_hash, section_name, category_name)
+    write_shared_metadata(content_hash, entry)
+    if entry['canonicalKey'] != file_key:
+        logger.info(f"同じ内容のドキュメントが登録済みです: {file_key} -> {entry['canonicalKey']}")
+        return create_response({"fileKey": entry['canonicalKey'], "contentHash": content_hash, "duplicate": True})
+
+    return create_response({
+        "uploadUrl": create_presigned_url(file_key, content_type, content_hash),
+        "fileKey": file_key,
+        "contentHash": content_hash,
+        "duplicate": False,
+    })
+
+@app.post('/document/content-hash')
+@tracer.capture_method
+def deduplicate_document():
+    """
+    アップロード済みのドキュメントの内容をストリームで読み込んでハッシュを計算し、重複排除する関数.
+    一括アップロード・マルチパートアップロードなど、アップロード時にハッシュを指定しなかった場合に使用する.
+    同じ内容が登録済みの場合は、正規のキーのメタデータにセクション・カテゴリを追加し、アップロードしたファイルを削除する.
+    """
+    if content_hash_index is None:
+        raise BadRequestError("重複排除が有効になっていません")
+    file_key = app.current_event.json_body.get('fileKey')
+    if (not file_key or not file_key.startswith('docs/') or file_key.endswith('.metadata.json')
+            or '..' in file_key.split('/')):
+        raise BadRequestError("fileKeyが不正です")
+
+    metadata_key = f"{file_key}.metadata.json"
+    try:
+        metadata = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=metadata_key)['Body'].read())
+        section_name = metadata['metadataAttributes']['section']
+        category_name = metadata['metadataAttributes']['category']
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=file_key)['Body']
+        content_hash = compute_content_hash(body.iter_chunks(CHUNK_SIZE))
+
+        entry = register_content_hash(file_key, content_hash, section_name, category_name)
+        duplicate = entry['canonicalKey'] != file_key
+        if duplicate or len(entry['scopes']) > 1:
+            write_shared_metadata(content_hash, entry)
+        if duplicate:
+            s3_client.delete_object(Bucket=BUCKET_NAME, Key=file_key)
+            s3_client.delete_object(Bucket=BUCKET_NAME, Key=metadata_key)
+            logger.info(f"同じ内容のドキュメントが登録済みのため削除しました: {file_key} -> {entry['canonicalKey']}")
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            raise BadRequestError("ファイルまたはメタデータファイルが存在しません")
+        logger.error(f"重複排除に失敗しました: {str(e)}")
+        raise InternalServerError(f"重複排除に失敗しました: {str(e)}")
+
+    return create_response({"fileKey": entry['canonicalKey'], "contentHash": content_hash, "duplicate": duplicate})
+
+def create_response(data: dict) -> dict:
+    """
+    レスポンスを作成する関数.
+    """
+    return Response(
+        status_code=HTTPStatus.OK,
+        content_type=content_types.APPLICATION_JSON,
+        body=json.dumps(data)
+    )
+
+def calculate_part_size(file_size: int, part_size: int) -> int:
+    """
+    パート数がS3の上限を超えないようにパートサイズを調整する関数.
+    """
+    part_size = max(part_size, S3_MIN_PART_SIZE)
+    return max(part_size, -(-file_size // S3_MAX_PARTS))
+
+def create_part_presigned_urls(file_key: str, upload_id: str, part_numbers: List[int]) -> List[Dict[str, Any]]:
+    """
+    マルチパートアップロードの各パートのpresigned URLを生成する関数.
+    """
+    return [
+        {
+            "partNumber": part_number,
+            "uploadUrl": s3_client.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': BUCKET_NAME, 'Key': file_key, 'UploadId': upload_id, 'PartNumber': part_number},
+                ExpiresIn=MULTIPART_URL_EXPIRES_IN),
+        }
+        for part_number in part_numbers
+    ]
+
+def list_uploaded_parts(file_key: str, upload_id: str) -> List[Dict[str, Any]]:
+    """
+    アップロード済みのパートを全て取得する関数（1000件を超える場合はページングする）.
+    """
+    parts = []
+    list_kwargs = {'Bucket': BUCKET_NAME, 'Key': file_key, 'UploadId': upload_id}
+    while True:
+        response = s3_client.list_parts(**list_kwargs)
+        parts.extend(
+            {"partNumber": part['PartNumber'], "eTag": part['ETag'], "size": part['Size']}
+            for part in response.get('Parts', [])
+        )
+        if not response.get('IsTruncated'):
+            return parts
+        list_kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+def get_multipart_target(request_body: dict) -> tuple:
+    """
+    マルチパートアップロードの対象（fileKey・uploadId）を取得する関数.
+    アップロード先はdocs/配下のみ許可する.
+    """
+    file_key = request_body.get('fileKey')
+    upload_id = request_body.get('uploadId')
+    if not file_key or not upload_id:
+        raise BadRequestError("fileKeyとuploadIdを指定してください")
+    if not file_key.startswith('docs/') or '..' in file_key.split('/'):
+        raise BadRequestError("fileKeyが不正です")
+    return file_key, upload_id
+
+def parse_part_numbers(part_numbers: Any) -> List[int]:
+    """
+    パート番号のリストを検証する関数.
+    """
+    if (not isinstance(part_numbers, list)
+            or not all(isinstance(number, int) and 1 <= number <= S3_MAX_PARTS for number in part_numbers)):
+        raise BadRequestError(f"partNumbersには1〜{S3_MAX_PARTS}のパート番号のリストを指定してください")
+    if len(part_numbers) > MAX_PRESIGNED_PARTS:
+        raise BadRequestError(f"1回に発行できるパートのURLは{MAX_PRESIGNED_PARTS}件までです")
+    return part_numbers
+
+@app.post('/document/multipart')
+@tracer.capture_method
+def create_multipart_upload():
+    """
+    マルチパートアップロードを開始する関数.
+    fileSizeを指定した場合は、全パートのpresigned URLもあわせて発行する.
+    """
+    request_body: dict = app.current_event.json_body
+    file_name = request_body.get('fileName')
+    content_type = request_body.get('contentType')
+    section_name = request_body.get('sectionName')
+    category_name = request_body.get('categoryName')
+    file_size = request_body.get('fileSize')
+    if not all([file_name, content_type, section_name, category_name]):
+        raise BadRequestError("必須パラメータが不足しています")
+    if file_size is not None and (not isinstance(file_size, int) or file_size <= 0):
+        raise BadRequestError("fileSizeが不正です")
+
+    file_key = f"docs/{section_name}/{file_name}"
+    part_size = calculate_part_size(file_size or 0, MULTIPART_PART_SIZE)
+    part_count = -(-file_size // part_size) if file_size else None
+    try:
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=BUCKET_NAME, Key=file_key, ContentType=content_type)['UploadId']
+        upload_metadata_file(file_key, section_name, category_name, file_name)
+        parts = create_part_presigned_urls(file_key, upload_id, list(range(1, min(part_count, MAX_PRESIGNED_PARTS) + 1))) \
+            if part_count else []
+    except Exception as e:
+        logger.error(f"マルチパートアップロードの開始に失敗しました: {str(e)}")
+        raise InternalServerError(f"マルチパートアップロードの開始に失敗しました: {str(e)}")
+
+    logger.info(f"マルチパートアップロードを開始しました: {file_key} ({part_count}パート)")
+    return create_response({
+        "fileKey": file_key,
+        "uploadId": upload_id,
+        "partSize": part_size,
+        "partCount": part_count,
+        "parts": parts,
+    })
+
+@app.post('/document/multipart/parts')
+@tracer.capture_method
+def presign_multipart_parts():
+    """
+    マルチパートアップロードの指定したパートのpresigned URLを発行する関数.
+    URLの期限切れや、中断したアップロードの再開時に使用する.
+    """
+    request_body: dict = app.current_event.json_body
+    file_key, upload_id = get_multipart_target(request_body)
+    part_numbers = parse_part_numbers(request_body.get('partNumbers'))
+    return create_response({
+        "fileKey": file_key,
+        "uploadId": upload_id,
+        "parts": create_part_presigned_urls(file_key, upload_id, part_numbers),
+    })
+
+@app.get('/document/multipart/parts')
+@tracer.capture_method
+def list_multipart_parts():
+    """
+    マルチパートアップロードのアップロード済みのパートを返す関数.
+    アップロードを再開する際に、未アップロードのパートのみを送信するために使用する.
+    """
+    file_key, upload_id = get_multipart_target({
+        'fileKey': app.current_event.get_query_string_value('fileKey', ''),
+        'uploadId': app.current_event.get_query_string_value('uploadId', ''),
+    })
+    try:
+        parts = list_uploaded_parts(file_key, upload_id)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            raise BadRequestError("マルチパートアップロードが存在しません")
+        raise InternalServerError(f"パートの取得に失敗しました: {str(e)}")
+    return create_response({"fileKey": file_key, "uploadId": upload_id, "parts": parts})
+
+@app.post('/document/multipart/complete')
+@tracer.capture_method
+def complete_multipart_upload():
+    """
+    マルチパートアップロードを完了する関数.
+    partsを省略した場合は、アップロード済みの全パートで完了する.
+    """
+    request_body: dict = app.current_event.json_body
+    file_key, upload_id = get_multipart_target(request_body)
+    parts = request_body.get('parts')
+    try:
+        if parts is None:
+            parts = list_uploaded_parts(file_key, upload_id)
+        s3_client.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=file_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(
+                ({'PartNumber': part['partNumber'], 'ETag': part['eTag']} for part in parts),
+                key=lambda part: part['PartNumber'],
+            )},
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchUpload', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+            raise BadRequestError(f"マルチパートアップロードを完了できません: {str(e)}")
+        raise InternalServerError(f"マルチパートアップロードの完了に失敗しました: {str(e)}")
+    except (KeyError, TypeError):
+        raise BadRequestError("partsにはpartNumberとeTagのリストを指定してください")
+
+    logger.info(f"マルチパートアップロードを完了しました: {file_key} ({len(parts)}パート)")
+    return create_response({"fileKey": file_key, "uploadId": upload_id, "partCount": len(parts)})
+
+@app.post('/document/multipart/abort')
+@tracer.capture_method
+def abort_multipart_upload():
+    """
+    マルチパートアップロードを中止し、アップロード済みのパートとメタデータファイルを削除する関数.
+    """
+    request_body: dict = app.current_event.json_body
+    file_key, upload_id = get_multipart_target(request_body)
+    try:
+        s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=file_key, UploadId=upload_id)
+        s3_client.delete_object(Bucket=BUCKET_NAME, Key=f"{file_key}.metadata.json")
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            raise BadRequestError("マルチパートアップロードが存在しません")
+        raise InternalServerError(f"マルチパートアップロードの中止に失敗しました: {str(e)}")
+
+    logger.info(f"マルチパートアップロードを中止しました: {file_key}")
+    return create_response({"fileKey": file_key, "uploadId": upload_id})
+
 @tracer.capture_lambda_handler
 def lambda_handler(event, context: LambdaContext) -> dict:
     """
     データソース関連のLambdaハンドラ.
 
+    S3のイベント（またはS3のイベントを送るSQS）では検索結果キャッシュを無効化し、
+    それ以外はAPI Gateway REST APIイベントとして処理する.
+
     Args:
-        event (dict): API Gateway REST APIイベント
+        event (dict): S3 / SQS / API Gateway REST APIイベント
         context (LambdaContext): 未使用
 
     Returns:
@@ -143,4 +642,6 @@ def lambda_handler(event, context: LambdaContext) -> dict:
     """
     if os.environ.get('DEBUG') == 'True':
         print('Event of lambda_handler:', json.dumps(event, indent=2))
+    if 'Records' in event:
+        return handle_s3_records(event['Records'])
     return app.resolve(event, context)
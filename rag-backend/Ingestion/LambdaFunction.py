@@ -0,0 +1,203 @@
+from http import HTTPStatus
+import os
+import json
+import boto3
+import logger
+from answer_cache import AnswerCache, DynamoDBCacheBackend
+from ingestion import (DynamoDBIngestionStore, InMemoryIngestionStore, IngestionCoordinator, LocalIngestionClient,
+                       get_s3_objects, read_shared_sections, summarize_job)
+from aws_lambda_powertools.event_handler import content_types
+from aws_lambda_powertools.event_handler.api_gateway import APIGatewayRestResolver, CORSConfig, Response
+from aws_lambda_powertools.event_handler.exceptions import InternalServerError, NotFoundError
+from aws_lambda_powertools.tracing import Tracer
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from botocore.exceptions import ClientError
+
+# 環境変数の取得
+AWS_REGION = os.environ.get('AWS_REGION', 'ap-northeast-1')  # デフォルト値を設定
+ALLOW_ORIGINS = os.environ.get("ALLOW_ORIGINS", "*")
+KNOWLEDGEBASE_ID = os.environ.get('KNOWLEDGEBASE_ID', '')
+KNOWLEDGEBASE_DATA_SOURCE_ID = os.environ.get('KNOWLEDGEBASE_DATA_SOURCE_ID', '')
+# 待機中のキー・取り込みジョブを保存するテーブル名
+INGESTION_TABLE_NAME = os.environ.get('INGESTION_TABLE_NAME', '')
+# 最後のアップロードから取り込みジョブを開始するまでの時間と、最初のアップロードからの最大の待ち時間（秒）
+INGESTION_DEBOUNCE_SECONDS = float(os.environ.get('INGESTION_DEBOUNCE_SECONDS', '60'))
+INGESTION_MAX_WAIT_SECONDS = float(os.environ.get('INGESTION_MAX_WAIT_SECONDS', '600'))
+# 1つのドキュメントの取り込みを試行する最大回数（失敗した取り込みジョブのキーはこの回数まで再度取り込む）
+INGESTION_MAX_ATTEMPTS = int(os.environ.get('INGESTION_MAX_ATTEMPTS', '3'))
+# 取り込みジョブのAPI（bedrock: Bedrock / local: ローカル代替）
+INGESTION_API = os.environ.get('INGESTION_API', 'bedrock')
+# 待機中のキー・取り込みジョブの保存先（dynamodb / memory: プロセス内に保持するローカルでのテスト用）
+INGESTION_STORE = os.environ.get('INGESTION_STORE', 'memory' if INGESTION_API == 'local' else 'dynamodb')
+# ステータスAPIで返す取り込みジョブの数
+INGESTION_JOB_HISTORY = int(os.environ.get('INGESTION_JOB_HISTORY', '20'))
+# Search Lambdaと共有する検索結果キャッシュのテーブル名（未設定の場合は無効化しない）
+ANSWER_CACHE_TABLE_NAME = os.environ.get('ANSWER_CACHE_TABLE_NAME', '')
+
+# CORSの設定
+cors_config = CORSConfig(allow_origin=ALLOW_ORIGINS)
+app = APIGatewayRestResolver(cors=cors_config)
+tracer = Tracer()
+s3_client = boto3.client('s3', region_name=AWS_REGION)
+answer_cache = AnswerCache(
+    DynamoDBCacheBackend(boto3.client('dynamodb', region_name=AWS_REGION), ANSWER_CACHE_TABLE_NAME)
+) if ANSWER_CACHE_TABLE_NAME else None
+
+
+def invalidate_answer_cache(job: dict) -> None:
+    """
+    取り込みジョブが完了したセクションの検索結果キャッシュを無効化する関数.
+    取り込みが完了するまでは検索結果が変わらないため、アップロード時ではなく取り込み完了時に無効化する.
+    """
+    if answer_cache is None:
+        return
+    for section_name in job['sections']:
+        try:
+            answer_cache.invalidate_section(section_name)
+        except Exception as e:
+            logger.warning(f"検索結果キャッシュの無効化に失敗しました: {section_name}: {str(e)}")
+    logger.info(f"取り込みジョブが完了しました: {job['ingestionJobId']} ({job['keyCount']}件)")
+
+def report_abandoned_keys(job: dict, keys: list) -> None:
+    """
+    取り込みを諦めたドキュメントを記録する関数.
+    INGESTION_MAX_ATTEMPTS回失敗したドキュメントは待機中に戻さないため、再度アップロードするまで検索できない.
+    """
+    logger.error(f"{len(keys)}件のドキュメントの取り込みを{INGESTION_MAX_ATTEMPTS}回失敗したため中止しました: {job['ingestionJobId']}",
+                 extra={'keys': keys, 'failureReasons': job['failureReasons']})
+
+def create_ingestion_client():
+    """
+    取り込みジョブのAPIのクライアントを作成する関数.
+    """
+    if INGESTION_API == 'local':
+        return LocalIngestionClient()
+    return boto3.client('bedrock-agent', region_name=AWS_REGION)
+
+def create_ingestion_store():
+    """
+    待機中のキー・取り込みジョブの保存先を作成する関数.
+    プロセス内の保存先はコールドスタートや同時実行で待機中のキーが失われるため、
+    INGESTION_STORE=memory（またはINGESTION_API=local）を指定した場合のみ使用する.
+    """
+    if INGESTION_STORE == 'memory':
+        logger.warning("待機中のキー・取り込みジョブをプロセス内に保持します（ローカルでのテスト用）")
+        return InMemoryIngestionStore()
+    if not INGESTION_TABLE_NAME:
+        raise RuntimeError("INGESTION_TABLE_NAMEが設定されていません（ローカルでのテスト時はINGESTION_STORE=memoryを指定してください）")
+    return DynamoDBIngestionStore(boto3.client('dynamodb', region_name=AWS_REGION), INGESTION_TABLE_NAME)
+
+ingestion_coordinator = IngestionCoordinator(
+    create_ingestion_client(),
+    KNOWLEDGEBASE_ID,
+    KNOWLEDGEBASE_DATA_SOURCE_ID,
+    create_ingestion_store(),
+    debounce_seconds=INGESTION_DEBOUNCE_SECONDS,
+    max_wait_seconds=INGESTION_MAX_WAIT_SECONDS,
+    on_complete=invalidate_answer_cache,
+    max_attempts=INGESTION_MAX_ATTEMPTS,
+    on_abandon=report_abandoned_keys,
+)
+
+def create_response(data: dict) -> dict:
+    """
+    レスポンスを作成する関数.
+    """
+    return Response(
+        status_code=HTTPStatus.OK,
+        content_type=content_types.APPLICATION_JSON,
+        body=json.dumps(data, ensure_ascii=False)
+    )
+
+def flush_ingestion(force: bool = False) -> dict:
+    """
+    取り込みジョブを開始できる場合は開始し、開始した取り込みジョブを返す関数.
+    """
+    job = ingestion_coordinator.flush(force=force)
+    if job is not None:
+        logger.info(f"取り込みジョブを開始しました: {job['ingestionJobId']}",
+                    extra={'keyCount': job['keyCount'], 'sections': job['sections']})
+    return summarize_job(job) if job else None
+
+@tracer.capture_method
+def handle_s3_records(records: list) -> dict:
+    """
+    アップロードされたキーを待機中に追加する関数.
+    重複排除で共有されたドキュメントのメタデータファイルからは、参照する全てのセクションを記録する.
+    """
+    objects = get_s3_objects(records)
+    added = ingestion_coordinator.add([key for _, key in objects], read_shared_sections(s3_client, objects))
+    return {"added": added, "job": flush_ingestion()}
+
+@tracer.capture_method
+def handle_scheduled_event() -> dict:
+    """
+    実行中の取り込みジョブの状態を更新し、取り込みジョブを開始できる場合は開始する関数.
+    """
+    active = ingestion_coordinator.active_job()
+    return {"activeJob": summarize_job(active) if active else None, "job": flush_ingestion()}
+
+@app.get('/ingestion/status')
+@tracer.capture_method
+def get_ingestion_status():
+    """
+    待機中のキーと、直近の取り込みジョブの状態を返す関数.
+    """
+    try:
+        return create_response(ingestion_coordinator.status(INGESTION_JOB_HISTORY))
+    except ClientError as e:
+        logger.error(f"取り込みジョブの状態の取得に失敗しました: {str(e)}")
+        raise InternalServerError(f"取り込みジョブの状態の取得に失敗しました: {str(e)}")
+
+@app.get('/ingestion/jobs/<job_id>')
+@tracer.capture_method
+def get_ingestion_job(job_id: str):
+    """
+    取り込みジョブの状態を返す関数.
+    """
+    try:
+        job = ingestion_coordinator.get_job(job_id)
+    except ClientError as e:
+        logger.error(f"取り込みジョブの状態の取得に失敗しました: {str(e)}")
+        raise InternalServerError(f"取り込みジョブの状態の取得に失敗しました: {str(e)}")
+    if job is None:
+        raise NotFoundError("取り込みジョブが存在しません")
+    return create_response(summarize_job(job))
+
+@app.post('/ingestion/flush')
+@tracer.capture_method
+def post_ingestion_flush():
+    """
+    デバウンス時間の経過を待たずに、待機中のキーの取り込みジョブを開始する関数.
+    実行中の取り込みジョブがある場合は開始しない.
+    """
+    try:
+        job = flush_ingestion(force=True)
+    except ClientError as e:
+        logger.error(f"取り込みジョブの開始に失敗しました: {str(e)}")
+        raise InternalServerError(f"取り込みジョブの開始に失敗しました: {str(e)}")
+    return create_response({"job": job})
+
+@tracer.capture_lambda_handler
+def lambda_handler(event, context: LambdaContext) -> dict:
+    """
+    取り込み関連のLambdaハンドラ.
+
+    S3のイベント（またはS3のイベントを送るSQS）ではアップロードされたキーを待機中に追加し、
+    EventBridgeのスケジュールでは取り込みジョブを開始・状態を更新する.
+    それ以外はAPI Gateway REST APIイベントとして処理する.
+
+    Args:
+        event (dict): S3 / SQS / EventBridge / API Gateway REST APIイベント
+        context (LambdaContext): 未使用
+
+    Returns:
+        dict: レスポンス
+    """
+    if os.environ.get('DEBUG') == 'True':
+        print('Event of lambda_handler:', json.dumps(event, indent=2))
+    if 'Records' in event:
+        return handle_s3_records(event['Records'])
+    if event.get('source') == 'aws.events':
+        return handle_scheduled_event()
+    return app.resolve(event, context)
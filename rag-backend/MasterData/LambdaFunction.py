@@ -4,10 +4,15 @@ import json
 import boto3
 import boto3.dynamodb
 import sys
+import queue
+import random
+import threading
+import time
 import logger
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, Generator, List, Any, Union
 from aws_lambda_powertools.event_handler import content_types
 from aws_lambda_powertools.event_handler.api_gateway import APIGatewayRestResolver, CORSConfig, Response
 from aws_lambda_powertools.event_handler.exceptions import BadRequestError, InternalServerError
@@ -19,68 +24,364 @@ from botocore.exceptions import ClientError
 AWS_REGION = os.environ.get('AWS_REGION', 'ap-northeast-1')  # デフォルト値を設定
 ALLOW_ORIGINS = os.environ.get("ALLOW_ORIGINS", "*")
 TABLE_NAME = os.environ.get('TABLE_NAME', 'default-table-name')
+# スキャンを並列実行するセグメント数（1の場合は並列実行しない）
+SCAN_TOTAL_SEGMENTS = int(os.environ.get('SCAN_TOTAL_SEGMENTS', '1'))
+# batch_write_itemで1回に書き込める最大件数
+BATCH_WRITE_SIZE = 25
+# batch_get_itemで1回に取得できる最大件数
+BATCH_GET_SIZE = 100
+# セクション以外の管理用項目のIDの接頭辞と、ID採番用のカウンターのID
+META_ID_PREFIX = 'meta#'
+ID_COUNTER_ID = 'meta#id_counter'
+# マスターデータの版数を管理する項目のID（保存のたびに版数を更新する）
+CATALOG_VERSION_ID = 'meta#catalog_version'
+# 版数を確認する最小間隔（秒、0の場合はリクエストごとに確認する）
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', '0'))
+# 未処理の項目を再送する最大回数と、再送までの待機時間（秒、指数バックオフ）
+BATCH_WRITE_MAX_RETRIES = int(os.environ.get('BATCH_WRITE_MAX_RETRIES', '8'))
+BATCH_WRITE_BASE_DELAY = float(os.environ.get('BATCH_WRITE_BASE_DELAY', '0.05'))
+BATCH_WRITE_MAX_DELAY = float(os.environ.get('BATCH_WRITE_MAX_DELAY', '2.0'))
 
 # CORSの設定
-cors_config = CORSConfig(allow_origin=ALLOW_ORIGINS)
+cors_config = CORSConfig(allow_origin=ALLOW_ORIGINS, expose_headers=['ETag'])
 app = APIGatewayRestResolver(cors=cors_config)
 dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
 tracer = Tracer()
+# boto3のリソースはスレッドセーフではないため、スレッドごとにテーブルを保持する
+thread_local = threading.local()
+# 並列スキャン用のスレッドプール（ウォームスタート間で共有する）
+scan_executor = ThreadPoolExecutor(max_workers=max(1, SCAN_TOTAL_SEGMENTS), thread_name_prefix='scan')
+# ID採番用のカウンターの初期化を1スレッドずつ行うためのロック
+id_counter_lock = threading.Lock()
+# ウォームスタート間で共有するマスターデータ（版数が変わった場合のみ再取得する）
+catalog_cache = {'version': None, 'items': [], 'body': '', 'checked_at': float('-inf')}
+catalog_lock = threading.Lock()
 
 
-def fetch_dynamodb_data() -> List[Dict[str, Any]]:
+def create_table():
+    """
+    DynamoDBテーブルを作成する関数（スレッドごとに1回呼び出される）.
+    メインスレッド以外ではスレッド専用のセッションからリソースを作成する.
+    """
+    if threading.current_thread() is threading.main_thread():
+        resource = dynamodb
+    else:
+        resource = boto3.session.Session().resource('dynamodb', region_name=AWS_REGION)
+    return resource.Table(TABLE_NAME)
+
+
+def get_table():
+    """
+    現在のスレッド用のDynamoDBテーブルを取得する関数.
+    """
+    table = getattr(thread_local, 'table', None)
+    if table is None:
+        table = create_table()
+        thread_local.table = table
+    return table
+
+
+def scan_segment(segment: int = 0, total_segments: int = 1,
+                 projection: Union[List[str], None] = None,
+                 consistent_read: bool = False) -> Generator[Dict[str, Any], None, None]:
+    """
+    DynamoDBのスキャンを最後のページまで実行し、項目を1件ずつ返す関数.
+
+    Args:
+        segment (int): スキャンするセグメント
+        total_segments (int): セグメントの総数（1の場合はテーブル全体）
+        projection (list): 取得する属性名のリスト（未指定の場合は全属性）
+        consistent_read (bool): 強い整合性のある読み込みを行うかどうか
+    """
+    table = get_table()
+    scan_kwargs = {}
+    if consistent_read:
+        scan_kwargs['ConsistentRead'] = True
+    if projection and 'id' not in projection:
+        # 管理用項目を除外するためidは必ず取得する
+        projection = ['id', *projection]
+    if total_segments > 1:
+        scan_kwargs['Segment'] = segment
+        scan_kwargs['TotalSegments'] = total_segments
+    if projection:
+        # 予約語と衝突しないよう属性名はプレースホルダーで指定する
+        names = {f'#p{index}': name for index, name in enumerate(projection)}
+        scan_kwargs['ProjectionExpression'] = ', '.join(names.keys())
+        scan_kwargs['ExpressionAttributeNames'] = names
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if not str(item.get('id', '')).startswith(META_ID_PREFIX):
+                yield item
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+# セグメントのスキャンの終了を表す番兵
+_SEGMENT_END = object()
+
+
+def iter_dynamodb_data(projection: Union[List[str], None] = None,
+                       total_segments: Union[int, None] = None,
+                       consistent_read: bool = False) -> Generator[Dict[str, Any], None, None]:
+    """
+    DynamoDBの全項目を1件ずつ返す関数（全件をメモリに保持しない）.
+    total_segmentsが2以上の場合はセグメントごとに並列でスキャンし、取得した順に返す.
+
+    Args:
+        projection (list): 取得する属性名のリスト（未指定の場合は全属性）
+        total_segments (int): 並列スキャンのセグメント数（未指定の場合はSCAN_TOTAL_SEGMENTS）
+        consistent_read (bool): 強い整合性のある読み込みを行うかどうか
+    """
+    total_segments = total_segments or SCAN_TOTAL_SEGMENTS
+    if total_segments <= 1:
+        yield from scan_segment(projection=projection, consistent_read=consistent_read)
+        return
+
+    # 読み出し側より先行しすぎないよう、キューの大きさを制限する
+    item_queue = queue.Queue(maxsize=1000)
+    cancelled = threading.Event()
+
+    def produce(segment: int):
+        try:
+            for item in scan_segment(segment, total_segments, projection, consistent_read):
+                if cancelled.is_set():
+                    break
+                item_queue.put(item)
+        except Exception as e:
+            item_queue.put(e)
+        finally:
+            item_queue.put(_SEGMENT_END)
+
+    for segment in range(total_segments):
+        scan_executor.submit(produce, segment)
+
+    remaining = total_segments
+    try:
+        while remaining:
+            item = item_queue.get()
+            if item is _SEGMENT_END:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        if remaining:
+            # 途中で終了した場合は、待機中のスレッドが終了できるようキューを空にする
+            cancelled.set()
+            while remaining:
+                if item_queue.get() is _SEGMENT_END:
+                    remaining -= 1
+
+
+def fetch_dynamodb_data(projection: Union[List[str], None] = None,
+                        consistent_read: bool = False) -> List[Dict[str, Any]]:
     """
     DynamoDBからデータを取得する関数.
     """
 
     # 実際のDynamoDB操作
     try:
-        table = dynamodb.Table(TABLE_NAME)
-        response = table.scan(Limit=100)
-        logger.info(response)
-        items = response.get('Items', [])
-        print(f"Found {len(items)} items in DynamoDB")
+        items = list(iter_dynamodb_data(projection, consistent_read=consistent_read))
+        logger.info(f"Found {len(items)} items in DynamoDB")
         return items
     except ClientError as e:
         error_msg = f"Error fetching data from DynamoDB: {e}"
-        print(error_msg)
+        logger.error(error_msg)
         raise InternalServerError(error_msg)
     except Exception as e:
         error_msg = f"Unexpected error: {e}"
-        print(error_msg)
+        logger.error(error_msg)
         raise InternalServerError(error_msg)
 
 
-def create_get_response(data: List[Dict[str, Any]]) -> dict:
+def get_catalog_version() -> int:
+    """
+    マスターデータの版数を取得する関数.
+    """
+    item = get_table().get_item(Key={'id': CATALOG_VERSION_ID}, ConsistentRead=True).get('Item')
+    return int(item['version']) if item else 0
+
+
+def update_catalog_version() -> int:
+    """
+    マスターデータの版数を1つ進める関数.
+    """
+    response = get_table().update_item(
+        Key={'id': CATALOG_VERSION_ID},
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW',
+    )
+    return int(response['Attributes']['version'])
+
+
+def load_catalog(revalidate: bool = False) -> dict:
+    """
+    マスターデータを取得する関数.
+    版数が前回の取得時から変わっていない場合は、DynamoDBをスキャンせずにキャッシュを返す.
+
+    Args:
+        revalidate (bool): CATALOG_VERSION_CHECK_INTERVAL内でも版数を確認するかどうか
+
+    Returns:
+        dict: 版数(version)・全セクションデータ(items)・レスポンスボディ(body)
+    """
+    with catalog_lock:
+        now = time.monotonic()
+        if (not revalidate and catalog_cache['version'] is not None
+                and now - catalog_cache['checked_at'] < CATALOG_VERSION_CHECK_INTERVAL):
+            return dict(catalog_cache)
+
+        # スキャン中に保存された場合も次回に再取得されるよう、版数はスキャンより前に取得する
+        version = get_catalog_version()
+        if version != catalog_cache['version']:
+            items = fetch_dynamodb_data()
+            catalog_cache.update({
+                'version': version,
+                'items': items,
+                'body': json.dumps({"results": items, "total": len(items)}),
+            })
+        catalog_cache['checked_at'] = now
+        return dict(catalog_cache)
+
+
+def create_etag(version: int) -> str:
+    """
+    マスターデータの版数からETagを作成する関数.
+    """
+    return f'"{TABLE_NAME}-{version}"'
+
+
+def create_get_response(data: List[Dict[str, Any]], etag: Union[str, None] = None, body: Union[str, None] = None) -> dict:
     """
     レスポンスを作成する関数.
     """
     return Response(
         status_code=HTTPStatus.OK,
         content_type=content_types.APPLICATION_JSON,
-        body=json.dumps({
+        body=body or json.dumps({
             "results": data,
             "total": len(data)
-        })
+        }),
+        # no-cacheを指定し、ブラウザがIf-None-Matchで再検証するようにする
+        headers={'ETag': etag, 'Cache-Control': 'no-cache'} if etag else None,
+    )
+
+
+def create_not_modified_response(etag: str) -> dict:
+    """
+    マスターデータが変更されていない場合のレスポンス(304)を作成する関数.
+    """
+    return Response(
+        status_code=HTTPStatus.NOT_MODIFIED,
+        content_type=content_types.APPLICATION_JSON,
+        body='',
+        headers={'ETag': etag},
     )
 
+def backoff(attempt: int) -> None:
+    """
+    再送までの待機を行う関数（ジッター付きの指数バックオフ）.
+    """
+    delay = min(BATCH_WRITE_MAX_DELAY, BATCH_WRITE_BASE_DELAY * (2 ** attempt))
+    time.sleep(random.uniform(delay / 2, delay))
+
+
+def find_existing_ids(ids: List[str]) -> set:
+    """
+    指定したIDのうちDynamoDBに存在するものをbatch_get_itemで取得する関数.
+    テーブル全体ではなく、指定したIDの件数に比例したコストで確認できる.
+    """
+    existing_ids = set()
+    unique_ids = list(dict.fromkeys(ids))
+    for start in range(0, len(unique_ids), BATCH_GET_SIZE):
+        request_items = {
+            TABLE_NAME: {
+                'Keys': [{'id': item_id} for item_id in unique_ids[start:start + BATCH_GET_SIZE]],
+                'ProjectionExpression': '#id',
+                'ExpressionAttributeNames': {'#id': 'id'},
+            }
+        }
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            existing_ids.update(item['id'] for item in response.get('Responses', {}).get(TABLE_NAME, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            if attempt >= BATCH_WRITE_MAX_RETRIES:
+                raise InternalServerError("DynamoDBからの取得が完了しませんでした")
+            backoff(attempt)
+            attempt += 1
+    return existing_ids
+
+
+def initialize_id_counter() -> None:
+    """
+    ID採番用のカウンターを既存データの最大IDで初期化する関数.
+    カウンターが存在しない場合（初回のみ）に呼び出す.
+    """
+    with id_counter_lock:
+        # 同じプロセスの別スレッドが初期化済みの場合はスキャンしない
+        if 'Item' in get_table().get_item(Key={'id': ID_COUNTER_ID}, ConsistentRead=True):
+            return
+        existing_ids = [int(item['id']) for item in iter_dynamodb_data(projection=['id']) if item['id'].isdigit()]
+        try:
+            get_table().put_item(
+                Item={'id': ID_COUNTER_ID, 'current_value': max(existing_ids, default=0)},
+                ConditionExpression='attribute_not_exists(id)',
+            )
+        except ClientError as e:
+            # 別のプロセスで同時に初期化された場合は、先に作成されたカウンターを使用する
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def allocate_ids(count: int) -> List[str]:
+    """
+    カウンターを1回の更新で count だけ進め、連続したIDをまとめて確保する関数.
+    更新はDynamoDB上でアトミックに行われるため、同時に保存されても同じIDは払い出されない.
+    """
+    if count <= 0:
+        return []
+
+    for attempt in range(2):
+        try:
+            response = get_table().update_item(
+                Key={'id': ID_COUNTER_ID},
+                UpdateExpression='ADD current_value :count',
+                ConditionExpression='attribute_exists(id)',
+                ExpressionAttributeValues={':count': count},
+                ReturnValues='UPDATED_NEW',
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException' or attempt:
+                raise
+            initialize_id_counter()
+            continue
+        last_id = int(response['Attributes']['current_value'])
+        return [str(new_id) for new_id in range(last_id - count + 1, last_id + 1)]
+
+
 def numbering_id(sections: dict) -> dict:
     """
     セクションデータのidを数値に変換する関数.
     """
-    # 現在のデータを取得して最大IDを特定
-    existing_data = fetch_dynamodb_data()
-    existing_ids = [int(item['id']) for item in existing_data if 'id' in item and item['id'].isdigit()]
-    max_id = max(existing_ids) if existing_ids else 0
-
-    # 既存のIDのマップを作成（高速検索用）
-    existing_id_map = {item['id']: True for item in existing_data if 'id' in item}
+    # 送信されたIDのうちDynamoDBに存在するものを確認
+    existing_id_map = find_existing_ids([section['id'] for section in sections if section.get('id')])
 
-    for section in sections:
-        # IDが存在するかチェック
-        if 'id' not in section or not section['id'] or section['id'] not in existing_id_map:
-            # 新規データの場合、新しいIDを採番
-            max_id += 1
-            section['id'] = str(max_id)
+    # 新規データの場合、新しいIDを採番
+    new_sections = [
+        section for section in sections
+        if 'id' not in section or not section['id'] or section['id'] not in existing_id_map
+    ]
+    for section, new_id in zip(new_sections, allocate_ids(len(new_sections))):
+        section['id'] = new_id
     return sections
 
 def formatting_category_data(categories: dict) -> dict:
@@ -119,32 +420,94 @@ def formatting_section_data(sections: dict) -> dict:
     return formatted_sections
 
 
-def save_dynamodb_data(formatted_sections) -> None:
+def batch_write_sections(sections: List[Dict[str, Any]]) -> None:
+    """
+    batch_write_itemでセクションデータを25件ずつ書き込む関数.
+    同じidのセクションは最後のものを書き込む（1回のbatch_write_itemに同じキーを含めるとValidationExceptionになる）.
+    未処理の項目（UnprocessedItems）は指数バックオフで再送する.
+    """
+    sections = list({section['id']: section for section in sections}.values())
+    for start in range(0, len(sections), BATCH_WRITE_SIZE):
+        request_items = {
+            TABLE_NAME: [{'PutRequest': {'Item': section}} for section in sections[start:start + BATCH_WRITE_SIZE]]
+        }
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                break
+            if attempt >= BATCH_WRITE_MAX_RETRIES:
+                unprocessed_count = sum(len(requests) for requests in request_items.values())
+                raise InternalServerError(f"DynamoDBへの書き込みが完了しませんでした（未処理: {unprocessed_count}件）")
+            backoff(attempt)
+            attempt += 1
+
+
+def is_section_changed(section: Dict[str, Any], existing_section: Union[Dict[str, Any], None]) -> bool:
+    """
+    セクションデータが既存のデータから変更されているかを判定する関数.
+    """
+    if existing_section is None:
+        return True
+    return (
+        existing_section.get('sectionName') != section['sectionName']
+        or list(existing_section.get('categories', [])) != section['categories']
+    )
+
+
+def update_catalog_cache(catalog: dict, saved_sections: List[Dict[str, Any]],
+                         new_version: Union[int, None]) -> List[Dict[str, Any]]:
+    """
+    保存したセクションデータをマスターデータのキャッシュに反映する関数.
+
+    Args:
+        catalog (dict): 保存前に取得したマスターデータ
+        saved_sections (list): 書き込んだセクションデータ
+        new_version (int): 書き込み後の版数（書き込んでいない場合はNone）
+
+    Returns:
+        list: 保存後の全セクションデータ
+    """
+    if new_version is None:
+        return catalog['items']
+
+    merged_sections = {item['id']: item for item in catalog['items']}
+    merged_sections.update({section['id']: section for section in saved_sections})
+    items = list(merged_sections.values())
+
+    with catalog_lock:
+        if catalog_cache['version'] == catalog['version'] and new_version == catalog['version'] + 1:
+            catalog_cache.update({
+                'version': new_version,
+                'items': items,
+                'body': json.dumps({"results": items, "total": len(items)}),
+            })
+        else:
+            # 別の保存処理と競合した場合は、次回の取得時に再スキャンする
+            catalog_cache['version'] = None
+    return items
+
+
+def save_dynamodb_data(formatted_sections) -> List[Dict[str, Any]]:
     """
     DynamoDBにデータを保存する関数.
-    既存のデータの場合は更新し、新規の場合は追加する
+    既存のデータと比較し、新規または変更のあったデータのみをまとめて書き込む.
+    書き込んだ内容はマスターデータのキャッシュにも反映する.
+
+    Returns:
+        list: 保存後の全セクションデータ
     """
-    table = dynamodb.Table(TABLE_NAME)
-    for section in formatted_sections:
-        try:
-            # 既存のデータを更新
-            table.update_item(
-                Key={
-                    'id': section['id']
-                },
-                UpdateExpression='SET sectionName = :sn, categories = :cat, update_at = :ua',
-                ExpressionAttributeValues={
-                    ':sn': section['sectionName'],
-                    ':cat': section['categories'],
-                    ':ua': section['update_at']
-                }
-            )
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ValidationException':
-                # 新規データの場合は追加
-                table.put_item(Item=section)
-            else:
-                raise e
+    catalog = load_catalog(revalidate=True)
+    existing_sections = {item['id']: item for item in catalog['items']}
+    changed_sections = [
+        section for section in formatted_sections
+        if is_section_changed(section, existing_sections.get(section['id']))
+    ]
+    logger.info(f"Saving {len(changed_sections)} of {len(formatted_sections)} sections to DynamoDB")
+    batch_write_sections(changed_sections)
+    new_version = update_catalog_version() if changed_sections else None
+    return update_catalog_cache(catalog, changed_sections, new_version)
 
 
 def create_save_response(data) -> dict:
@@ -178,12 +541,23 @@ def search_dynamodb():
     """
     DynamoDBからデータを検索する関数.
     """
-    dynamodb_data = fetch_dynamodb_data()
+    catalog = load_catalog()
+    etag = create_etag(catalog['version'])
+    headers = app.current_event.headers or {}
+    if_none_match = next((value for name, value in headers.items() if name.lower() == 'if-none-match'), None)
+    if if_none_match == etag:
+        return create_not_modified_response(etag)
 
-    if not dynamodb_data:
-        return create_get_response([])
+    # fieldsで取得する属性を指定できる（例: ?fields=id,sectionName）
+    fields = app.current_event.get_query_string_value('fields', '')
+    projection = [field.strip() for field in fields.split(',') if field.strip()]
+    if projection:
+        dynamodb_data = [
+            {field: item[field] for field in projection if field in item} for item in catalog['items']
+        ]
+        return create_get_response(dynamodb_data, etag)
 
-    return create_get_response(dynamodb_data)
+    return create_get_response(catalog['items'], etag, catalog['body'])
 
 @app.post('/masterdata/sections-categories')
 @tracer.capture_method
@@ -197,9 +571,13 @@ def save_categories():
     if sections:
         numbered_sections = numbering_id(sections)
         formatted_sections = formatting_section_data(numbered_sections)
-        save_dynamodb_data(formatted_sections)
+        dynamodb_data = save_dynamodb_data(formatted_sections)
+    else:
+        dynamodb_data = load_catalog()['items']
 
-    dynamodb_data = fetch_dynamodb_data()
+    # ?consistent=true の場合のみ、保存後のデータをDynamoDBから読み直す
+    if app.current_event.get_query_string_value('consistent', '') == 'true':
+        dynamodb_data = fetch_dynamodb_data(consistent_read=True)
 
     if not dynamodb_data:
         return create_get_response([])
@@ -5,7 +5,17 @@ import boto3
 import boto3.dynamodb
 import sys
 import base64
+import functools
+import threading
+import time
 import logger
+import timing
+from answer_cache import AnswerCache, DynamoDBCacheBackend, InMemoryCacheBackend, RedisCacheBackend
+from cache import TTLCache
+from context_packing import pack_documents
+from rank_fusion import RRF_K, reciprocal_rank_fusion
+from retrieval_filter import FilterRegistry, UnknownFilterError, load_sections_from_file, load_sections_from_table, load_version_from_table
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
@@ -21,8 +31,71 @@ AWS_REGION = os.environ.get('AWS_REGION', 'ap-northeast-1')  # デフォルト
 ALLOW_ORIGINS = os.environ.get("ALLOW_ORIGINS", "*")
 TABLE_NAME = os.environ.get('TABLE_NAME', 'default-table-name')
 KNOWLEDGEBASE_ID = os.environ.get('KNOWLEDGEBASE_ID', '')
+KNOWLEDGEBASE_DATA_SOURCE_ID = os.environ.get('KNOWLEDGEBASE_DATA_SOURCE_ID', '')
 MODEL_VERSION = os.environ.get('MODEL_VERSION', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
 ANTHROPIC_VERSION = os.environ.get('ANTHROPIC_VERSION', 'bedrock-2023-05-31')
+# 検索対象ごとの検索・要約を並列実行する最大数（1の場合は逐次実行）
+MAX_PARALLEL_SEARCHES = int(os.environ.get('MAX_PARALLEL_SEARCHES', '5'))
+# 検索結果キャッシュの設定
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'False') == 'True'
+ANSWER_CACHE_BACKEND = os.environ.get('ANSWER_CACHE_BACKEND', 'memory')  # memory / dynamodb / redis
+ANSWER_CACHE_TABLE_NAME = os.environ.get('ANSWER_CACHE_TABLE_NAME', '')
+ANSWER_CACHE_REDIS_URL = os.environ.get('ANSWER_CACHE_REDIS_URL', '')
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', '1800'))
+ANSWER_CACHE_MAX_SIZE = int(os.environ.get('ANSWER_CACHE_MAX_SIZE', '1024'))
+# 類似質問のキャッシュ検索（埋め込みベクトルのコサイン類似度がしきい値以上の場合にヒット）
+ANSWER_CACHE_SEMANTIC = os.environ.get('ANSWER_CACHE_SEMANTIC', 'False') == 'True'
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0.95'))
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+# Knowledge Baseの検索結果キャッシュの設定
+RETRIEVAL_CACHE_ENABLED = os.environ.get('RETRIEVAL_CACHE_ENABLED', 'True') == 'True'
+RETRIEVAL_CACHE_MAX_SIZE = int(os.environ.get('RETRIEVAL_CACHE_MAX_SIZE', '256'))
+RETRIEVAL_CACHE_TTL = int(os.environ.get('RETRIEVAL_CACHE_TTL', '300'))
+# プロンプトに含めるドキュメントのトークン数の上限（0以下の場合は上限なし）と、重複とみなす割合
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '8000'))
+CONTEXT_OVERLAP_THRESHOLD = float(os.environ.get('CONTEXT_OVERLAP_THRESHOLD', '0.8'))
+# プロバイダー側のプロンプトキャッシュ（共通の指示部分）を使用するかどうか
+PROMPT_CACHE_ENABLED = os.environ.get('PROMPT_CACHE_ENABLED', 'False') == 'True'
+# プレサインURLの有効期限と、キャッシュしたURLを再発行するまでの余裕（秒）
+PRESIGNED_URL_EXPIRES_IN = int(os.environ.get('PRESIGNED_URL_EXPIRES_IN', '3600'))
+PRESIGNED_URL_SAFETY_MARGIN = int(os.environ.get('PRESIGNED_URL_SAFETY_MARGIN', '300'))
+PRESIGNED_URL_CACHE_MAX_SIZE = int(os.environ.get('PRESIGNED_URL_CACHE_MAX_SIZE', '1024'))
+# Knowledge Baseの取り込みジョブを確認する間隔（秒）
+INGESTION_CHECK_INTERVAL = int(os.environ.get('INGESTION_CHECK_INTERVAL', '60'))
+# 検索対象のセクション・カテゴリを確認するMasterDataのテーブルと、起動時に読み込むJSONファイル
+MASTERDATA_TABLE_NAME = os.environ.get('MASTERDATA_TABLE_NAME', '')
+FILTER_CATALOG_PATH = os.environ.get('FILTER_CATALOG_PATH', '')
+# MasterDataの版数を確認する間隔（秒）
+FILTER_CATALOG_REFRESH_INTERVAL = int(os.environ.get('FILTER_CATALOG_REFRESH_INTERVAL', '60'))
+# 組み立て済みの検索フィルターを保持する最大件数
+FILTER_CACHE_MAX_SIZE = int(os.environ.get('FILTER_CACHE_MAX_SIZE', '1024'))
+# 存在しないセクション・カテゴリが指定された場合の動作（skip: 検索せず空の結果を返す / reject: 400エラー）
+UNKNOWN_FILTER_ACTION = os.environ.get('UNKNOWN_FILTER_ACTION', 'skip')
+# DocumentUploadの重複排除で複数のセクション・カテゴリに共有されたドキュメントも検索対象にするかどうか
+CONTENT_DEDUPE_ENABLED = os.environ.get('CONTENT_DEDUPE_ENABLED', 'False') == 'True'
+# 検索方式（single: 1回の検索 / fusion: 複数の検索を並列に実行し、Reciprocal Rank Fusionで統合する）
+RETRIEVAL_ENGINE = os.environ.get('RETRIEVAL_ENGINE', 'single')
+# 1回の検索で取得する件数（fusionの場合は統合後の件数）
+RETRIEVAL_NUMBER_OF_RESULTS = int(os.environ.get('RETRIEVAL_NUMBER_OF_RESULTS', '10'))
+# fusionで実行する検索タイプ（カンマ区切り）と、同時に実行する検索の最大数
+RETRIEVAL_SEARCH_TYPES = [
+    search_type.strip() for search_type in os.environ.get('RETRIEVAL_SEARCH_TYPES', 'SEMANTIC,HYBRID').split(',')
+    if search_type.strip()
+]
+RETRIEVAL_FANOUT = int(os.environ.get('RETRIEVAL_FANOUT', '4'))
+# fusionで追加する書き換えクエリの数（0の場合は書き換えない）と、書き換えに使用するモデル
+QUERY_REWRITE_COUNT = int(os.environ.get('QUERY_REWRITE_COUNT', '0'))
+QUERY_REWRITE_MODEL_ID = os.environ.get('QUERY_REWRITE_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+RRF_CONSTANT = int(os.environ.get('RRF_CONSTANT', str(RRF_K)))
+# 生成の前に検索結果を並べ替えるリランカー（none / bm25 / cross-encoder）と、プロンプトに残す件数（0の場合は全件）
+RERANKER = os.environ.get('RERANKER', 'none')
+RERANK_TOP_K = int(os.environ.get('RERANK_TOP_K', '0'))
+# リランカーのスコアの重み（1未満の場合は元の順位と合算する）
+RERANK_WEIGHT = float(os.environ.get('RERANK_WEIGHT', '0.5'))
+RERANKER_MODEL = os.environ.get('RERANKER_MODEL', 'hotchpotch/japanese-reranker-cross-encoder-xsmall-v1')
+# 処理ごとの所要時間を構造化ログに出力するかどうかと、Server-Timingヘッダーを返すかどうか
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', 'False') == 'True'
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'False') == 'True'
 # CORSの設定
 cors_config = CORSConfig(allow_origin=ALLOW_ORIGINS)
 app = APIGatewayRestResolver(cors=cors_config)
@@ -31,8 +104,25 @@ s3_client = boto3.client('s3', region_name=AWS_REGION)
 tracer = Tracer()
 bedrock_agent_runtime = boto3.client('bedrock-agent-runtime')
 bedrock_runtime = boto3.client('bedrock-runtime')
-
-MESSAGE_HEADER = """
+bedrock_agent = boto3.client('bedrock-agent')
+
+# ウォームスタート間で共有するKnowledge Baseの検索結果キャッシュ
+retrieval_cache = TTLCache(max_size=RETRIEVAL_CACHE_MAX_SIZE, ttl=RETRIEVAL_CACHE_TTL) if RETRIEVAL_CACHE_ENABLED else None
+# ウォームスタート間で共有するプレサインURLのキャッシュ（S3 URIごと）
+presigned_url_cache = TTLCache(
+    max_size=PRESIGNED_URL_CACHE_MAX_SIZE,
+    ttl=PRESIGNED_URL_EXPIRES_IN - PRESIGNED_URL_SAFETY_MARGIN,
+)
+# 最後に完了した取り込みジョブ（検索結果キャッシュの世代番号として使用する）
+knowledge_base_generation = {'value': '', 'checked_at': float('-inf')}
+knowledge_base_generation_lock = threading.Lock()
+# セクション・カテゴリの検証と、組み立て済みの検索フィルター
+filter_registry = FilterRegistry(shared=CONTENT_DEDUPE_ENABLED, max_size=FILTER_CACHE_MAX_SIZE)
+filter_registry_checked_at = {'value': float('-inf')}
+filter_registry_lock = threading.Lock()
+
+# 全リクエストで共通の指示（プロンプトキャッシュの対象となるよう、可変のドキュメントより前に配置する）
+MESSAGE_INSTRUCTIONS = """
 あなたは社内ユーザーからの質問を応えるAIアシスタントです。
 以下の手順で社員の質問に答えてください。手順以外のことは絶対にしないでください。
 
@@ -54,11 +144,6 @@ MESSAGE_HEADER = """
 }
 </参考ドキュメントのJSON形式>
 
-<参考ドキュメント>
-"""
-
-MESSAGE_FOOTER = """
-</参考ドキュメント>
 
 <回答のルール>
 * 雑談や挨拶には応じないでください。「私は雑談はできません。通常のチャット機能をご利用ください。」とだけ出力してください。他の文言は一切出力しないでください。例外はありません。
@@ -69,6 +154,62 @@ MESSAGE_FOOTER = """
 </回答のルール>
 """
 
+# リクエストごとに変わる参考ドキュメント
+MESSAGE_DOCUMENTS = """
+<参考ドキュメント>
+{0}
+</参考ドキュメント>
+"""
+
+@timing.timed('embed')
+def embed_text(text: str) -> list:
+    """
+    テキストの埋め込みベクトルを取得する関数.
+    """
+    response = bedrock_runtime.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        accept="application/json",
+        body=json.dumps({'inputText': text}),
+        contentType="application/json",
+    )
+    return json.loads(response.get('body').read()).get('embedding', [])
+
+def create_reranker():
+    """
+    設定に応じてリランカーを生成する関数.
+    """
+    if RERANKER == 'none':
+        return None
+    # numpy・sentence-transformersはリランカーを使用する場合のみimportする
+    from reranking import BM25Reranker, CrossEncoderReranker
+    if RERANKER == 'cross-encoder':
+        from sentence_transformers import CrossEncoder
+        return CrossEncoderReranker(CrossEncoder(RERANKER_MODEL).predict)
+    return BM25Reranker()
+
+# ウォームスタート間で共有するリランカー（クロスエンコーダーのモデルはコールドスタート時に読み込む）
+reranker = create_reranker()
+
+@timing.timed('rerank')
+def rerank_documents(search_text: str, documents: list) -> list:
+    """
+    生成の前に検索結果を並べ替え、上位RERANK_TOP_K件に絞り込む関数.
+    """
+    if reranker is None:
+        return documents
+
+    from reranking import rerank
+    reranked_documents, rerank_stats = rerank(
+        reranker,
+        search_text,
+        documents,
+        get_text=lambda document: document.get('content', {}).get('text', ''),
+        top_k=RERANK_TOP_K or None,
+        weight=RERANK_WEIGHT,
+    )
+    logger.info("Rerank", extra=rerank_stats)
+    return reranked_documents
+
 def format_documents(documents: list) -> list:
     """
     ドキュメントを整形する関数.
@@ -85,64 +226,281 @@ def format_documents(documents: list) -> list:
         })
     return formatted_documents
 
-def generate_retrieve_config(section_name: str, categories: list):
+def generate_retrieve_config(section_name: str, categories: list, search_type: str = 'SEMANTIC'):
     """
     ベックロックにフィルター有りでデータを渡す設定を生成する関数.
+    フィルターはセクション・カテゴリの組み合わせごとに組み立て済みのものを使用する.
     """
     filters = {}
-    if section_name and categories:
-                filters['filter'] = {
-                'andAll': [
-                    {'equals': {'key': 'section', 'value': section_name}},
-                    {'in': {'key': 'category', 'value': categories}},
-                ],
-            }
-    elif categories:
-        filters['filter']= {'in': {'key': 'category', 'value': categories}}
-    elif section_name:
-        filters['filter']= {'equals': {'key': 'section', 'value': section_name}}
+    retrieval_filter = filter_registry.compile(section_name, categories)
+    if retrieval_filter is not None:
+        filters['filter'] = retrieval_filter
 
     return {
         'vectorSearchConfiguration': {
-            'numberOfResults': 10,
-            'overrideSearchType': 'SEMANTIC',
+            'numberOfResults': RETRIEVAL_NUMBER_OF_RESULTS,
+            'overrideSearchType': search_type,
             **filters,
         },
     }
 
-def generate_retrieval_config_without_filter():
+def generate_retrieval_config_without_filter(search_type: str = 'SEMANTIC'):
     """
     ベックロックにフィルター無しでデータを渡す設定を生成する関数.
     """
     return {
         'vectorSearchConfiguration': {
-            'numberOfResults': 10,
-            'overrideSearchType': 'SEMANTIC'
+            'numberOfResults': RETRIEVAL_NUMBER_OF_RESULTS,
+            'overrideSearchType': search_type
         },
     }
 
-def retrieve_documents_without_filter(search_text: str):
+def load_filter_catalog():
     """
-    ベックロックからデータを取得する関数.
+    検索対象のセクション・カテゴリを読み込む関数.
+    MasterDataの版数をFILTER_CATALOG_REFRESH_INTERVAL秒ごとに確認し、変わった場合のみ全件を読み込む.
+    読み込みに失敗した場合は前回の内容（未読み込みの場合は検証無し）で検索を続ける.
+    """
+    if not MASTERDATA_TABLE_NAME:
+        return
+
+    with filter_registry_lock:
+        now = time.monotonic()
+        if now - filter_registry_checked_at['value'] < FILTER_CATALOG_REFRESH_INTERVAL:
+            return
+        filter_registry_checked_at['value'] = now
+        try:
+            table = dynamodb.Table(MASTERDATA_TABLE_NAME)
+            if filter_registry.is_loaded and load_version_from_table(table) == filter_registry.version:
+                return
+            version, sections = load_sections_from_table(table)
+            filter_registry.load(sections, version)
+            logger.info("Loaded filter catalog", extra={'version': version, 'sections': len(sections)})
+        except Exception as e:
+            logger.warning(f"セクション・カテゴリの読み込みに失敗しました: {str(e)}")
+
+
+def get_knowledge_base_generation() -> str:
+    """
+    Knowledge Baseの世代番号を取得する関数.
+    最後に完了した取り込みジョブのIDを世代番号とし、再取り込みで検索結果キャッシュを無効化する.
+    取り込みジョブはINGESTION_CHECK_INTERVAL秒ごとにのみ確認する.
+    """
+    if not KNOWLEDGEBASE_DATA_SOURCE_ID:
+        return ''
+
+    with knowledge_base_generation_lock:
+        now = time.monotonic()
+        if now - knowledge_base_generation['checked_at'] < INGESTION_CHECK_INTERVAL:
+            return knowledge_base_generation['value']
+        try:
+            jobs = bedrock_agent.list_ingestion_jobs(
+                knowledgeBaseId=KNOWLEDGEBASE_ID,
+                dataSourceId=KNOWLEDGEBASE_DATA_SOURCE_ID,
+                filters=[{'attribute': 'STATUS', 'operator': 'EQ', 'values': ['COMPLETE']}],
+                sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+                maxResults=1,
+            ).get('ingestionJobSummaries', [])
+            knowledge_base_generation['value'] = jobs[0]['ingestionJobId'] if jobs else ''
+        except ClientError as e:
+            logger.warning(f"取り込みジョブの取得に失敗しました: {str(e)}")
+        knowledge_base_generation['checked_at'] = now
+        return knowledge_base_generation['value']
+
+def create_answer_cache():
+    """
+    設定に応じて検索結果キャッシュを生成する関数.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    # Ingestion・DocumentUploadによるセクション単位の無効化はDynamoDBのテーブルにのみ反映されるため、
+    # それ以外のバックエンドでは取り込みジョブの完了（Knowledge Baseの世代番号）で無効化する
+    if ANSWER_CACHE_BACKEND != 'dynamodb' and not KNOWLEDGEBASE_DATA_SOURCE_ID:
+        raise RuntimeError("検索結果キャッシュを無効化できません（ANSWER_CACHE_BACKEND=dynamodb、"
+                           "またはKNOWLEDGEBASE_DATA_SOURCE_IDを設定してください）")
+    if ANSWER_CACHE_BACKEND == 'dynamodb':
+        if not ANSWER_CACHE_TABLE_NAME:
+            raise RuntimeError("ANSWER_CACHE_TABLE_NAMEが設定されていません")
+        backend = DynamoDBCacheBackend(boto3.client('dynamodb', region_name=AWS_REGION), ANSWER_CACHE_TABLE_NAME)
+    elif ANSWER_CACHE_BACKEND == 'redis':
+        # redisは使用する場合のみimportする
+        import redis
+        backend = RedisCacheBackend(redis.Redis.from_url(ANSWER_CACHE_REDIS_URL))
+    else:
+        backend = InMemoryCacheBackend(max_size=ANSWER_CACHE_MAX_SIZE)
+    return AnswerCache(
+        backend,
+        ttl=ANSWER_CACHE_TTL,
+        embed=embed_text if ANSWER_CACHE_SEMANTIC else None,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        knowledge_base_generation=get_knowledge_base_generation,
+    )
+
+# ウォームスタート間で共有する検索結果キャッシュ
+answer_cache = create_answer_cache()
+
+@timing.timed('retrieve')
+def query_knowledge_base(retrieve_config: dict, search_text: str) -> list:
+    """
+    Knowledge Baseに検索を実行する関数.
     """
-    retrieve_config = generate_retrieval_config_without_filter()
     return bedrock_agent_runtime.retrieve(
         knowledgeBaseId=KNOWLEDGEBASE_ID,
         retrievalConfiguration=retrieve_config,
         retrievalQuery={'text': search_text},
     ).get('retrievalResults', [])
 
+def retrieve(retrieve_config: dict, search_text: str) -> list:
+    """
+    ベックロックからデータを取得する関数.
+    同じ検索テキスト・検索設定の結果はキャッシュから返す.
+    """
+    if retrieval_cache is None:
+        return query_knowledge_base(retrieve_config, search_text)
+
+    cache_key = (
+        KNOWLEDGEBASE_ID,
+        get_knowledge_base_generation(),
+        search_text,
+        json.dumps(retrieve_config['vectorSearchConfiguration'], sort_keys=True, ensure_ascii=False),
+    )
+    documents = retrieval_cache.get(cache_key)
+    if documents is None:
+        documents = query_knowledge_base(retrieve_config, search_text)
+        retrieval_cache.set(cache_key, documents)
+    return documents
+
+def retrieve_documents_without_filter(search_text: str):
+    """
+    ベックロックからデータを取得する関数.
+    """
+    return retrieve_by_engine(search_text, generate_retrieval_config_without_filter)
+
 
 def retrieve_documents(search_text: str, section_name: str, categories: list):
     """
     ベックロックからフィルター有りでデータを取得する関数.
     """
-    retrieve_config = generate_retrieve_config(section_name, categories)
-    return bedrock_agent_runtime.retrieve(
-        knowledgeBaseId=KNOWLEDGEBASE_ID,
-        retrievalConfiguration=retrieve_config,
-        retrievalQuery={'text': search_text},
-    ).get('retrievalResults', [])
+    return retrieve_by_engine(search_text, functools.partial(generate_retrieve_config, section_name, categories))
+
+
+def retrieve_by_engine(search_text: str, generate_config) -> list:
+    """
+    RETRIEVAL_ENGINEに応じてベックロックからデータを取得する関数.
+
+    Args:
+        search_text (str): 検索テキスト
+        generate_config (Callable): 検索タイプを受け取り、検索設定を返す関数
+    """
+    if RETRIEVAL_ENGINE != 'fusion':
+        return retrieve(generate_config(), search_text)
+    return retrieve_fused(search_text, generate_config)
+
+
+@timing.timed('rewrite')
+def rewrite_query(search_text: str, count: int) -> list:
+    """
+    検索テキストを同じ意味の別の表現に書き換える関数.
+    書き換えに失敗した場合は空のリストを返す.
+    """
+    prompt = (
+        "次の検索クエリを、同じ意味の別の表現に{0}通り書き換えてください。"
+        "社内ドキュメントの検索に使用します。1行に1つ、書き換えたクエリのみを出力してください。\n"
+        "<検索クエリ>{1}</検索クエリ>"
+    ).format(count, search_text)
+    try:
+        response = bedrock_runtime.invoke_model(
+            modelId=QUERY_REWRITE_MODEL_ID,
+            accept="application/json",
+            body=json.dumps({
+                "anthropic_version": ANTHROPIC_VERSION,
+                "max_tokens": 300,
+                "messages": [{"role": "user", "content": prompt}],
+            }),
+            contentType="application/json",
+        )
+        text = json.loads(response.get('body').read()).get('content')[0].get('text')
+    except Exception as e:
+        logger.warning(f"検索クエリの書き換えに失敗しました: {str(e)}")
+        return []
+
+    rewrites = []
+    for line in text.splitlines():
+        query = line.strip().lstrip('-・*0123456789.)） ').strip()
+        if query and query != search_text and query not in rewrites:
+            rewrites.append(query)
+    return rewrites[:count]
+
+
+def retrieve_leg(search_text: str, search_type: str, generate_config) -> dict:
+    """
+    fusionの検索を1つ実行し、結果と所要時間を返す関数.
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        documents = retrieve(generate_config(search_type), search_text)
+    except Exception as e:
+        documents, error = [], e
+    return {
+        'search_text': search_text,
+        'search_type': search_type,
+        'documents': documents,
+        'error': error,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def get_document_key(document: dict) -> tuple:
+    """
+    同じドキュメントのチャンクを判定するキー（S3 URIとページ番号）を取得する関数.
+    ページ番号が無い場合は、同じS3 URIの別のチャンクを区別するためテキストを含める.
+    """
+    metadata = document.get('metadata', {})
+    page = metadata.get('x-amz-bedrock-kb-document-page-number')
+    if page is None:
+        page = document.get('content', {}).get('text', '')
+    return metadata.get('x-amz-bedrock-kb-source-uri', ''), page
+
+
+def retrieve_fused(search_text: str, generate_config) -> list:
+    """
+    検索タイプごとの検索と書き換えたクエリでの検索を並列に実行し、
+    Reciprocal Rank Fusionで統合する関数.
+    書き換えたクエリの検索は、書き換えの完了を待たずに開始した元のクエリの検索と並行して実行する.
+    """
+    search_types = RETRIEVAL_SEARCH_TYPES or ['SEMANTIC']
+    with ThreadPoolExecutor(max_workers=max(1, RETRIEVAL_FANOUT)) as executor:
+        futures = [
+            timing.submit(executor, retrieve_leg, search_text, search_type, generate_config)
+            for search_type in search_types
+        ]
+        if QUERY_REWRITE_COUNT > 0:
+            futures += [
+                timing.submit(executor, retrieve_leg, rewritten_text, search_types[-1], generate_config)
+                for rewritten_text in rewrite_query(search_text, QUERY_REWRITE_COUNT)
+            ]
+        legs = [future.result() for future in futures]
+
+    for leg in legs:
+        logger.info("Retrieval leg", extra={
+            'search_type': leg['search_type'],
+            'rewritten': leg['search_text'] != search_text,
+            'results': len(leg['documents']),
+            'elapsed_ms': leg['elapsed_ms'],
+            'error': str(leg['error']) if leg['error'] else None,
+        })
+    succeeded = [leg for leg in legs if leg['error'] is None]
+    if not succeeded:
+        raise legs[0]['error']
+
+    fused = reciprocal_rank_fusion(
+        [leg['documents'] for leg in succeeded],
+        key=get_document_key,
+        k=RRF_CONSTANT,
+        top_k=RETRIEVAL_NUMBER_OF_RESULTS,
+    )
+    return [document for _, document in fused]
 
 
 def get_highest_score_text(documents):
@@ -158,31 +516,60 @@ def get_highest_score_text(documents):
 def create_response(data: List[Dict[str, Any]]) -> dict:
     """
     レスポンスを作成する関数.
+    SERVER_TIMING_ENABLEDの場合は、処理ごとの所要時間をServer-Timingヘッダーに設定する.
     """
+    headers = {}
+    timings = timing.current()
+    if SERVER_TIMING_ENABLED and timings.enabled:
+        headers['Server-Timing'] = timings.server_timing()
+        headers['Timing-Allow-Origin'] = ALLOW_ORIGINS
     return Response(
         status_code = HTTPStatus.OK,
         content_type = content_types.APPLICATION_JSON,
         body = json.dumps({
             "results": data,
             "total": len(data),
-        })
+        }),
+        headers = headers,
     )
 
+@timing.timed('sign')
 def get_presigned_url(s3_uri: str):
     """
     プレサインURLを取得する関数.
+    有効期限の PRESIGNED_URL_SAFETY_MARGIN 秒前までは、発行済みのURLをキャッシュから返す.
     """
+    presigned_url = presigned_url_cache.get(s3_uri)
+    if presigned_url is not None:
+        return presigned_url
+
     bucket = s3_uri.split('/')[2]
     key = '/'.join(s3_uri.split('/')[3:])
-    return s3_client.generate_presigned_url(
-        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=3600)
+    presigned_url = s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=PRESIGNED_URL_EXPIRES_IN)
+    presigned_url_cache.set(s3_uri, presigned_url)
+    return presigned_url
+
 
+def generate_system_prompt(documents: str):
+    """
+    システムプロンプトを生成する関数.
+    共通の指示を先頭に置き、プロンプトキャッシュが有効な場合はキャッシュ対象として指定する.
+    """
+    documents_prompt = MESSAGE_DOCUMENTS.format(documents)
+    if not PROMPT_CACHE_ENABLED:
+        return MESSAGE_INSTRUCTIONS + documents_prompt
+    return [
+        {'type': 'text', 'text': MESSAGE_INSTRUCTIONS, 'cache_control': {'type': 'ephemeral'}},
+        {'type': 'text', 'text': documents_prompt},
+    ]
 
+@timing.timed('prompt_build')
 def generate_summary_prompt(documents: list, search_text: str):
     """
     要約のプロンプトを生成する関数.
     """
-    query = MESSAGE_HEADER + documents + MESSAGE_FOOTER
+    query = generate_system_prompt(documents)
 
     message = [
         {
@@ -205,16 +592,25 @@ def generate_summary(documents: list, search_text: str):
     """
     検索結果の要約を生成する関数.
     """
-    response = bedrock_runtime.invoke_model(
-        modelId=MODEL_VERSION,
-        accept="application/json",
-        body=json.dumps(generate_summary_prompt(documents, search_text)),
-        contentType="application/json",
-    )
+    request_body = json.dumps(generate_summary_prompt(documents, search_text))
+    with timing.span('generate'):
+        response = bedrock_runtime.invoke_model(
+            modelId=MODEL_VERSION,
+            accept="application/json",
+            body=request_body,
+            contentType="application/json",
+        )
     response_body = json.loads(response.get('body').read())
+    usage = response_body.get('usage', {})
+    logger.info("Model usage", extra={
+        'input_tokens': usage.get('input_tokens', 0),
+        'output_tokens': usage.get('output_tokens', 0),
+        'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0),
+        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
+    })
     return response_body.get('content')[0].get('text')
 
-def generate_retrieval_result(retrieved_results: list, search_text: str, section_name: str, categories: list):
+def generate_retrieval_result(search_text: str, section_name: str, categories: list) -> dict:
     """
     検索結果を生成する関数.
     """
@@ -222,16 +618,113 @@ def generate_retrieval_result(retrieved_results: list, search_text: str, section
         documents = retrieve_documents(search_text, section_name, categories)
     else:
         documents = retrieve_documents_without_filter(search_text)
+    documents = rerank_documents(search_text, documents)
     formatted_documents = format_documents(documents)
-    result_message = generate_summary(json.dumps(formatted_documents), search_text)
+    with timing.span('pack'):
+        packed_documents, packing_stats = pack_documents(
+            formatted_documents,
+            CONTEXT_TOKEN_BUDGET,
+            get_text=lambda document: document['Content'],
+            # 取得した順（Knowledge Baseのスコア順、fusionで統合した順位、またはリランク後の順位）に採用する
+            get_score=lambda document: -document['id'],
+            overlap_threshold=CONTEXT_OVERLAP_THRESHOLD,
+        )
+    logger.info("Context packing", extra={'section_name': section_name, **packing_stats})
+    result_message = generate_summary(json.dumps(packed_documents, ensure_ascii=False), search_text)
     highest_score_text = get_highest_score_text(documents)
-    retrieved_results.append({
+    return {
         'section_name': section_name,
         'categories': categories,
         'documents': formatted_documents,
         'highest_score_text': highest_score_text,
         'result_message': result_message
-    })
+    }
+
+
+def refresh_document_urls(result: dict) -> dict:
+    """
+    キャッシュした検索結果のプレサインURLを再発行する関数.
+    """
+    for document in result.get('documents', []):
+        s3_uri = document.get('DocumentTitle', '')
+        if s3_uri.startswith('s3://'):
+            document['DocumentUrl'] = get_presigned_url(s3_uri)
+    return result
+
+def create_unknown_filter_result(section_name: str, categories: list) -> dict:
+    """
+    存在しないセクション・カテゴリが指定された場合の検索結果を作成する関数.
+    """
+    return {
+        'section_name': section_name,
+        'categories': categories,
+        'documents': [],
+        'highest_score_text': '',
+        'result_message': '指定されたセクション・カテゴリは登録されていません。'
+    }
+
+def get_retrieval_result(search_text: str, section_name: str, categories: list) -> dict:
+    """
+    キャッシュを利用して検索結果を取得する関数.
+    キャッシュに存在しない場合は検索・要約を行い、結果をキャッシュする.
+    """
+    if section_name and categories:
+        try:
+            filter_registry.validate(section_name, categories)
+        except UnknownFilterError as e:
+            logger.warning(str(e))
+            return create_unknown_filter_result(section_name, categories)
+
+    if answer_cache is None:
+        return generate_retrieval_result(search_text, section_name, categories)
+
+    try:
+        cached_result = answer_cache.get(search_text, section_name, categories)
+    except Exception as e:
+        logger.warning(f"検索結果キャッシュの取得に失敗しました: {str(e)}")
+        cached_result = None
+    if cached_result is not None:
+        return refresh_document_urls(cached_result)
+
+    result = generate_retrieval_result(search_text, section_name, categories)
+    try:
+        answer_cache.set(search_text, section_name, categories, result)
+    except Exception as e:
+        logger.warning(f"検索結果キャッシュの保存に失敗しました: {str(e)}")
+    return result
+
+
+def generate_retrieval_results(search_text: str, targets: list) -> list:
+    """
+    検索対象ごとの検索結果を並列に生成する関数.
+    結果の順序はtargetsの順序と同じになる.
+
+    Args:
+        search_text (str): 検索テキスト
+        targets (list): (section_name, categories) のリスト
+
+    Returns:
+        list: 検索対象ごとの検索結果
+    """
+    max_workers = min(MAX_PARALLEL_SEARCHES, len(targets))
+    if max_workers <= 1:
+        return [
+            get_retrieval_result(search_text, section_name, categories)
+            for section_name, categories in targets
+        ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            timing.submit(executor, get_retrieval_result, search_text, section_name, categories)
+            for section_name, categories in targets
+        ]
+        return [future.result() for future in futures]
+
+
+# コールドスタート時に検索対象のセクション・カテゴリを読み込む
+if FILTER_CATALOG_PATH:
+    filter_registry.load(load_sections_from_file(FILTER_CATALOG_PATH))
+load_filter_catalog()
 
 
 @app.post('/knowledgebase/search')
@@ -241,7 +734,6 @@ def search_rag():
     入力からRAG検索する関数.
     """
     # data mapping
-    retrieved_results = []
     request_body: dict = app.current_event.json_body
 
     search_text = request_body.get('search_text', '')
@@ -251,21 +743,36 @@ def search_rag():
     if search_target :
         # search_targetが配列かどうかをチェック
         if isinstance(search_target, list):
-            # 配列の場合、従来通りfor文で処理
-            for target in search_target:
-                section_name = target.get('section_name', '')
-                categories = target.get('category', [])
-                generate_retrieval_result(retrieved_results, search_text, section_name, categories)
+            # 配列の場合、検索対象ごとに並列で処理
+            targets = [
+                (target.get('section_name', ''), target.get('category', []))
+                for target in search_target
+            ]
         else:
-            # オブジェクトの場合、for文を使わずに処理
-            section_name = search_target.get('section_name', '')
-            categories = search_target.get('category', [])
-            generate_retrieval_result(retrieved_results, search_text, section_name, categories)
+            # オブジェクトの場合、単一の検索対象として処理
+            targets = [(search_target.get('section_name', ''), search_target.get('category', []))]
 
     else:
-        generate_retrieval_result(retrieved_results, search_text, '', [])
+        targets = [('', [])]
+
+    load_filter_catalog()
+    if UNKNOWN_FILTER_ACTION == 'reject':
+        for section_name, categories in targets:
+            if section_name and categories:
+                try:
+                    filter_registry.validate(section_name, categories)
+                except UnknownFilterError as e:
+                    raise BadRequestError(str(e))
+
+    try:
+        retrieved_results = generate_retrieval_results(search_text, targets)
+    except UnknownFilterError as e:
+        # 検証の後にセクション・カテゴリが更新された場合は、検索フィルターの組み立てで検出される
+        raise BadRequestError(str(e))
 
     logger.info(f"Retrieved results: {retrieved_results}")
+    if retrieval_cache is not None:
+        logger.info("Retrieval cache stats", extra=retrieval_cache.stats())
 
     return create_response(retrieved_results)
 
@@ -282,4 +789,8 @@ def lambda_handler(event, context: LambdaContext) -> dict:
         dict: レスポンス
     """
     logger.info(f"Received event: {event}")
-    return app.resolve(event, context)
+    timings = timing.start(TIMING_ENABLED or SERVER_TIMING_ENABLED)
+    response = app.resolve(event, context)
+    if timings.enabled:
+        logger.info("Request timing", extra=timings.as_log_fields())
+    return response
@@ -1,8 +1,15 @@
 """Generateに関連する機能を提供するLambda関数."""
+import asyncio
+import functools
 import json
 import os
+import queue
 import re
-from typing import Any, Generator
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Generator, Union
 
 import boto3
 import uvicorn
@@ -11,6 +18,9 @@ from fastapi import FastAPI, Request
 from fastapi.responses import StreamingResponse
 from langfuse.decorators import langfuse_context, observe
 
+# lambda_layerの共通モジュール（DockerfileでイメージにコピーされるSearchと同じ実装）
+from context_packing import pack_documents
+
 logger = Logger()
 
 # 環境変数の設定
@@ -20,14 +30,33 @@ ANTHROPIC_VERSION = os.environ.get('ANTHROPIC_VERSION')
 SERVER_HOST = os.environ.get('SERVER_HOST', '127.0.0.1')    # サーバーホストの設定を追加
 SERVER_PORT = int(os.environ.get('SERVER_PORT', '8080'))
 ALLOW_ORIGIN = os.getenv('ALLOW_ORIGIN', '*')  # デフォルト値を '*' に設定
+# 全セクションのモデル呼び出しを同時に開始し、結果を多重化して返すかどうか
+PARALLEL_SECTION_STREAM = os.environ.get('PARALLEL_SECTION_STREAM', 'False') == 'True'
+MAX_PARALLEL_STREAMS = int(os.environ.get('MAX_PARALLEL_STREAMS', '5'))
+# モデルのストリームを読み出すスレッド数の上限（プロセス全体）
+MAX_STREAM_WORKERS = int(os.environ.get('MAX_STREAM_WORKERS', '64'))
+# プロンプトに含めるドキュメントのトークン数の上限（0以下の場合は上限なし）と、重複とみなす割合
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '8000'))
+CONTEXT_OVERLAP_THRESHOLD = float(os.environ.get('CONTEXT_OVERLAP_THRESHOLD', '0.8'))
+# プロバイダー側のプロンプトキャッシュ（共通の指示部分）を使用するかどうか
+PROMPT_CACHE_ENABLED = os.environ.get('PROMPT_CACHE_ENABLED', 'False') == 'True'
+# キャッシュした署名付きURLを再発行するまでの余裕（秒）と、キャッシュの最大件数
+SIGNED_URL_SAFETY_MARGIN = int(os.environ.get('SIGNED_URL_SAFETY_MARGIN', '300'))
+SIGNED_URL_CACHE_MAX_SIZE = int(os.environ.get('SIGNED_URL_CACHE_MAX_SIZE', '1024'))
+# 処理ごとの所要時間（最初のトークンまでの時間・トークン/秒など）を構造化ログに出力するかどうか
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', 'False') == 'True'
 
 # AWSクライアントの初期化
 bedrock_runtime = boto3.client('bedrock-runtime')
 s3_client = boto3.client('s3', region_name=MODEL_REGION)
 
+# boto3のEventStreamは同期的なため、イベントループをブロックしないよう別スレッドで読み出す
+stream_executor = ThreadPoolExecutor(max_workers=MAX_STREAM_WORKERS, thread_name_prefix='model-stream')
+
 app = FastAPI()
 
-MESSAGE_HEADER = """
+# 全リクエストで共通の指示（プロンプトキャッシュの対象となるよう、可変のドキュメントより前に配置する）
+MESSAGE_INSTRUCTIONS = """
 あなたは社内ユーザーからの質問を応えるAIアシスタントです。
 以下の手順で社員の質問に答えてください。手順以外のことは絶対にしないでください。
 
@@ -48,10 +77,6 @@ MESSAGE_HEADER = """
 }
 </参考ドキュメントのJSON形式>
 
-<参考ドキュメント>
-"""
-MESSAGE_FOOTER = """
-</参考ドキュメント>
 
 <回答のルール>
 * 雑談や挨拶には応じないでください。「私は雑談はできません。通常のチャット機能をご利用ください。」とだけ出力してください。他の文言は一切出力しないでください。例外はありません。
@@ -63,6 +88,33 @@ MESSAGE_FOOTER = """
 </回答のルール>
 """
 
+# リクエストごとに変わる参考ドキュメント
+MESSAGE_DOCUMENTS = """
+<参考ドキュメント>
+{0}
+</参考ドキュメント>
+"""
+
+def generate_system_prompt(documents: str):
+    """システムプロンプトを生成します.
+
+    共通の指示を先頭に置き、プロンプトキャッシュが有効な場合はキャッシュ対象として指定します.
+
+    Args:
+        documents (str): 検索対象ドキュメントです.
+
+    Returns:
+        str | list: システムプロンプトです.
+    """
+    documents_prompt = MESSAGE_DOCUMENTS.format(documents)
+    if not PROMPT_CACHE_ENABLED:
+        return MESSAGE_INSTRUCTIONS + documents_prompt
+    return [
+        {'type': 'text', 'text': MESSAGE_INSTRUCTIONS, 'cache_control': {'type': 'ephemeral'}},
+        {'type': 'text', 'text': documents_prompt},
+    ]
+
+
 def generate_payload_for_bedrock_runtime(documents: str, search_text: str):
     """bedrock-runtime検索用の設定情報と文字列を生成します.
 
@@ -73,7 +125,7 @@ def generate_payload_for_bedrock_runtime(documents: str, search_text: str):
     Returns:
         dict: 生成された設定情報です.
     """
-    query = MESSAGE_HEADER + documents + MESSAGE_FOOTER
+    query = generate_system_prompt(documents)
 
     messages = [
         {'role': 'user', 'content': [{'type': 'text', 'text': search_text}]},
@@ -86,9 +138,66 @@ def generate_payload_for_bedrock_runtime(documents: str, search_text: str):
     }
 
 
+class SignedUrlCache:
+    """署名付きURLのLRUキャッシュです.
+
+    有効期限の SIGNED_URL_SAFETY_MARGIN 秒前までは発行済みのURLを再利用します.
+    モジュールスコープで保持し、ウォームスタート間・リクエスト間で共有します.
+    """
+
+    def __init__(self, max_size: int, safety_margin: int):
+        self.max_size = max_size
+        self.safety_margin = safety_margin
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, s3_uri: str, expiration: int):
+        """キャッシュから署名付きURLを取得します.
+
+        Args:
+            s3_uri (str): S3のURIです.
+            expiration (int): 署名付きURLの有効期限です.
+
+        Returns:
+            str: 署名付きURLです. 存在しないか再発行が必要な場合はNoneです.
+        """
+        key = (s3_uri, expiration)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, s3_uri: str, expiration: int, signed_url: str):
+        """署名付きURLをキャッシュに設定します.
+
+        Args:
+            s3_uri (str): S3のURIです.
+            expiration (int): 署名付きURLの有効期限です.
+            signed_url (str): 署名付きURLです.
+        """
+        reuse_until = time.monotonic() + expiration - self.safety_margin
+        with self._lock:
+            self._entries[(s3_uri, expiration)] = (reuse_until, signed_url)
+            self._entries.move_to_end((s3_uri, expiration))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+signed_url_cache = SignedUrlCache(SIGNED_URL_CACHE_MAX_SIZE, SIGNED_URL_SAFETY_MARGIN)
+
+
 def generate_signed_url(s3_uri, expiration=3600):
     """指定されたS3 URIに基づき署名付きURLを生成します.
 
+    同じS3 URIの署名付きURLは、有効期限が近づくまでキャッシュから返します.
+
     Args:
         s3_uri (str): S3のURI（例: s3://bucket-name/key）です.
         expiration (int): 署名付きURLの有効期限です.
@@ -96,109 +205,356 @@ def generate_signed_url(s3_uri, expiration=3600):
     Returns:
         str: 署名付きURLです.
     """
+    signed_url = signed_url_cache.get(s3_uri, expiration)
+    if signed_url is not None:
+        return signed_url
+
     bucket_name, key = s3_uri.replace('s3://', '').split('/', 1)
-    return s3_client.generate_presigned_url(
+    signed_url = s3_client.generate_presigned_url(
         'get_object',
         Params={'Bucket': bucket_name, 'Key': key},
         ExpiresIn=expiration,
     )
+    signed_url_cache.set(s3_uri, expiration, signed_url)
+    return signed_url
 
 
-def format_documents_for_result(documents: list) -> list:
-    """結果返却のためにドキュメントを整形します.
+def format_document_for_result(doc: dict) -> dict:
+    """結果返却のために1件のドキュメントを整形します.
 
     Args:
-        documents (list): 検索で取得したドキュメントのリストです.
+        doc (dict): 検索で取得したドキュメントです.
 
     Returns:
-        list: 整形されたドキュメントのリストです.
+        dict: 整形されたドキュメントです.
     """
-    formatted_docs = []
-    url_data = {}  # S3 URIごとのデータを管理する辞書
-    for doc in documents:
-        s3_uri = doc['location']['s3Location']['uri']
-        page_number = doc['metadata'].get('x-amz-bedrock-kb-document-page-number', 1)
-
-        # URLデータが初めての場合は初期化
-        if s3_uri not in url_data:
-            url_data[s3_uri] = {
-                'signedUrl': generate_signed_url(s3_uri),
-                'pageNumbers': set(),  # ページ番号を集合で管理
-            }
-
-        # ページ番号が未登録の場合のみ処理
-        if page_number not in url_data[s3_uri]['pageNumbers']:
-            formatted_docs.append({
-                'documentUrl': url_data[s3_uri]['signedUrl'],
-                'pageNumber': page_number,
-                'score': doc.get('score', 0),
-            })
-            url_data[s3_uri]['pageNumbers'].add(page_number)  # ページ番号を登録
-    return formatted_docs
+    return {
+        'documentUrl': generate_signed_url(doc['location']['s3Location']['uri']),
+        'pageNumber': doc['metadata'].get('x-amz-bedrock-kb-document-page-number', 1),
+        'score': doc.get('score', 0),
+    }
 
 
 def format_documents_for_generate(retrieved_documents: list) -> list:
     """LLMモデルでGenereteのためにドキュメントを整形します.
 
+    スコアの高い順にCONTEXT_TOKEN_BUDGETの範囲内でドキュメントを採用し、
+    採用済みのドキュメントと大部分が重複するチャンクは除外します（Searchと同じcontext_packingを使用します）.
+    SourceIdは引用との対応付けのため、retrieved_documents内の位置を維持します.
+
     Args:
         retrieved_documents (list): Retrieveで取得したドキュメントのリストです.
 
     Returns:
         list: 整形されたドキュメントのリストです.
     """
-    formatted_docs = []
-    for idx, doc in enumerate(retrieved_documents):
-        formatted_docs.append({
+    packed_documents, stats = pack_documents(
+        list(enumerate(retrieved_documents)),
+        CONTEXT_TOKEN_BUDGET,
+        get_text=lambda item: item[1]['content'].get('text', ''),
+        get_score=lambda item: item[1].get('score', 0),
+        overlap_threshold=CONTEXT_OVERLAP_THRESHOLD,
+    )
+    logger.info('コンテキストのパッキング結果', extra=stats)
+    return [
+        {
             'SourceId': str(idx),
             'DocumentId': str(idx),
             'DocumentTitle': doc['metadata'].get('x-amz-bedrock-kb-source-uri', '未指定'),
             'DocumentPage': doc['metadata'].get('x-amz-bedrock-kb-document-page-number', '未指定'),
             'Content': doc['content'].get('text', ''),
-        })
-    return formatted_docs
+        }
+        for idx, doc in packed_documents
+    ]
 
 
-def process_model_response(response, section) -> Generator[str, Any, None]:
+class CitationTracker:
+    """モデルの出力から引用マーカー [^N] を逐次検出します.
+
+    マーカーがチャンクをまたいで分割された場合に備え、
+    マーカーの途中の可能性がある末尾の文字列のみを保持します.
+    """
+
+    CITATION_PATTERN = re.compile(r'\[\^(\d+)]')
+    PARTIAL_CITATION_PATTERN = re.compile(r'\[(\^\d*)?\Z')
+
+    def __init__(self):
+        self._pending = ''
+        self._cited = set()
+
+    def feed(self, text: str) -> list:
+        """出力テキストを追加し、新たに引用されたSourceIdを返します.
+
+        Args:
+            text (str): モデルの出力テキストです.
+
+        Returns:
+            list: 初めて引用されたSourceIdのリストです（出現順）.
+        """
+        buffer = self._pending + text
+        new_citations = []
+        last_end = 0
+        for match in self.CITATION_PATTERN.finditer(buffer):
+            last_end = match.end()
+            source_id = int(match.group(1))
+            if source_id not in self._cited:
+                self._cited.add(source_id)
+                new_citations.append(source_id)
+
+        tail = buffer[last_end:]
+        bracket = tail.rfind('[')
+        if bracket != -1 and self.PARTIAL_CITATION_PATTERN.match(tail, bracket):
+            self._pending = tail[bracket:]
+        else:
+            self._pending = ''
+        return new_citations
+
+
+def process_model_response(response, section, timings: Union[dict, None] = None) -> Generator[str, Any, None]:
     """モデルのレスポンスを処理します.
 
+    引用されたドキュメントは、出力中に初めて引用された時点でdocumentsとして返します.
+
     Args:
         response: bedrock-runtimeからのレスポンスです.
         section: 処理対象のセクションです.
+        timings (dict): 指定した場合、最初のトークンまでの時間とトークン/秒を計測してログに出力します.
+            モデル呼び出しを開始した時刻（invoked_at）とプロンプトの作成時間（prompt_build_ms）を含みます.
 
     Yields:
         str: ストリーミングデータです.
     """
-    current_response = ''
-    document_sent = False
+    citation_tracker = CitationTracker()
+    sent_pages = set()  # 返却済みの (S3 URI, ページ番号)
     section_name = section.get('sectionName', '')
     documents = section.get('documents', [])
+    first_token_at = last_token_at = None
+    text_deltas = output_tokens = 0
 
     for event in response.get('body'):
         chunk = json.loads(event['chunk']['bytes'].decode())
+        if chunk.get('type') == 'message_delta':
+            output_tokens = chunk.get('usage', {}).get('output_tokens', output_tokens)
+        if chunk.get('type') == 'message_start':
+            usage = chunk.get('message', {}).get('usage', {})
+            logger.info('モデルの使用トークン数', extra={
+                'sectionName': section_name,
+                'input_tokens': usage.get('input_tokens', 0),
+                'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0),
+                'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
+            })
         if chunk.get('type') == 'content_block_delta':
             delta = chunk.get('delta', {})
             if delta.get('type') == 'text_delta':
+                if timings is not None:
+                    last_token_at = time.perf_counter()
+                    first_token_at = first_token_at or last_token_at
+                    text_deltas += 1
                 chunk_text = delta.get('text', '')
-                current_response += chunk_text
                 yield json.dumps({
                     'type': 'resultText',
                     'sectionName': section_name,
                     'content': chunk_text,
                 })
 
-    # 引用ドキュメントの処理
-    if not document_sent:
-        cited_docs = re.findall(r'\[\^(\d+)]', current_response)
-        if cited_docs:
-            result_docs = format_documents_for_result(documents)
-            yield from (
-                json.dumps({
-                    'type': 'documents',
-                    'sectionName': section_name,
-                    'content': doc,
-                })
-                for doc in result_docs
-            )
+                # 引用ドキュメントの処理
+                for source_id in citation_tracker.feed(chunk_text):
+                    if source_id >= len(documents):
+                        continue
+                    document = documents[source_id]
+                    page = (
+                        document['location']['s3Location']['uri'],
+                        document['metadata'].get('x-amz-bedrock-kb-document-page-number', 1),
+                    )
+                    if page in sent_pages:
+                        continue
+                    sent_pages.add(page)
+                    yield json.dumps({
+                        'type': 'documents',
+                        'sectionName': section_name,
+                        'content': format_document_for_result(document),
+                    })
+
+    if timings is not None and first_token_at is not None:
+        # usageが無い場合はテキストの差分の数をトークン数とみなす
+        tokens = output_tokens or text_deltas
+        generation_seconds = last_token_at - first_token_at
+        logger.info('セクションのストリームの所要時間', extra={
+            'sectionName': section_name,
+            'prompt_build_ms': timings['prompt_build_ms'],
+            'ttft_ms': round((first_token_at - timings['invoked_at']) * 1000, 1),
+            'generation_ms': round(generation_seconds * 1000, 1),
+            'output_tokens': tokens,
+            'tokens_per_sec': round(tokens / generation_seconds, 1) if generation_seconds > 0 else None,
+        })
+
+
+def generate_section_stream(section: dict, search_text: str) -> Generator[str, Any, None]:
+    """1セクション分のモデル呼び出しを行い、レスポンスを返します.
+
+    Args:
+        section (dict): 処理対象のセクションです.
+        search_text (str): 検索テキストです.
+
+    Yields:
+        str: ストリーミングデータです.
+    """
+    documents = section.get('documents', [])
+    started = time.perf_counter() if TIMING_ENABLED else None
+
+    # ドキュメントの処理とモデル呼び出し
+    formatted_docs = format_documents_for_generate(documents)
+    request_body = generate_payload_for_bedrock_runtime(
+        json.dumps(formatted_docs, ensure_ascii=False),
+        search_text,
+    )
+
+    timings = None
+    if TIMING_ENABLED:
+        invoked_at = time.perf_counter()
+        timings = {'invoked_at': invoked_at, 'prompt_build_ms': round((invoked_at - started) * 1000, 1)}
+
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=MODEL_VERSION,
+        contentType='application/json',
+        accept='application/json',
+        body=json.dumps(request_body),
+    )
+
+    # レスポンスの処理（途中で読み出しを止めた場合もモデルのストリームを閉じる）
+    try:
+        yield from process_model_response(response, section, timings)
+    finally:
+        close = getattr(response.get('body'), 'close', None)
+        if close is not None:
+            close()
+
+
+def generate_sequential_stream(retrieved_results: list, search_text: str) -> Generator[str, Any, None]:
+    """セクションを1つずつ順番に処理します.
+
+    Args:
+        retrieved_results (list): 検索結果のリストです.
+        search_text (str): 検索テキストです.
+
+    Yields:
+        str: ストリーミングデータです.
+    """
+    for section in retrieved_results:
+        yield from generate_section_stream(section, search_text)
+
+
+# セクションのストリームの終了を表す番兵
+_SECTION_STREAM_END = object()
+
+
+def generate_parallel_stream(retrieved_results: list, search_text: str) -> Generator[str, Any, None]:
+    """全セクションのモデル呼び出しを同時に開始し、届いた順に多重化して返します.
+
+    セクションごとのデータの順序は保たれ、sectionNameで区別できます.
+    同時に呼び出すセクション数はMAX_PARALLEL_STREAMSで制限します.
+    クライアントの切断などで読み出しが止まった場合は、各セクションのストリームを次のデータで止め、
+    未開始のセクションは呼び出さずに、ストリームの終了を待たずに戻ります.
+
+    Args:
+        retrieved_results (list): 検索結果のリストです.
+        search_text (str): 検索テキストです.
+
+    Yields:
+        str: ストリーミングデータです.
+    """
+    chunk_queue = queue.Queue()
+    cancelled = threading.Event()
+
+    def produce(section: dict):
+        if cancelled.is_set():
+            return
+        try:
+            for chunk in generate_section_stream(section, search_text):
+                if cancelled.is_set():
+                    break
+                chunk_queue.put(chunk)
+        except Exception as ex:
+            logger.error('セクションのストリーム生成エラー: {0}'.format(str(ex)))
+            chunk_queue.put(json.dumps({
+                'type': 'error',
+                'sectionName': section.get('sectionName', ''),
+                'content': str(ex),
+            }))
+        finally:
+            chunk_queue.put(_SECTION_STREAM_END)
+
+    max_workers = max(1, min(MAX_PARALLEL_STREAMS, len(retrieved_results)))
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for section in retrieved_results:
+            executor.submit(produce, section)
+
+        remaining = len(retrieved_results)
+        while remaining:
+            chunk = chunk_queue.get()
+            if chunk is _SECTION_STREAM_END:
+                remaining -= 1
+                continue
+            yield chunk
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ストリームの終了を表す番兵
+_STREAM_END = object()
+
+
+async def iterate_in_thread(
+    generator_factory: Callable[[], Generator[str, Any, None]],
+) -> AsyncGenerator[str, None]:
+    """同期ジェネレーターを別スレッドで実行し、イベントループをブロックせずに結果を返します.
+
+    スレッドで取得したデータはasyncio.Queueを経由してイベントループに渡します.
+    呼び出し側が途中で読み出しを止めた場合、スレッド側も次のデータで処理を止めます.
+
+    Args:
+        generator_factory (Callable): 同期ジェネレーターを生成する関数です.
+
+    Yields:
+        str: ジェネレーターが返したデータです.
+    """
+    loop = asyncio.get_running_loop()
+    chunk_queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        if cancelled.is_set():
+            return
+        try:
+            loop.call_soon_threadsafe(chunk_queue.put_nowait, item)
+        except RuntimeError:
+            # イベントループが既に閉じられている場合は破棄する
+            cancelled.set()
+
+    def produce():
+        try:
+            for chunk in generator_factory():
+                if cancelled.is_set():
+                    break
+                put(chunk)
+        except Exception as ex:
+            put(ex)
+        finally:
+            put(_STREAM_END)
+
+    loop.run_in_executor(stream_executor, produce)
+    try:
+        while True:
+            chunk = await chunk_queue.get()
+            if chunk is _STREAM_END:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
 
 
 @observe()
@@ -213,27 +569,24 @@ async def generate_stream(retrieved_results: str, search_text: str):
         str: ストリーミングデータです.
     """
     try:
-        for section in retrieved_results:
-            documents = section.get('documents', [])
-
-            # ドキュメントの処理とモデル呼び出し
-            formatted_docs = format_documents_for_generate(documents)
-            request_body = generate_payload_for_bedrock_runtime(
-                json.dumps(formatted_docs, ensure_ascii=False),
-                search_text,
-            )
-
-            response = bedrock_runtime.invoke_model_with_response_stream(
-                modelId=MODEL_VERSION,
-                contentType='application/json',
-                accept='application/json',
-                body=json.dumps(request_body),
-            )
-
-            # レスポンスの処理
-            for model_response_chunk in process_model_response(response, section):
-                yield 'data: {0}\n\n'.format(model_response_chunk)
-        langfuse_context.flush()
+        if PARALLEL_SECTION_STREAM and len(retrieved_results) > 1:
+            generator_factory = functools.partial(generate_parallel_stream, retrieved_results, search_text)
+        else:
+            generator_factory = functools.partial(generate_sequential_stream, retrieved_results, search_text)
+
+        started = time.perf_counter()
+        first_chunk_ms = None
+        async for model_response_chunk in iterate_in_thread(generator_factory):
+            if TIMING_ENABLED and first_chunk_ms is None:
+                first_chunk_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield 'data: {0}\n\n'.format(model_response_chunk)
+        if TIMING_ENABLED:
+            logger.info('ストリームの所要時間', extra={
+                'sections': len(retrieved_results),
+                'first_chunk_ms': first_chunk_ms,
+                'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            })
+        await asyncio.to_thread(langfuse_context.flush)
 
     except Exception as ex:
         logger.error('ストリーム生成エラー: {0}'.format(str(ex)))
@@ -344,6 +697,10 @@ async def shutdown_event():
 def lambda_handler(event, context):
     """AWS Lambda関数のハンドラー.
 
+    Lambda Web Adapter（AWS_LWA_INVOKE_MODE=RESPONSE_STREAM）経由で起動した場合、
+    リクエストはFastAPIアプリケーションが処理し、チャンクは生成され次第返却されます.
+    本ハンドラーはWeb Adapterを使用せずに直接呼び出された場合のフォールバックです.
+
     Args:
         event: AWS Lambdaのイベントデータです.
         context: AWS Lambdaのコンテキストデータです.
@@ -390,15 +747,14 @@ def lambda_handler(event, context):
                     loop = asyncio.get_event_loop()
                     return loop.run_until_complete(coroutine)
 
-                # ストリーミングレスポンスのためのマルチパートレスポンス
-                response_body = ''
+                # レスポンスストリーミングに対応していない呼び出しのため、全チャンクをまとめて返す
+                # （Lambda Web Adapter経由の呼び出しはFastAPIのStreamingResponseで逐次返却される）
+                logger.warning('Lambda Web Adapterを使用していないため、ストリーミングせずに全チャンクをまとめて返します')
                 chunks = run_async(collect_stream_chunks(
                     body.get('retrievedResults', []),
                     body.get('searchText', ''),
                 ))
-
-                for chunk in chunks:
-                    response_body += chunk
+                response_body = ''.join(chunks)
 
                 return {
                     'statusCode': 200,
@@ -0,0 +1,217 @@
+"""DocumentUpload Lambdaの内容のハッシュによる重複排除のベンチマーク.
+
+同じPDFが複数のセクション・ファイル名でアップロードされる状況を再現し、
+重複排除しない場合と比べて取り込み対象（埋め込み・インデックス）になるドキュメントの数を比較する.
+重複排除したドキュメントが、アップロードした全てのセクション・カテゴリの検索フィルター
+（CONTENT_DEDUPE_ENABLED=True のSearchのフィルター）に一致することを確認する.
+あわせて、アップロード後にストリームで読み込んでハッシュを計算する場合のスループットと、
+ハッシュと異なる内容のアップロードが拒否されることを確認する.
+
+実行方法:
+    python benchmark/bench_content_dedupe.py
+"""
+import hashlib
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'AKIABENCHMARK')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+from stubs import FakeLambdaContext, FakeS3Client, build_api_gateway_event, load_lambda_module  # noqa: E402
+
+DISTINCT_DOCUMENTS = 20
+UPLOADS = 100
+SECTIONS = 5
+CATEGORIES = ('規程', '手順書', 'FAQ')
+DOCUMENT_SIZE = 256 * 1024
+STREAM_SIZE = 64 * 1024 * 1024
+SEED = 0
+
+
+def call(upload, path: str, body: dict, status_code: int = 200) -> dict:
+    """Lambdaのハンドラを呼び出し、レスポンスのボディを返す."""
+    response = upload.lambda_handler(build_api_gateway_event('POST', path, body), FakeLambdaContext())
+    assert response['statusCode'] == status_code, response
+    return json.loads(response['body'])
+
+
+def matches(retrieval_filter: dict, attributes: dict) -> bool:
+    """Knowledge Baseの検索フィルターがメタデータの属性に一致するかを評価する."""
+    operator, operand = next(iter(retrieval_filter.items()))
+    if operator == 'andAll':
+        return all(matches(condition, attributes) for condition in operand)
+    if operator == 'orAll':
+        return any(matches(condition, attributes) for condition in operand)
+    value = attributes.get(operand['key'])
+    if operator == 'equals':
+        return value == operand['value']
+    if operator == 'in':
+        return value in operand['value']
+    if operator == 'listContains':
+        return isinstance(value, list) and operand['value'] in value
+    raise ValueError(operator)
+
+
+def run_uploads(upload, documents: list, uploads: list) -> dict:
+    """クライアントでハッシュを計算してアップロードした場合の、保存したドキュメントの数を返す."""
+    started = time.perf_counter()
+    duplicates = 0
+    for document_index, file in uploads:
+        body = dict(file, contentHash=hashlib.sha256(documents[document_index]).hexdigest())
+        result = call(upload, '/document/presigned-url', body)
+        if result.get('duplicate'):
+            duplicates += 1
+            continue
+        # presigned URLへのPUTの代わりに、URLに含まれるチェックサムを指定して書き込む
+        checksum = None
+        if 'contentHash' in result:
+            assert 'x-amz-checksum-sha256=' in result['uploadUrl']
+            checksum = upload.to_checksum_sha256(result['contentHash'])
+        upload.s3_client.put_object(
+            Bucket=upload.BUCKET_NAME, Key=result['fileKey'], Body=documents[document_index], ChecksumSHA256=checksum)
+    elapsed = time.perf_counter() - started
+    stored = [key for _, key in upload.s3_client.objects if not key.endswith('.metadata.json')]
+    return {'uploads': len(uploads), 'duplicates': duplicates, 'documents_indexed': len(stored),
+            'ms_per_upload': round(elapsed / len(uploads) * 1000, 3)}
+
+
+def check_filters(upload, build_filter, documents: list, uploads: list) -> int:
+    """全てのアップロードが、そのセクション・カテゴリの検索フィルターで同じ内容の正規のキーに一致することを確認する.
+
+    Returns:
+        int: 共有されたドキュメントを対象にしないフィルターでは見つからないアップロードの数
+    """
+    contents = {key: body for (_, key), body in upload.s3_client.objects.items()}
+    unmatched_without_shared = 0
+    for document_index, file in uploads:
+        found = {}
+        for shared in (True, False):
+            retrieval_filter = build_filter(file['sectionName'], [file['categoryName']], shared)
+            found[shared] = [
+                key for key, body in contents.items()
+                if key.endswith('.metadata.json') and matches(retrieval_filter, json.loads(body)['metadataAttributes'])
+                and contents[key[:-len('.metadata.json')]] == documents[document_index]
+            ]
+        assert found[True], file
+        unmatched_without_shared += not found[False]
+    return unmatched_without_shared
+
+
+def count_members(retrieval_filter: dict) -> int:
+    """orAll・andAllの条件の数が2〜5であることを確認し、最大の条件の数を返す."""
+    operator, operand = next(iter(retrieval_filter.items()))
+    if operator not in ('orAll', 'andAll'):
+        return 0
+    assert 2 <= len(operand) <= 5, retrieval_filter
+    return max([len(operand), *map(count_members, operand)])
+
+
+def check_filter_limits(upload, build_filter) -> None:
+    """5つ以上のカテゴリを指定しても、orAll・andAllの条件が5つ以下で、全てのカテゴリに一致することを確認する."""
+    for count in (5, 6, 12, 30):
+        categories = ['category-{0}'.format(index) for index in range(count)]
+        for section_name in ('section-0', ''):
+            retrieval_filter = build_filter(section_name, categories, True)
+            count_members(retrieval_filter)
+            for category in categories:
+                attributes = {'section': 'section-x', 'category': 'other', 'sections': ['section-x', 'section-0'],
+                              'categories': ['other', category],
+                              'scopes': [upload.format_scope('section-0', category)]}
+                assert matches(retrieval_filter, attributes), (section_name, category)
+    print('filter limits: up to 30 categories with at most 5 members per orAll/andAll')
+
+
+def check_streamed(upload, documents: list) -> None:
+    """ハッシュを指定せずにアップロードしたドキュメントを、ストリームで読み込んで重複排除する."""
+    file = {'fileName': 'copy.pdf', 'contentType': 'application/pdf', 'sectionName': 'section-new',
+            'categoryName': '規程'}
+    result = call(upload, '/document/presigned-urls', {'files': [file]})['results'][0]
+    upload.s3_client.put_object(Bucket=upload.BUCKET_NAME, Key=result['fileKey'], Body=documents[0])
+    deduplicated = call(upload, '/document/content-hash', {'fileKey': result['fileKey']})
+    assert deduplicated['duplicate'] and deduplicated['fileKey'] != result['fileKey']
+    assert (upload.BUCKET_NAME, result['fileKey']) not in upload.s3_client.objects
+    metadata = json.loads(upload.s3_client.objects[(upload.BUCKET_NAME, deduplicated['fileKey'] + '.metadata.json')])
+    assert upload.format_scope('section-new', '規程') in metadata['metadataAttributes']['scopes'], metadata
+
+    # 大きなファイルのハッシュの計算のスループット
+    key = 'docs/section-new/large.pdf'
+    upload.s3_client.put_object(Bucket=upload.BUCKET_NAME, Key=key, Body=os.urandom(STREAM_SIZE))
+    upload.s3_client.put_object(Bucket=upload.BUCKET_NAME, Key=key + '.metadata.json',
+                                Body=upload.create_metadata_body('section-new', '規程'))
+    started = time.perf_counter()
+    assert not call(upload, '/document/content-hash', {'fileKey': key})['duplicate']
+    elapsed = time.perf_counter() - started
+    print('streamed hash: {0}MB in {1:.3f}s ({2:.0f} MB/s), duplicate moved to {3}'.format(
+        STREAM_SIZE // (1024 * 1024), elapsed, STREAM_SIZE / (1024 * 1024) / elapsed, deduplicated['fileKey']))
+
+
+def check_metadata_attributes(upload) -> None:
+    """/を含むセクション名・カテゴリ名もそのまま属性に設定され、スコープが1つの場合はリストの属性を設定しないことを確認する."""
+    attributes = json.loads(upload.create_metadata_body('人事/総務', '就業規則'))['metadataAttributes']
+    assert (attributes['section'], attributes['category']) == ('人事/総務', '就業規則'), attributes
+    assert 'scopes' not in attributes and 'sections' not in attributes, attributes
+    scopes = [upload.format_scope('人事/総務', '就業規則'), upload.format_scope('経理', '規程/手順')]
+    attributes = json.loads(upload.create_metadata_body('人事/総務', '就業規則', scopes))['metadataAttributes']
+    assert attributes['sections'] == ['人事/総務', '経理'] and attributes['categories'] == ['就業規則', '規程/手順']
+    assert upload.parse_scope(attributes['scopes'][1]) == ('経理', '規程/手順'), attributes
+
+
+def check_tampered(upload, documents: list) -> None:
+    """ハッシュと異なる内容のアップロードが拒否されることを確認する."""
+    file = {'fileName': 'tampered.pdf', 'contentType': 'application/pdf', 'sectionName': 'section-0',
+            'categoryName': '規程', 'contentHash': hashlib.sha256(b'declared content').hexdigest()}
+    result = call(upload, '/document/presigned-url', file)
+    try:
+        upload.s3_client.put_object(Bucket=upload.BUCKET_NAME, Key=result['fileKey'], Body=documents[0],
+                                    ChecksumSHA256=upload.to_checksum_sha256(result['contentHash']))
+    except ClientError as e:
+        assert e.response['Error']['Code'] == 'BadDigest'
+    else:
+        raise AssertionError('tampered upload was accepted')
+    call(upload, '/document/presigned-url', dict(file, contentHash='not-a-hash'), status_code=400)
+    print('tampered upload: rejected with BadDigest')
+
+
+def main():
+    upload = load_lambda_module('DocumentUpload/LambdaFunction.py', 'document_upload_lambda')
+    from content_dedupe import InMemoryContentHashIndex
+    from retrieval_filter import build_filter
+
+    rng = random.Random(SEED)
+    documents = [rng.randbytes(DOCUMENT_SIZE) for _ in range(DISTINCT_DOCUMENTS)]
+    uploads = [
+        (rng.randrange(DISTINCT_DOCUMENTS), {
+            'fileName': 'manual-{0}.pdf'.format(index),
+            'contentType': 'application/pdf',
+            'sectionName': 'section-{0}'.format(rng.randrange(SECTIONS)),
+            'categoryName': rng.choice(CATEGORIES),
+        })
+        for index in range(UPLOADS)
+    ]
+    signer = boto3.client('s3', region_name='ap-northeast-1')
+
+    upload.content_hash_index = None
+    upload.s3_client = FakeS3Client(signer=signer)
+    print('without dedupe:', json.dumps(run_uploads(upload, documents, uploads)))
+
+    upload.content_hash_index = InMemoryContentHashIndex()
+    upload.s3_client = FakeS3Client(signer=signer)
+    result = run_uploads(upload, documents, uploads)
+    print('with dedupe   :', json.dumps(result))
+    assert result['documents_indexed'] == len({document_index for document_index, _ in uploads})
+    unmatched = check_filters(upload, build_filter, documents, uploads)
+    print('filters: all {0} uploads match their canonical document ({1} would not without shared filters)'.format(
+        len(uploads), unmatched))
+    check_filter_limits(upload, build_filter)
+    check_streamed(upload, documents)
+    check_metadata_attributes(upload)
+    check_tampered(upload, documents)
+
+
+if __name__ == '__main__':
+    main()
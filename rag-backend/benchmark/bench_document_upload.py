@@ -0,0 +1,140 @@
+"""DocumentUpload Lambdaの一括アップロードのベンチマーク.
+
+1件・50件・500件のファイルについて、1ファイルずつのリクエスト（/document/presigned-url）と
+一括のリクエスト（/document/presigned-urls）で、1ファイルあたりの所要時間を比較する.
+また、同じファイル名のメタデータファイルを同時に書き込んでも内容が混ざらないことと、
+検索結果キャッシュがpresigned URLの発行時ではなくS3のイベント（アップロード完了）で無効化されることを確認する.
+署名はboto3で実際に計算し（ダミーの認証情報を使用するため、AWSへのアクセスは発生しない）、
+メタデータファイルの書き込みとAPI Gatewayの往復には人工的な遅延を入れる.
+
+実行方法:
+    python benchmark/bench_document_upload.py
+"""
+import json
+import os
+import time
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'AKIABENCHMARK')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3  # noqa: E402
+
+from stubs import FakeLambdaContext, FakeS3Client, build_api_gateway_event, load_lambda_module  # noqa: E402
+
+FILE_COUNTS = (1, 50, 500)
+PUT_LATENCY = 0.02
+ROUND_TRIP_LATENCY = 0.05
+
+
+def build_files(count: int) -> list:
+    """アップロードするファイルの指定を生成する."""
+    return [
+        {
+            'fileName': 'manual-{0}.pdf'.format(index),
+            'contentType': 'application/pdf',
+            'sectionName': 'section-{0}'.format(index % 5),
+            'categoryName': '規程',
+        }
+        for index in range(count)
+    ]
+
+
+def run_single(upload, files: list) -> float:
+    """1ファイルずつリクエストした場合の所要時間を返す."""
+    started = time.perf_counter()
+    for file in files:
+        time.sleep(ROUND_TRIP_LATENCY)
+        event = build_api_gateway_event('POST', '/document/presigned-url', file)
+        assert upload.lambda_handler(event, FakeLambdaContext())['statusCode'] == 200
+    return time.perf_counter() - started
+
+
+def run_batch(upload, files: list) -> float:
+    """一括でリクエストした場合の所要時間を返す."""
+    started = time.perf_counter()
+    time.sleep(ROUND_TRIP_LATENCY)
+    event = build_api_gateway_event('POST', '/document/presigned-urls', {'files': files})
+    response = upload.lambda_handler(event, FakeLambdaContext())
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200 and body['failed'] == 0, body
+    assert all(result['uploadUrl'].startswith('https://') for result in body['results'])
+    return time.perf_counter() - started
+
+
+def check_sidecars(upload) -> None:
+    """同じファイル名を複数のセクションに同時にアップロードしても、メタデータファイルが混ざらないことを確認する."""
+    upload.s3_client = FakeS3Client(put_latency=PUT_LATENCY)
+    files = [
+        {'fileName': 'manual.pdf', 'contentType': 'application/pdf', 'sectionName': 'section-{0}'.format(index),
+         'categoryName': 'category-{0}'.format(index)}
+        for index in range(50)
+    ]
+    run_batch(upload, files)
+    for file in files:
+        key = 'docs/{0}/manual.pdf.metadata.json'.format(file['sectionName'])
+        metadata = json.loads(upload.s3_client.objects[(upload.BUCKET_NAME, key)])['metadataAttributes']
+        assert (metadata['section'], metadata['category']) == (file['sectionName'], file['categoryName']), metadata
+    print('sidecars: {0} files with the same name, calls={1}'.format(len(files), dict(upload.s3_client.calls)))
+
+
+def check_validation(upload) -> None:
+    """必須パラメータが不足したファイルは重複ではなく入力エラーとして返し、他のファイルの発行を妨げないことを確認する."""
+    upload.s3_client = FakeS3Client()
+    files = build_files(3)
+    files[1:1] = [{'fileName': 'missing-{0}.pdf'.format(index)} for index in range(3)] + ['invalid']
+    files.append(dict(files[0]))
+    event = build_api_gateway_event('POST', '/document/presigned-urls', {'files': files})
+    results = json.loads(upload.lambda_handler(event, FakeLambdaContext())['body'])['results']
+    errors = [result.get('error') for result in results]
+    missing, invalid, duplicate = '必須パラメータが不足しています', 'ファイルの指定が不正です', 'ファイルが重複しています'
+    assert errors == [None, missing, missing, missing, invalid, None, None, duplicate], results
+    assert 'fileKey' not in results[1] and results[1]['fileName'] == 'missing-0.pdf', results[1]
+    print('validation: {0} files, {1} errors'.format(len(files), sum(1 for error in errors if error)))
+
+
+def check_invalidation(upload) -> None:
+    """presigned URLの発行では検索結果キャッシュを無効化せず、S3のイベントでセクションごとに1回無効化することを確認する."""
+    from answer_cache import AnswerCache, InMemoryCacheBackend
+
+    backend = InMemoryCacheBackend()
+    upload.answer_cache = AnswerCache(backend)
+    upload.s3_client = FakeS3Client()
+    files = build_files(10)
+    run_batch(upload, files)
+    assert backend.get_counter('generation#section-0') == 0
+
+    keys = ['docs/{0}/{1}{2}'.format(file['sectionName'], file['fileName'], suffix)
+            for file in files for suffix in ('', '.metadata.json')]
+    # 重複排除で共有されたドキュメントは、メタデータファイルに記録した他のセクションも無効化する
+    scopes = [upload.format_scope(files[0]['sectionName'], '規程'), upload.format_scope('section-shared', '規程')]
+    upload.s3_client.put_object(Bucket=upload.BUCKET_NAME, Key=keys[1],
+                                Body=upload.create_metadata_body(files[0]['sectionName'], '規程', scopes))
+    records = [{'eventSource': 'aws:s3', 's3': {'bucket': {'name': upload.BUCKET_NAME}, 'object': {'key': key}}}
+               for key in keys]
+    result = upload.lambda_handler({'Records': records}, FakeLambdaContext())
+    assert result['sections'] == sorted({file['sectionName'] for file in files} | {'section-shared'}), result
+    assert all(backend.get_counter('generation#{0}'.format(section)) == 1 for section in result['sections'])
+    upload.answer_cache = None
+    print('invalidation: 0 on presign, 1 per section on {0} S3 events'.format(len(records)))
+
+
+def main():
+    upload = load_lambda_module('DocumentUpload/LambdaFunction.py', 'document_upload_lambda')
+    signer = boto3.client('s3', region_name='ap-northeast-1')
+
+    print('put={0}s round_trip={1}s parallel={2}'.format(PUT_LATENCY, ROUND_TRIP_LATENCY, upload.MAX_PARALLEL_UPLOADS))
+    for count in FILE_COUNTS:
+        files = build_files(count)
+        upload.s3_client = FakeS3Client(put_latency=PUT_LATENCY, signer=signer)
+        single = run_single(upload, files)
+        upload.s3_client = FakeS3Client(put_latency=PUT_LATENCY, signer=signer)
+        batch = run_batch(upload, files)
+        print('files={0:>3}: single={1:.2f}s ({2:.1f} ms/file) batch={3:.2f}s ({4:.1f} ms/file)'.format(
+            count, single, single / count * 1000, batch, batch / count * 1000))
+    check_sidecars(upload)
+    check_validation(upload)
+    check_invalidation(upload)
+
+
+if __name__ == '__main__':
+    main()
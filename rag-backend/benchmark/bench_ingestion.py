@@ -0,0 +1,180 @@
+"""Ingestion Lambdaの取り込みジョブのまとめ方のベンチマーク.
+
+ドキュメントとメタデータファイルのアップロード（S3のイベント）が何回かのまとまりで届く状況を、
+時刻を進めるだけの仮想の時計で再現する. 取り込みジョブのAPIにはローカル代替（LocalIngestionClient）を使用する.
+S3のイベントごとに取り込みジョブを開始した場合と、Ingestion Lambdaでデバウンス時間ごとにまとめた場合で、
+開始した取り込みジョブの数・実行中のため開始できなかった数と、アップロードから取り込み完了までの時間を比較する.
+
+実行方法:
+    python benchmark/bench_ingestion.py
+"""
+import json
+import os
+
+os.environ.setdefault('INGESTION_API', 'local')
+os.environ.setdefault('INGESTION_STORE', 'memory')
+
+from stubs import FakeLambdaContext, FakeS3Client, build_api_gateway_event, load_lambda_module  # noqa: E402
+
+BUCKET_NAME = 'benchmark-bucket'
+# 重複排除で他のセクションからも参照されるドキュメント（最初のバーストの先頭）と、参照するセクション
+SHARED_SECTION = 'section-shared'
+
+BURSTS = 5
+FILES_PER_BURST = 100
+UPLOAD_INTERVAL = 0.5
+BURST_INTERVAL = 180.0
+SCHEDULE_INTERVAL = 60.0
+JOB_DURATION = 90.0
+DEBOUNCE_SECONDS = 60.0
+MAX_WAIT_SECONDS = 600.0
+
+
+class SimulatedClock:
+    """仮想の時計."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def build_uploads() -> list:
+    """(アップロード時刻, S3のキー) のリストを生成する（ドキュメントの後にメタデータファイルをアップロードする）."""
+    uploads = []
+    for burst in range(BURSTS):
+        for index in range(FILES_PER_BURST):
+            uploaded_at = burst * BURST_INTERVAL + index * UPLOAD_INTERVAL
+            key = 'docs/section-{0}/manual-{1}-{2}.pdf'.format(index % 4, burst, index)
+            uploads.append((uploaded_at, key))
+            uploads.append((uploaded_at + 0.1, key + '.metadata.json'))
+    return uploads
+
+
+def build_s3_event(key: str) -> dict:
+    """S3のイベント通知を生成する."""
+    return {'Records': [{'eventSource': 'aws:s3',
+                         's3': {'bucket': {'name': BUCKET_NAME}, 'object': {'key': key.replace(' ', '+')}}}]}
+
+
+def run_per_event(uploads: list) -> dict:
+    """S3のイベントごとに取り込みジョブを開始した場合の件数を返す.
+
+    実行中のため開始できなかったイベントのうち、以降に取り込みジョブが開始されなかったドキュメントは
+    手動で同期するまで検索できない（documents_missed）.
+    """
+    from botocore.exceptions import ClientError
+    from ingestion import LocalIngestionClient, get_document_key
+
+    clock = SimulatedClock()
+    client = LocalIngestionClient(duration=JOB_DURATION, clock=clock)
+    started_at = []
+    conflicts = 0
+    for uploaded_at, key in uploads:
+        clock.now = uploaded_at
+        try:
+            client.start_ingestion_job(knowledgeBaseId='kb', dataSourceId='ds', clientToken=key)
+            started_at.append(uploaded_at)
+        except ClientError:
+            conflicts += 1
+    missed = {get_document_key(key) for at, key in uploads if at > started_at[-1]}
+    return {'events': len(uploads), 'jobs_started': len(started_at), 'conflicts': conflicts,
+            'documents_missed': len(missed)}
+
+
+def run_coordinated(ingestion, uploads: list) -> dict:
+    """Ingestion Lambdaでまとめて取り込みジョブを開始した場合の件数と、取り込み完了までの時間を返す."""
+    from answer_cache import AnswerCache, InMemoryCacheBackend
+    from ingestion import InMemoryIngestionStore, IngestionCoordinator, LocalIngestionClient
+
+    clock = SimulatedClock()
+    client = LocalIngestionClient(duration=JOB_DURATION, clock=clock)
+    backend = InMemoryCacheBackend()
+    ingestion.answer_cache = AnswerCache(backend)
+    # 共有されたドキュメントのメタデータファイルには、正規のキー以外のセクションも記録される
+    ingestion.s3_client = FakeS3Client()
+    shared_key = uploads[1][1]
+    ingestion.s3_client.put_object(Bucket=BUCKET_NAME, Key=shared_key, Body=json.dumps({'metadataAttributes': {
+        'section': 'section-0', 'category': '規程', 'sections': ['section-0', SHARED_SECTION]}}).encode())
+    ingestion.ingestion_coordinator = IngestionCoordinator(
+        client, 'kb', 'ds', InMemoryIngestionStore(), debounce_seconds=DEBOUNCE_SECONDS,
+        max_wait_seconds=MAX_WAIT_SECONDS, on_complete=ingestion.invalidate_answer_cache, clock=clock)
+
+    # S3のイベントとスケジュール（SCHEDULE_INTERVAL秒ごと）を時刻順に処理する
+    end = uploads[-1][0] + MAX_WAIT_SECONDS + JOB_DURATION * 2
+    schedules = [index * SCHEDULE_INTERVAL for index in range(int(end // SCHEDULE_INTERVAL) + 1)]
+    events = sorted([(at, 'upload', key) for at, key in uploads] + [(at, 'schedule', None) for at in schedules])
+    for at, kind, key in events:
+        clock.now = at
+        if kind == 'upload':
+            ingestion.lambda_handler(build_s3_event(key), FakeLambdaContext())
+        else:
+            ingestion.lambda_handler({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, FakeLambdaContext())
+
+    response = ingestion.lambda_handler(build_api_gateway_event('GET', '/ingestion/status'), FakeLambdaContext())
+    status = json.loads(response['body'])
+    assert status['pending']['count'] == 0 and status['activeJob'] is None, status
+    jobs = sorted(ingestion.ingestion_coordinator.store.list_jobs(100), key=lambda job: job['startedAt'])
+    assert all(job['status'] == 'COMPLETE' for job in jobs), jobs
+    response = ingestion.lambda_handler(
+        build_api_gateway_event('GET', '/ingestion/jobs/{0}'.format(jobs[0]['ingestionJobId'])), FakeLambdaContext())
+    assert json.loads(response['body'])['status'] == 'COMPLETE'
+
+    # アップロードから、そのドキュメントを含む取り込みジョブの完了までの時間
+    completed_at = {}
+    for job in jobs:
+        for key in ingestion.ingestion_coordinator.get_job_keys(job['ingestionJobId']):
+            completed_at.setdefault(key, job['startedAt'] + JOB_DURATION)
+    delays = sorted(completed_at[key] - at for at, key in uploads if key in completed_at)
+    assert len(completed_at) == BURSTS * FILES_PER_BURST
+    # 共有されたドキュメントを参照するセクションのキャッシュも、取り込み完了時に無効化される
+    assert SHARED_SECTION in jobs[0]['sections'], jobs[0]['sections']
+    assert backend.get_counter('generation#' + SHARED_SECTION) == 1
+    return {
+        'events': len(uploads),
+        'jobs_started': len(jobs),
+        'documents_per_job': [job['keyCount'] for job in jobs],
+        'delay_p50_s': delays[len(delays) // 2],
+        'delay_max_s': delays[-1],
+        'sections_invalidated': sum(len(job['sections']) for job in jobs),
+    }
+
+
+def check_abandon(ingestion) -> dict:
+    """取り込みジョブが失敗し続けるドキュメントが、INGESTION_MAX_ATTEMPTS回で待機中に戻されなくなることを確認する."""
+    from ingestion import InMemoryIngestionStore, IngestionCoordinator, LocalIngestionClient
+
+    clock = SimulatedClock()
+    client = LocalIngestionClient(duration=JOB_DURATION, clock=clock, final_status='FAILED')
+    abandoned = []
+    coordinator = IngestionCoordinator(
+        client, 'kb', 'ds', InMemoryIngestionStore(), debounce_seconds=DEBOUNCE_SECONDS,
+        max_wait_seconds=MAX_WAIT_SECONDS, max_attempts=ingestion.INGESTION_MAX_ATTEMPTS,
+        on_abandon=lambda job, keys: abandoned.extend(keys), clock=clock)
+    coordinator.add(['docs/section-0/broken.pdf'])
+    for _ in range(ingestion.INGESTION_MAX_ATTEMPTS * 4):
+        # スケジュールの実行と同様に、実行中の取り込みジョブの状態を更新してから開始する
+        clock.now += SCHEDULE_INTERVAL * 2
+        coordinator.active_job()
+        coordinator.flush()
+    status = coordinator.status()
+    assert len(client.jobs) == ingestion.INGESTION_MAX_ATTEMPTS, client.jobs
+    assert status['pending']['count'] == 0 and status['activeJob'] is None, status
+    assert abandoned == ['docs/section-0/broken.pdf'], abandoned
+    assert status['jobs'][0]['abandonedKeyCount'] == 1, status['jobs'][0]
+    return {'jobs_started': len(client.jobs), 'abandoned': len(abandoned)}
+
+
+def main():
+    ingestion = load_lambda_module('Ingestion/LambdaFunction.py', 'ingestion_lambda')
+    uploads = build_uploads()
+    print('bursts={0} files/burst={1} job_duration={2}s debounce={3}s schedule={4}s'.format(
+        BURSTS, FILES_PER_BURST, JOB_DURATION, DEBOUNCE_SECONDS, SCHEDULE_INTERVAL))
+    print('per-event  :', json.dumps(run_per_event(uploads)))
+    print('coordinated:', json.dumps(run_coordinated(ingestion, uploads)))
+    print('abandon    :', json.dumps(check_abandon(ingestion)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""MasterData Lambdaのベンチマーク.
+
+DynamoDBのローカル代替に数千件のセクションを登録し、全件取得の件数と所要時間を
+逐次スキャン・並列スキャンで比較する.
+また、セクションの保存に必要なDynamoDBへのリクエスト回数（全件スキャンの回数を含む）を計測し、
+多数のスレッドから同時にIDを採番しても重複しないことを確認する.
+
+実行方法:
+    python benchmark/bench_masterdata.py
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stubs import FakeDynamoDBResource, FakeDynamoDBTable, FakeLambdaContext, build_api_gateway_event, load_lambda_module
+
+ITEM_COUNT = 5000
+SCAN_LATENCY = 0.01
+SAVE_COUNT = 500
+CHANGED_COUNT = 50
+ALLOCATE_THREADS = 32
+GET_COUNT = 100
+ALLOCATE_CALLS = 200
+
+
+def build_sections(count: int) -> list:
+    """セクションのデータを生成する."""
+    return [
+        {
+            'id': str(index),
+            'sectionName': 'section-{0}'.format(index),
+            'categories': ['規程', '手順書'],
+            'update_at': '2024-01-01T00:00:00',
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def use_table(masterdata, table, resource=None):
+    """テーブルの作成をローカル代替に置き換え、スレッドごとに保持したテーブルとマスターデータのキャッシュを破棄する."""
+    masterdata.dynamodb = resource or FakeDynamoDBResource({masterdata.TABLE_NAME: table})
+    masterdata.create_table = lambda: table
+    masterdata.thread_local = threading.local()
+    masterdata.catalog_cache.update({'version': None, 'checked_at': float('-inf')})
+
+
+def count_scan_pages(table, total_segments: int) -> int:
+    """全件スキャンに必要なscanの回数（セグメントごとのページ数の合計. 空のセグメントも1回）を返す."""
+    counts = [0] * total_segments
+    for key in table.items:
+        counts[table._segment_of(key, total_segments)] += 1
+    return sum(max(1, -(-count // table.page_size)) for count in counts)
+
+
+def save_with_update_item(table, formatted_sections):
+    """変更前の保存処理（セクションごとにupdate_itemを呼び出す）."""
+    for section in formatted_sections:
+        table.update_item(
+            Key={'id': section['id']},
+            UpdateExpression='SET sectionName = :sn, categories = :cat, update_at = :ua',
+            ExpressionAttributeValues={
+                ':sn': section['sectionName'],
+                ':cat': section['categories'],
+                ':ua': section['update_at'],
+            },
+        )
+
+
+def bench_save(masterdata):
+    """セクションの保存に必要なリクエスト回数を計測する."""
+    masterdata.SCAN_TOTAL_SEGMENTS = 1
+    sections = masterdata.formatting_section_data(build_sections(SAVE_COUNT))
+    for index in range(CHANGED_COUNT):
+        sections[index]['categories'] = ['規程', '手順書', '様式']
+
+    legacy_table = FakeDynamoDBTable(build_sections(SAVE_COUNT))
+    save_with_update_item(legacy_table, sections)
+    print('save {0} sections ({1} changed) with update_item: requests={2}'.format(
+        SAVE_COUNT, CHANGED_COUNT, sum(legacy_table.calls.values())))
+
+    table = FakeDynamoDBTable(build_sections(SAVE_COUNT))
+    resource = FakeDynamoDBResource({masterdata.TABLE_NAME: table}, unprocessed_rate=0.1)
+    use_table(masterdata, table, resource)
+    masterdata.BATCH_WRITE_BASE_DELAY = 0.001
+    saved = masterdata.save_dynamodb_data(sections)
+    assert len(saved) == SAVE_COUNT
+    assert all(table.items[str(index + 1)]['categories'][-1] == '様式' for index in range(CHANGED_COUNT))
+    print('save {0} sections ({1} changed) with batch_write_item: requests={2} ({3})'.format(
+        SAVE_COUNT, CHANGED_COUNT, sum(table.calls.values()) + sum(resource.calls.values()),
+        dict(table.calls + resource.calls)))
+
+    # 同じidのセクションが同じ25件に含まれても、最後のものを書き込む
+    duplicated = masterdata.formatting_section_data(build_sections(3))
+    duplicated.append(dict(duplicated[0], sectionName='section-renamed'))
+    masterdata.save_dynamodb_data(duplicated)
+    assert table.items['1']['sectionName'] == 'section-renamed', table.items['1']
+
+
+def bench_save_categories(masterdata):
+    """POSTでセクションを保存した際の、全件スキャンの回数を計測する."""
+    masterdata.SCAN_TOTAL_SEGMENTS = 1
+    masterdata.CATALOG_VERSION_CHECK_INTERVAL = 0
+    table = FakeDynamoDBTable(build_sections(ITEM_COUNT))
+    use_table(masterdata, table)
+    pages_per_pass = -(-ITEM_COUNT // table.page_size)
+    # IDカウンターの初期化（初回のみの全件スキャン）は計測の対象外とする
+    masterdata.initialize_id_counter()
+
+    sections = build_sections(CHANGED_COUNT)
+    for section in sections:
+        section['categories'] = [{'categoryName': name} for name in ('規程', '手順書', '様式')]
+    sections.append({'sectionName': 'section-new', 'categories': [{'categoryName': '規程'}]})
+    event = build_api_gateway_event('POST', '/masterdata/sections-categories', {'sections': sections})
+
+    expected_total = ITEM_COUNT
+    for label, query in (('cold catalog', None), ('warm catalog', None), ('consistent=true', {'consistent': 'true'})):
+        event['queryStringParameters'] = query
+        table.calls.clear()
+        response = masterdata.lambda_handler(event, FakeLambdaContext())
+        body = json.loads(response['body'])
+        expected_total += 1
+        assert body['total'] == expected_total, body['total']
+        assert any(item['sectionName'] == 'section-new' for item in body['results'])
+        print('save_categories ({0}): full scan passes={1:g} {2}'.format(
+            label, table.calls['scan'] / pages_per_pass, dict(table.calls)))
+
+    # 書き込んだ内容がキャッシュに反映され、次のGETでは再スキャンしない
+    table.calls.clear()
+    response = masterdata.lambda_handler(
+        build_api_gateway_event('GET', '/masterdata/sections-categories'), FakeLambdaContext())
+    assert json.loads(response['body'])['total'] == expected_total
+    assert table.calls['scan'] == 0, dict(table.calls)
+
+
+def bench_allocate_ids(masterdata):
+    """多数のスレッドから同時にIDを採番し、重複が無いことを確認する."""
+    table = FakeDynamoDBTable(build_sections(ITEM_COUNT))
+    use_table(masterdata, table)
+
+    with ThreadPoolExecutor(max_workers=ALLOCATE_THREADS) as executor:
+        blocks = list(executor.map(lambda count: masterdata.allocate_ids(count), [3] * ALLOCATE_CALLS))
+    ids = [int(new_id) for block in blocks for new_id in block]
+    assert len(ids) == len(set(ids)) == ALLOCATE_CALLS * 3, 'duplicated ids'
+    assert min(ids) == ITEM_COUNT + 1 and max(ids) == ITEM_COUNT + ALLOCATE_CALLS * 3
+    print('allocate_ids from {0} threads: {1} unique ids, scans={2} (counter initialization)'.format(
+        ALLOCATE_THREADS, len(ids), table.calls['scan']))
+
+    table.calls.clear()
+    masterdata.allocate_ids(5)
+    print('allocate_ids after initialization: requests={0}'.format(sum(table.calls.values())))
+
+
+def bench_catalog(masterdata):
+    """マスターデータを繰り返し取得した際のDynamoDBへのリクエスト回数を計測する."""
+    masterdata.SCAN_TOTAL_SEGMENTS = 1
+    table = FakeDynamoDBTable(build_sections(ITEM_COUNT))
+    use_table(masterdata, table)
+
+    event = build_api_gateway_event('GET', '/masterdata/sections-categories')
+    response = masterdata.lambda_handler(event, FakeLambdaContext())
+    etag = response['multiValueHeaders']['ETag'][0]
+    started = time.perf_counter()
+    for _ in range(GET_COUNT):
+        masterdata.lambda_handler(event, FakeLambdaContext())
+    elapsed = (time.perf_counter() - started) / GET_COUNT * 1000
+    event['headers']['If-None-Match'] = etag
+    assert masterdata.lambda_handler(event, FakeLambdaContext())['statusCode'] == 304
+    print('{0} GETs of {1} sections: {2} ({3:.2f} ms/request, If-None-Match -> 304)'.format(
+        GET_COUNT + 2, ITEM_COUNT, dict(table.calls), elapsed))
+
+
+def main():
+    masterdata = load_lambda_module('MasterData/LambdaFunction.py', 'masterdata_lambda')
+    table = FakeDynamoDBTable(build_sections(ITEM_COUNT), latency=SCAN_LATENCY)
+
+    for total_segments in (1, 4, 8):
+        use_table(masterdata, table)
+        masterdata.SCAN_TOTAL_SEGMENTS = total_segments
+        masterdata.scan_executor = masterdata.ThreadPoolExecutor(max_workers=total_segments)
+        table.calls.clear()
+        started = time.perf_counter()
+        response = masterdata.lambda_handler(
+            build_api_gateway_event('GET', '/masterdata/sections-categories'), FakeLambdaContext())
+        elapsed = time.perf_counter() - started
+        total = json.loads(response['body'])['total']
+        assert total == ITEM_COUNT, total
+        assert table.calls['scan'] == count_scan_pages(table, total_segments), dict(table.calls)
+        print('segments={0}: items={1} scans={2} elapsed={3:.2f}s'.format(
+            total_segments, total, table.calls['scan'], elapsed))
+
+    masterdata.SCAN_TOTAL_SEGMENTS = 1
+    ids = list(masterdata.iter_dynamodb_data(projection=['id']))
+    assert len(ids) == ITEM_COUNT and all(set(item) == {'id'} for item in ids)
+    print('projection=id: items={0}'.format(len(ids)))
+
+    bench_save(masterdata)
+    bench_save_categories(masterdata)
+    bench_allocate_ids(masterdata)
+    bench_catalog(masterdata)
+
+
+if __name__ == '__main__':
+    main()
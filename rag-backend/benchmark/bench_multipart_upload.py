@@ -0,0 +1,133 @@
+"""DocumentUpload Lambdaのマルチパートアップロードのベンチマーク.
+
+大きなファイル（既定は512MB）を、1回のPUT（presigned URL）と、マルチパートアップロードの
+パートの並列数1・4・8でアップロードした場合の所要時間とスループットを比較する.
+1接続あたりの帯域を制限したアップロードを人工的な遅延で再現するため、実際のデータは転送しない.
+あわせて、途中で中断したアップロードをアップロード済みのパートの一覧から再開できることと、
+中止したアップロードのメタデータファイルが削除されることを確認する.
+
+実行方法:
+    python benchmark/bench_multipart_upload.py
+    python benchmark/bench_multipart_upload.py --file-size-mb 1024 --bandwidth-mbps 50 --time-scale 1
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stubs import FakeLambdaContext, FakeS3Client, build_api_gateway_event, load_lambda_module
+
+MB = 1024 * 1024
+PARALLELISMS = (1, 4, 8)
+FILE = {
+    'fileName': 'large-manual.pdf',
+    'contentType': 'application/pdf',
+    'sectionName': 'section-0',
+    'categoryName': '規程',
+}
+
+
+def call(upload, method: str, path: str, body=None, query=None, status_code: int = 200) -> dict:
+    """Lambdaのハンドラを呼び出し、レスポンスのボディを返す."""
+    response = upload.lambda_handler(build_api_gateway_event(method, path, body, query), FakeLambdaContext())
+    assert response['statusCode'] == status_code, response
+    return json.loads(response['body'])
+
+
+def put_part(upload, started: dict, part: dict, part_size: int, seconds_per_byte: float) -> dict:
+    """presigned URLへのパートのPUTを、帯域に応じた遅延で再現する."""
+    time.sleep(part_size * seconds_per_byte)
+    body = 'part-{0}'.format(part['partNumber']).encode()
+    response = upload.s3_client.upload_part(
+        Bucket=upload.BUCKET_NAME, Key=started['fileKey'], UploadId=started['uploadId'],
+        PartNumber=part['partNumber'], Body=body)
+    return {'partNumber': part['partNumber'], 'eTag': response['ETag']}
+
+
+def run_single_put(file_size: int, seconds_per_byte: float) -> float:
+    """1回のPUTでアップロードした場合の所要時間を返す."""
+    started = time.perf_counter()
+    time.sleep(file_size * seconds_per_byte)
+    return time.perf_counter() - started
+
+
+def run_multipart(upload, file_size: int, parallelism: int, seconds_per_byte: float) -> float:
+    """マルチパートアップロードでparallelism個のパートを同時にアップロードした場合の所要時間を返す."""
+    upload.s3_client = FakeS3Client()
+    started_at = time.perf_counter()
+    started = call(upload, 'POST', '/document/multipart', dict(FILE, fileSize=file_size))
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        parts = list(executor.map(
+            lambda part: put_part(upload, started, part, started['partSize'], seconds_per_byte), started['parts']))
+    completed = call(upload, 'POST', '/document/multipart/complete',
+                     {'fileKey': started['fileKey'], 'uploadId': started['uploadId'], 'parts': parts})
+    elapsed = time.perf_counter() - started_at
+    assert completed['partCount'] == started['partCount'] == len(parts)
+    assert (upload.BUCKET_NAME, started['fileKey']) in upload.s3_client.objects
+    return elapsed
+
+
+def check_resume(upload) -> None:
+    """中断したアップロードを、アップロード済みのパートの一覧から再開できることを確認する."""
+    upload.s3_client = FakeS3Client()
+    started = call(upload, 'POST', '/document/multipart', dict(FILE, fileSize=100 * MB))
+    uploaded = [put_part(upload, started, part, 0, 0) for part in started['parts'][::2]]
+
+    # 再開時は、アップロード済みのパートを取得して残りのパートのURLを再発行する
+    query = {'fileKey': started['fileKey'], 'uploadId': started['uploadId']}
+    listed = call(upload, 'GET', '/document/multipart/parts', query=query)['parts']
+    assert [part['partNumber'] for part in listed] == [part['partNumber'] for part in uploaded]
+    remaining = sorted(set(range(1, started['partCount'] + 1)) - {part['partNumber'] for part in listed})
+    presigned = call(upload, 'POST', '/document/multipart/parts', dict(query, partNumbers=remaining))['parts']
+    for part in presigned:
+        put_part(upload, started, part, 0, 0)
+
+    # partsを省略すると、アップロード済みの全パートで完了する
+    completed = call(upload, 'POST', '/document/multipart/complete', query)
+    assert completed['partCount'] == started['partCount']
+    expected = b''.join('part-{0}'.format(number).encode() for number in range(1, started['partCount'] + 1))
+    assert upload.s3_client.objects[(upload.BUCKET_NAME, started['fileKey'])] == expected
+    print('resume: {0}/{1} parts uploaded before resuming, calls={2}'.format(
+        len(uploaded), started['partCount'], dict(upload.s3_client.calls)))
+
+
+def check_abort(upload) -> None:
+    """中止したアップロードのメタデータファイルが削除され、以降の操作がエラーになることを確認する."""
+    upload.s3_client = FakeS3Client()
+    started = call(upload, 'POST', '/document/multipart', FILE)
+    target = {'fileKey': started['fileKey'], 'uploadId': started['uploadId']}
+    call(upload, 'POST', '/document/multipart/abort', target)
+    assert not upload.s3_client.objects and not upload.s3_client.multipart_uploads
+    call(upload, 'POST', '/document/multipart/complete', target, status_code=400)
+    call(upload, 'POST', '/document/multipart/parts', dict(target, fileKey='../secret'), status_code=400)
+    print('abort: sidecar removed, calls={0}'.format(dict(upload.s3_client.calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--file-size-mb', type=int, default=512, help='アップロードするファイルのサイズ（MB）')
+    parser.add_argument('--bandwidth-mbps', type=float, default=40.0, help='1接続あたりの帯域（MB/秒）')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='転送の遅延に掛ける係数')
+    args = parser.parse_args()
+
+    upload = load_lambda_module('DocumentUpload/LambdaFunction.py', 'document_upload_lambda')
+    file_size = args.file_size_mb * MB
+    seconds_per_byte = args.time_scale / (args.bandwidth_mbps * MB)
+    part_size = upload.calculate_part_size(file_size, upload.MULTIPART_PART_SIZE)
+    print('file={0}MB part={1}MB parts={2} bandwidth={3}MB/s per connection time_scale={4}'.format(
+        args.file_size_mb, part_size // MB, -(-file_size // part_size), args.bandwidth_mbps, args.time_scale))
+
+    def report(label: str, elapsed: float) -> None:
+        # time_scaleで縮めた時間を、実際の帯域での所要時間・スループットに換算する
+        seconds = elapsed / args.time_scale
+        print('{0:<12}: {1:6.1f}s {2:7.1f} MB/s'.format(label, seconds, args.file_size_mb / seconds))
+
+    report('single PUT', run_single_put(file_size, seconds_per_byte))
+    for parallelism in PARALLELISMS:
+        report('parallel={0}'.format(parallelism), run_multipart(upload, file_size, parallelism, seconds_per_byte))
+    check_resume(upload)
+    check_abort(upload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""SearchとSearchStreamのパイプライン全体のベンチマーク.
+
+Bedrock・S3のスタブに実際に近い遅延の分布を設定し、実際のハンドラ（Searchはlambda_handler、
+SearchStreamはgenerate_stream）を同時実行数を指定して繰り返し実行する.
+処理ごと（retrieve / sign / prompt_build / generate / first_token / last_token / end_to_end）の
+p50・p95・p99とスループットをJSONで出力する.
+first_token・last_tokenは、リクエストの開始からセクションごとの最初・最後のトークンまでの時間.
+
+遅延の分布は --profile で {"retrieve": {"median": 0.3, "p95": 0.8}, ...} 形式のJSONを指定できる.
+指定しない処理はDEFAULT_PROFILEの値を使用する.
+
+実行方法:
+    python benchmark/bench_pipeline.py
+    python benchmark/bench_pipeline.py --requests 100 --concurrency 10 --output result.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from stubs import (
+    FakeBedrockAgentRuntime,
+    FakeBedrockRuntime,
+    FakeLambdaContext,
+    FakeS3Client,
+    FakeStreamingBedrockRuntime,
+    LatencyDistribution,
+    build_api_gateway_event,
+    build_retrieval_results,
+    load_latency_profile,
+    load_lambda_module,
+)
+
+# 処理ごとの遅延（秒）の中央値とp95
+DEFAULT_PROFILE = {
+    'retrieve': {'median': 0.35, 'p95': 0.8},
+    'generate': {'median': 2.0, 'p95': 4.0},
+    'first_token': {'median': 0.6, 'p95': 1.5},
+    'token_interval': {'median': 0.015, 'p95': 0.04},
+    'sign': {'median': 0.0005, 'p95': 0.002},
+}
+SEARCH_TEXT = '有給休暇の申請方法'
+
+
+def percentile(values: list, ratio: float) -> float:
+    """値のリストのパーセンタイルを線形補間で返す."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * ratio
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class StageRecorder:
+    """処理ごとの所要時間を記録する."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, module, function_name: str, stage: str) -> None:
+        """モジュールの関数を、所要時間を記録する関数に置き換える."""
+        original = getattr(module, function_name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(module, function_name, timed)
+
+    def summary(self) -> dict:
+        """処理ごとの件数・平均・p50・p95・p99（ミリ秒）を返す."""
+        return {
+            stage: {
+                'count': len(values),
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            }
+            for stage, values in sorted(self.samples.items())
+        }
+
+
+def build_profile(path: str, seed: int, time_scale: float) -> dict:
+    """遅延の分布を作成する（time_scaleで全体の遅延を縮める）."""
+    profile = {}
+    for index, (name, value) in enumerate(DEFAULT_PROFILE.items()):
+        profile[name] = LatencyDistribution(value['median'], value['p95'], seed + index)
+    if path:
+        profile.update(load_latency_profile(path, seed))
+    for distribution in profile.values():
+        distribution.median *= time_scale
+        distribution.p95 *= time_scale
+    return profile
+
+
+def run_search(profile: dict, requests: int, concurrency: int, sections: int) -> dict:
+    """Searchのlambda_handlerを同時実行し、処理ごとの所要時間とスループットを返す."""
+    search = load_lambda_module('Search/LambdaFunction.py', 'search_lambda')
+    search.bedrock_agent_runtime = FakeBedrockAgentRuntime(profile['retrieve'])
+    search.bedrock_runtime = FakeBedrockRuntime(profile['generate'])
+    search.s3_client = FakeS3Client(profile['sign'])
+    # リクエストごとの処理時間を計測するため、検索結果のキャッシュは無効にする
+    search.answer_cache = None
+    search.retrieval_cache = None
+
+    recorder = StageRecorder()
+    recorder.wrap(search, 'query_knowledge_base', 'retrieve')
+    recorder.wrap(search, 'get_presigned_url', 'sign')
+    recorder.wrap(search, 'generate_summary_prompt', 'prompt_build')
+    recorder.wrap(search, 'generate_summary', 'generate')
+
+    def request(index: int) -> None:
+        event = build_api_gateway_event('POST', '/knowledgebase/search', {
+            'search_text': '{0} {1}'.format(SEARCH_TEXT, index),
+            'search_target': [
+                {'section_name': 'section-{0}'.format(section), 'category': ['規程']}
+                for section in range(sections)
+            ],
+        })
+        started = time.perf_counter()
+        response = search.lambda_handler(event, FakeLambdaContext())
+        recorder.record('end_to_end', time.perf_counter() - started)
+        assert response['statusCode'] == 200, response
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(request, range(requests)))
+    wall_seconds = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(requests / wall_seconds, 3),
+        'stages': recorder.summary(),
+    }
+
+
+async def run_search_stream(profile: dict, requests: int, concurrency: int, sections: int,
+                            parallel_sections: bool) -> dict:
+    """SearchStreamのgenerate_streamを同時実行し、処理ごとの所要時間とスループットを返す."""
+    stream = load_lambda_module('SearchStream/lambda_function.py', 'search_stream_lambda')
+    stream.bedrock_runtime = FakeStreamingBedrockRuntime(profile['first_token'], profile['token_interval'])
+    stream.s3_client = FakeS3Client(profile['sign'])
+    stream.PARALLEL_SECTION_STREAM = parallel_sections
+
+    recorder = StageRecorder()
+    recorder.wrap(stream, 'generate_signed_url', 'sign')
+    recorder.wrap(stream, 'generate_payload_for_bedrock_runtime', 'prompt_build')
+    semaphore = asyncio.Semaphore(concurrency)
+    retrieved_results = [
+        {'sectionName': 'section-{0}'.format(section), 'documents': build_retrieval_results(10)}
+        for section in range(sections)
+    ]
+
+    async def request(index: int) -> None:
+        async with semaphore:
+            first_tokens, last_tokens = {}, {}
+            started = time.perf_counter()
+            async for event in stream.generate_stream(retrieved_results, '{0} {1}'.format(SEARCH_TEXT, index)):
+                data = json.loads(event[len('data: '):])
+                assert data['type'] != 'error', data
+                if data['type'] == 'resultText':
+                    elapsed = time.perf_counter() - started
+                    first_tokens.setdefault(data['sectionName'], elapsed)
+                    last_tokens[data['sectionName']] = elapsed
+            recorder.record('end_to_end', time.perf_counter() - started)
+            for section_name, elapsed in first_tokens.items():
+                recorder.record('first_token', elapsed)
+                recorder.record('last_token', last_tokens[section_name])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(index) for index in range(requests)))
+    wall_seconds = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'parallel_sections': parallel_sections,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(requests / wall_seconds, 3),
+        'stages': recorder.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20, help='パイプラインごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=5, help='同時実行数')
+    parser.add_argument('--sections', type=int, default=3, help='1リクエストあたりの検索対象（セクション）の数')
+    parser.add_argument('--profile', help='遅延の分布のJSONファイル')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='全体の遅延に掛ける係数')
+    parser.add_argument('--seed', type=int, default=0, help='遅延の乱数のシード')
+    parser.add_argument('--parallel-sections', action='store_true', help='SearchStreamでセクションを並列に生成する')
+    parser.add_argument('--only', choices=['search', 'search_stream'], help='指定したパイプラインのみ実行する')
+    parser.add_argument('--output', help='結果のJSONを書き込むファイル（未指定の場合は標準出力）')
+    args = parser.parse_args()
+
+    profile = build_profile(args.profile, args.seed, args.time_scale)
+    result = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'sections': args.sections,
+            'time_scale': args.time_scale,
+            'seed': args.seed,
+            'profile': {name: {'median': value.median, 'p95': value.p95} for name, value in profile.items()},
+        },
+    }
+    if args.only in (None, 'search'):
+        result['search'] = run_search(profile, args.requests, args.concurrency, args.sections)
+    if args.only in (None, 'search_stream'):
+        result['search_stream'] = asyncio.run(run_search_stream(
+            profile, args.requests, args.concurrency, args.sections, args.parallel_sections))
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
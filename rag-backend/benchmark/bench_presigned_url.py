@@ -0,0 +1,94 @@
+"""プレサインURLキャッシュのマイクロベンチマーク.
+
+10セクション × 10チャンクの検索結果を整形する際の署名コストを、キャッシュの有無で比較する.
+SearchStreamは、全てのチャンクを引用するモデルのレスポンスを process_model_response で処理し、
+引用されたドキュメントを返す際（format_document_for_result）の署名を計測する.
+署名はboto3で実際に計算する（ダミーの認証情報を使用するため、AWSへのアクセスは発生しない）.
+
+実行方法:
+    python benchmark/bench_presigned_url.py
+"""
+import json
+import os
+import time
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'AKIABENCHMARK')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+from stubs import FakeEventStream, build_retrieval_results, load_lambda_module  # noqa: E402
+
+SECTION_COUNT = 10
+CHUNK_COUNT = 10
+SOURCE_COUNT = 3
+REQUEST_COUNT = 50
+
+
+def measure(format_sections) -> float:
+    """1リクエストあたりの整形時間（ミリ秒）を計測する."""
+    sections = [build_retrieval_results(CHUNK_COUNT, SOURCE_COUNT) for _ in range(SECTION_COUNT)]
+    started = time.perf_counter()
+    for _ in range(REQUEST_COUNT):
+        format_sections(sections)
+    return (time.perf_counter() - started) / REQUEST_COUNT * 1000
+
+
+def stream_documents(stream, documents: list) -> list:
+    """全てのチャンクを引用するモデルのレスポンスを処理し、返されたdocumentsのcontentを返す."""
+    tokens = ['回答です。'] + ['[^{0}]'.format(index) for index in range(len(documents))]
+    response = {'body': FakeEventStream(tokens, 0, 0)}
+    chunks = [json.loads(chunk) for chunk in stream.process_model_response(response, {'documents': documents})]
+    return [chunk['content'] for chunk in chunks if chunk['type'] == 'documents']
+
+
+def check_stream_output(stream):
+    """SearchStreamで返すドキュメントが引用順に全て含まれ、同じS3 URIには同じ署名付きURLを返すことを確認する."""
+    documents = build_retrieval_results(CHUNK_COUNT, SOURCE_COUNT)
+    results = stream_documents(stream, documents)
+    assert [result['pageNumber'] for result in results] == list(range(1, CHUNK_COUNT + 1)), results
+    assert [result['score'] for result in results] == [document['score'] for document in documents]
+    urls = {}
+    for document, result in zip(documents, results):
+        uri = document['location']['s3Location']['uri']
+        bucket_key = uri.replace('s3://', '').split('/', 1)[1]
+        assert bucket_key in result['documentUrl'], result
+        assert urls.setdefault(uri, result['documentUrl']) == result['documentUrl']
+    assert len(urls) == SOURCE_COUNT
+
+
+def main():
+    search = load_lambda_module('Search/LambdaFunction.py', 'search_lambda')
+    stream = load_lambda_module('SearchStream/lambda_function.py', 'search_stream_lambda')
+
+    def format_search(sections):
+        for documents in sections:
+            search.format_documents(documents)
+
+    def format_stream(sections):
+        for documents in sections:
+            stream_documents(stream, documents)
+
+    print('{0} sections x {1} chunks ({2} source documents per section)'.format(SECTION_COUNT, CHUNK_COUNT, SOURCE_COUNT))
+
+    # キャッシュ無し: 最大件数0のキャッシュはすぐに削除されるため、従来どおりチャンクごとに署名する
+    cache = search.presigned_url_cache
+    search.presigned_url_cache = search.TTLCache(max_size=0)
+    print('Search       without cache: {0:.2f} ms/request'.format(measure(format_search)))
+    search.presigned_url_cache = cache
+    print('Search       with cache:    {0:.2f} ms/request'.format(measure(format_search)))
+
+    # キャッシュ無し: 従来どおり1回の整形の中でのみ重複を排除する
+    cache = stream.signed_url_cache
+    stream.signed_url_cache = stream.SignedUrlCache(0, stream.SIGNED_URL_SAFETY_MARGIN)
+    print('SearchStream without cache: {0:.2f} ms/request'.format(measure(format_stream)))
+    stream.signed_url_cache = cache
+    cache.hits = cache.misses = 0
+    print('SearchStream with cache:    {0:.2f} ms/request'.format(measure(format_stream)))
+    # キャッシュ有り: 署名はS3 URIごとの最初の1回のみで、以降は全てキャッシュから返す
+    assert cache.misses == SOURCE_COUNT, (cache.hits, cache.misses)
+    assert cache.hits == SECTION_COUNT * CHUNK_COUNT * REQUEST_COUNT - SOURCE_COUNT, (cache.hits, cache.misses)
+    print('SearchStream cache:         {0} hits / {1} misses'.format(cache.hits, cache.misses))
+    check_stream_output(stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Search Lambdaのリランキングのベンチマーク.
+
+BM25によるリランキングの1リクエストあたりの所要時間を候補の件数ごとに計測し、
+上位の件数に絞り込んだ場合にプロンプトに含めるトークン数がどれだけ減るかを確認する.
+
+実行方法:
+    python benchmark/bench_rerank.py
+"""
+import os
+import statistics
+import time
+
+from stubs import build_retrieval_results, load_lambda_module
+
+CANDIDATE_COUNTS = (10, 50, 200)
+ITERATIONS = 200
+TOP_K = 5
+SEARCH_TEXT = '就業規則の第3条について教えてください'
+
+
+def percentile(values: list, ratio: float) -> float:
+    """値のリストのパーセンタイルを返す."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def main():
+    os.environ['RERANKER'] = 'bm25'
+    os.environ['RERANK_TOP_K'] = str(TOP_K)
+    search = load_lambda_module('Search/LambdaFunction.py', 'search_lambda')
+    from context_packing import estimate_tokens
+
+    for candidate_count in CANDIDATE_COUNTS:
+        documents = build_retrieval_results(candidate_count, source_count=candidate_count)
+        elapsed = []
+        for _ in range(ITERATIONS):
+            started = time.perf_counter()
+            reranked = search.rerank_documents(SEARCH_TEXT, documents)
+            elapsed.append((time.perf_counter() - started) * 1000)
+        assert len(reranked) == min(TOP_K, candidate_count)
+        print('bm25 candidates={0:>3}: p50={1:.2f}ms p95={2:.2f}ms mean={3:.2f}ms'.format(
+            candidate_count, percentile(elapsed, 0.5), percentile(elapsed, 0.95), statistics.mean(elapsed)))
+
+    documents = build_retrieval_results(10)
+    reranked = search.rerank_documents(SEARCH_TEXT, documents)
+    all_tokens = sum(estimate_tokens(document['content']['text']) for document in documents)
+    kept_tokens = sum(estimate_tokens(document['content']['text']) for document in reranked)
+    print('prompt tokens: {0} chunks {1} tokens -> top {2} chunks {3} tokens ({4:.0%})'.format(
+        len(documents), all_tokens, TOP_K, kept_tokens, kept_tokens / all_tokens))
+
+
+if __name__ == '__main__':
+    main()
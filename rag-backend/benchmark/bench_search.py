@@ -0,0 +1,110 @@
+"""Search Lambdaの検索対象ごとの並列実行のベンチマーク.
+
+あわせて、検索結果キャッシュが他のセクションの更新・Knowledge Baseの再取り込みで無効化されることと、
+検索フィルターの組み立てで検出した存在しないセクションが400エラーになることを確認する.
+
+実行方法:
+    python benchmark/bench_search.py
+"""
+import json
+import time
+
+from stubs import (
+    FakeBedrockAgentRuntime,
+    FakeBedrockRuntime,
+    FakeLambdaContext,
+    FakeS3Client,
+    build_api_gateway_event,
+    load_lambda_module,
+)
+
+RETRIEVE_LATENCY = 0.3
+GENERATE_LATENCY = 1.0
+SECTION_COUNT = 5
+
+
+def run(search, parallelism: int) -> float:
+    """指定した並列数で検索を実行し、所要時間を返す."""
+    search.MAX_PARALLEL_SEARCHES = parallelism
+    event = build_api_gateway_event('POST', '/knowledgebase/search', {
+        'search_text': '有給休暇の申請方法',
+        'search_target': [
+            {'section_name': 'section-{0}'.format(index), 'category': ['規程']}
+            for index in range(SECTION_COUNT)
+        ],
+    })
+    started = time.perf_counter()
+    response = search.lambda_handler(event, FakeLambdaContext())
+    elapsed = time.perf_counter() - started
+    assert response['statusCode'] == 200, response
+    return elapsed
+
+
+def check_answer_cache_invalidation(search) -> None:
+    """セクションのみを指定した検索（フィルター無し）のキャッシュが、他のセクションの更新と再取り込みで無効化されることを確認する."""
+    from answer_cache import AnswerCache, InMemoryCacheBackend
+
+    generation = {'value': 'job-1'}
+    search.bedrock_agent_runtime = FakeBedrockAgentRuntime(0)
+    search.bedrock_runtime = FakeBedrockRuntime(0)
+    search.answer_cache = AnswerCache(InMemoryCacheBackend(), knowledge_base_generation=lambda: generation['value'])
+
+    def retrieve_count() -> int:
+        search.get_retrieval_result('有給休暇の申請方法', 'section-0', [])
+        return search.bedrock_agent_runtime.call_count
+
+    assert retrieve_count() == 1 and retrieve_count() == 1
+    search.answer_cache.invalidate_section('section-1')
+    assert retrieve_count() == 2
+    generation['value'] = 'job-2'
+    assert retrieve_count() == 3 and retrieve_count() == 3
+    search.answer_cache = None
+    print('answer cache: invalidated by other sections and by re-ingestion')
+
+
+def check_filter_registry(search) -> None:
+    """組み立て済みの検索フィルターが最大件数までしか保持されず、組み立て時に検出した存在しないセクションが400エラーになることを確認する."""
+    from retrieval_filter import FilterRegistry
+
+    registry = FilterRegistry(max_size=8)
+    for index in range(100):
+        registry.compile('section-{0}'.format(index), ['規程'])
+    assert len(registry._filters) == 8, len(registry._filters)
+
+    # 検証の後、検索フィルターの組み立てまでの間にセクションが削除された場合を再現する
+    search.filter_registry = FilterRegistry(max_size=8)
+    search.filter_registry.load([{'sectionName': 'section-0', 'categories': ['規程']}])
+    search.filter_registry.validate = lambda section_name, categories: (section_name, tuple(categories))
+    search.bedrock_agent_runtime = FakeBedrockAgentRuntime(0)
+    search.bedrock_runtime = FakeBedrockRuntime(0)
+    event = build_api_gateway_event('POST', '/knowledgebase/search', {
+        'search_text': '有給休暇の申請方法', 'search_target': {'section_name': 'section-removed', 'category': ['規程']}})
+    response = search.lambda_handler(event, FakeLambdaContext())
+    assert response['statusCode'] == 400, response
+    assert 'section-removed' in json.loads(response['body'])['message'], response
+    assert search.bedrock_agent_runtime.call_count == 0
+    search.filter_registry = FilterRegistry()
+    print('filter registry: bounded to {0} filters, unknown section while compiling -> 400'.format(registry.max_size))
+
+
+def main():
+    search = load_lambda_module('Search/LambdaFunction.py', 'search_lambda')
+    search.bedrock_agent_runtime = FakeBedrockAgentRuntime(RETRIEVE_LATENCY)
+    search.bedrock_runtime = FakeBedrockRuntime(GENERATE_LATENCY)
+    search.s3_client = FakeS3Client()
+    # 並列化の効果のみを計測するため、キャッシュは無効にする
+    search.answer_cache = None
+    search.retrieval_cache = None
+
+    sequential = run(search, 1)
+    parallel = run(search, SECTION_COUNT)
+    print('sections={0} retrieve={1}s generate={2}s'.format(SECTION_COUNT, RETRIEVE_LATENCY, GENERATE_LATENCY))
+    print('sequential: {0:.2f}s'.format(sequential))
+    print('parallel:   {0:.2f}s'.format(parallel))
+    print('speedup:    {0:.1f}x'.format(sequential / parallel))
+    check_answer_cache_invalidation(search)
+    check_filter_registry(search)
+
+
+if __name__ == '__main__':
+    main()
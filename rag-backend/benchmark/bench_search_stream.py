@@ -0,0 +1,121 @@
+"""SearchStreamのセクションごとの最初のトークンまでの時間（TTFT）のベンチマーク.
+
+あわせて、FastAPIアプリケーション（Lambda Web Adapter経由で呼び出されるASGIアプリケーション）が
+最初のresultTextのチャンクを、モデルのストリームが終わる前に返すことと、
+並列ストリームの読み出しを途中で止めた場合（クライアントの切断）に、モデルのストリームの終了を待たずに戻ることを確認する.
+
+実行方法:
+    python benchmark/bench_search_stream.py
+"""
+import asyncio
+import json
+import time
+
+from stubs import wait
+
+from stubs import FakeS3Client, FakeStreamingBedrockRuntime, build_retrieval_results, load_lambda_module
+
+FIRST_TOKEN_LATENCY = 0.5
+TOKEN_INTERVAL = 0.02
+SECTION_COUNT = 5
+
+
+async def measure(stream, parallel: bool) -> dict:
+    """セクションごとのTTFTと全体の所要時間を計測する."""
+    stream.PARALLEL_SECTION_STREAM = parallel
+    retrieved_results = [
+        {'sectionName': 'section-{0}'.format(index), 'documents': build_retrieval_results(10)}
+        for index in range(SECTION_COUNT)
+    ]
+    first_tokens = {}
+    started = time.perf_counter()
+    async for event in stream.generate_stream(retrieved_results, '有給休暇の申請方法'):
+        data = json.loads(event[len('data: '):])
+        if data['type'] == 'resultText':
+            first_tokens.setdefault(data['sectionName'], time.perf_counter() - started)
+    return {'ttft': first_tokens, 'total': time.perf_counter() - started}
+
+
+async def check_asgi_streaming(stream) -> float:
+    """ASGIアプリケーションにPOSTし、最初のresultTextのチャンクがモデルのストリームの終了前に届くことを確認する.
+
+    Returns:
+        float: 最初のresultTextのチャンクから、モデルのストリームの終了までの時間（秒）
+    """
+    stream.PARALLEL_SECTION_STREAM = False
+    stream.bedrock_runtime = FakeStreamingBedrockRuntime(FIRST_TOKEN_LATENCY, TOKEN_INTERVAL)
+    body = json.dumps({
+        'retrievedResults': [{'sectionName': 'section-0', 'documents': build_retrieval_results(10)}],
+        'searchText': '有給休暇の申請方法',
+    }).encode()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': '/', 'raw_path': b'/', 'root_path': '', 'query_string': b'',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 8080),
+    }
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    received = []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # クライアントは切断しない（レスポンスの送信が終わるとキャンセルされる）
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            assert message['status'] == 200, message
+        elif message['type'] == 'http.response.body' and message.get('body'):
+            received.append((time.perf_counter(), message['body'].decode()))
+
+    await stream.app(scope, receive, send)
+    first_text_at = next(at for at, chunk in received if '"type": "resultText"' in chunk)
+    finished_at = stream.bedrock_runtime.streams[0].finished_at
+    assert finished_at is not None and first_text_at < finished_at, (first_text_at, finished_at)
+    return finished_at - first_text_at
+
+
+def check_cancellation(stream) -> None:
+    """並列ストリームの読み出しを止めた際に、ストリームの終了を待たずに戻り、各セクションのストリームを閉じることを確認する."""
+    tokens = ['トークン'] * 200
+    stream.bedrock_runtime = FakeStreamingBedrockRuntime(0.1, TOKEN_INTERVAL, tokens)
+    section_count = stream.MAX_PARALLEL_STREAMS + 3
+    retrieved_results = [
+        {'sectionName': 'section-{0}'.format(index), 'documents': build_retrieval_results(10)}
+        for index in range(section_count)
+    ]
+    generator = stream.generate_parallel_stream(retrieved_results, '有給休暇の申請方法')
+    next(generator)
+    started = time.perf_counter()
+    generator.close()
+    close_elapsed = time.perf_counter() - started
+    # 各スレッドは次のトークンを受け取った時点で止まる
+    wait(TOKEN_INTERVAL * 5)
+    streams = stream.bedrock_runtime.streams
+    stream_duration = 0.1 + TOKEN_INTERVAL * len(tokens)
+    assert close_elapsed < stream_duration / 10, close_elapsed
+    assert len(streams) <= stream.MAX_PARALLEL_STREAMS, len(streams)
+    assert all(event_stream.closed_at and not event_stream.finished_at for event_stream in streams)
+    print('cancel: close returned in {0:.3f}s (stream={1:.1f}s), {2}/{3} sections invoked and closed'.format(
+        close_elapsed, stream_duration, len(streams), section_count))
+
+
+def main():
+    stream = load_lambda_module('SearchStream/lambda_function.py', 'search_stream_lambda')
+    stream.bedrock_runtime = FakeStreamingBedrockRuntime(FIRST_TOKEN_LATENCY, TOKEN_INTERVAL)
+    stream.s3_client = FakeS3Client()
+
+    for parallel in (False, True):
+        result = asyncio.run(measure(stream, parallel))
+        print('{0}: total={1:.2f}s'.format('parallel  ' if parallel else 'sequential', result['total']))
+        for section_name, ttft in result['ttft'].items():
+            print('  {0}: ttft={1:.2f}s'.format(section_name, ttft))
+
+    lead = asyncio.run(check_asgi_streaming(stream))
+    print('asgi: first resultText chunk sent {0:.2f}s before the model stream finished'.format(lead))
+    check_cancellation(stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""SearchStreamの1プロセスあたりの同時ストリーム数の負荷試験.
+
+1つのイベントループ上でgenerate_streamを同時に実行し、全ストリームの所要時間と
+イベントループの遅延（別タスクのタイマーがどれだけ遅れたか）を計測する.
+
+実行方法:
+    python benchmark/bench_search_stream_load.py
+"""
+import asyncio
+import time
+
+from stubs import FakeS3Client, FakeStreamingBedrockRuntime, build_retrieval_results, load_lambda_module
+
+FIRST_TOKEN_LATENCY = 0.5
+TOKEN_INTERVAL = 0.02
+CONCURRENCY_LEVELS = (1, 10, 25, 50)
+TICK_INTERVAL = 0.01
+
+
+async def consume(stream, retrieved_results: list) -> float:
+    """1ストリームを最後まで読み出し、所要時間を返す."""
+    started = time.perf_counter()
+    async for _ in stream.generate_stream(retrieved_results, '有給休暇の申請方法'):
+        pass
+    return time.perf_counter() - started
+
+
+async def watch_loop_lag(stop: asyncio.Event) -> float:
+    """イベントループのタイマーの最大遅延を計測する."""
+    max_lag = 0.0
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK_INTERVAL
+        await asyncio.sleep(TICK_INTERVAL)
+        max_lag = max(max_lag, time.perf_counter() - expected)
+    return max_lag
+
+
+async def run(stream, concurrency: int) -> dict:
+    """指定した同時実行数でストリームを実行する."""
+    retrieved_results = [{'sectionName': 'section', 'documents': build_retrieval_results(10)}]
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(stop))
+    started = time.perf_counter()
+    durations = await asyncio.gather(*(consume(stream, retrieved_results) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return {
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'max_stream': max(durations),
+        'streams_per_sec': concurrency / elapsed,
+        'max_loop_lag': await watcher,
+    }
+
+
+def main():
+    stream = load_lambda_module('SearchStream/lambda_function.py', 'search_stream_lambda')
+    stream.bedrock_runtime = FakeStreamingBedrockRuntime(FIRST_TOKEN_LATENCY, TOKEN_INTERVAL)
+    stream.s3_client = FakeS3Client()
+
+    for concurrency in CONCURRENCY_LEVELS:
+        result = asyncio.run(run(stream, concurrency))
+        print(
+            'concurrency={concurrency:3d} elapsed={elapsed:.2f}s slowest_stream={max_stream:.2f}s '
+            'streams/s={streams_per_sec:.1f} max_loop_lag={max_loop_lag:.3f}s'.format(**result),
+        )
+
+
+if __name__ == '__main__':
+    main()
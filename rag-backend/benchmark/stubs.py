@@ -0,0 +1,556 @@
+"""ベンチマーク用のAWSクライアントのスタブ.
+
+実際のAWSを呼び出さずに、人工的な遅延を入れたレスポンスを返す.
+"""
+import base64
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+BACKEND_ROOT = Path(__file__).parent.parent
+
+
+def load_lambda_module(relative_path: str, module_name: str):
+    """Lambda関数のモジュールをファイルパスから読み込む.
+
+    Args:
+        relative_path (str): rag-backendからの相対パス
+        module_name (str): 読み込み後のモジュール名
+
+    Returns:
+        module: 読み込んだモジュール
+    """
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+    os.environ.setdefault('POWERTOOLS_TRACE_DISABLED', 'true')
+    os.environ.setdefault('POWERTOOLS_LOG_LEVEL', 'WARNING')
+    layer_path = str(BACKEND_ROOT / 'lambda_layer')
+    if layer_path not in sys.path:
+        sys.path.insert(0, layer_path)
+    spec = importlib.util.spec_from_file_location(module_name, BACKEND_ROOT / relative_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_retrieval_results(count: int, source_count: int = 3) -> list:
+    """retrieveのレスポンスに含まれる検索結果を生成する.
+
+    Args:
+        count (int): 検索結果の件数
+        source_count (int): 検索結果に含まれるドキュメント（S3オブジェクト）の数
+
+    Returns:
+        list: 検索結果のリスト
+    """
+    results = []
+    for index in range(count):
+        uri = 's3://bench-bucket/docs/section/manual-{0}.pdf'.format(index % source_count)
+        results.append({
+            'content': {'text': '就業規則 第{0}条 の内容です。'.format(index) * 20},
+            'location': {'type': 'S3', 's3Location': {'uri': uri}},
+            'metadata': {
+                'x-amz-bedrock-kb-source-uri': uri,
+                'x-amz-bedrock-kb-document-page-number': index + 1,
+            },
+            'score': 1.0 - index * 0.01,
+        })
+    return results
+
+
+class LatencyDistribution:
+    """中央値とp95から決めた対数正規分布に従う遅延.
+
+    スタブのlatencyに数値の代わりに指定すると、呼び出しごとに遅延がばらつく.
+    """
+
+    def __init__(self, median: float, p95: float = None, seed: int = None):
+        """初期化.
+
+        Args:
+            median (float): 遅延の中央値（秒）
+            p95 (float): 遅延のp95（秒）. 未指定の場合は中央値の1.5倍
+            seed (int): 乱数のシード
+        """
+        self.median = median
+        self.p95 = p95 if p95 is not None else median * 1.5
+        self.sigma = math.log(self.p95 / median) / 1.645 if median > 0 and self.p95 > median else 0.0
+        self.random = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.median), self.sigma)
+
+    def __bool__(self) -> bool:
+        return self.median > 0
+
+
+def wait(latency) -> None:
+    """遅延（秒、またはLatencyDistribution）の分だけ待機する."""
+    time.sleep(latency.sample() if isinstance(latency, LatencyDistribution) else latency)
+
+
+def load_latency_profile(path: str, seed: int = None) -> dict:
+    """JSONファイルから処理ごとの遅延の分布を読み込む.
+
+    JSONは {"retrieve": {"median": 0.3, "p95": 0.8}, "sign": 0.001, ...} の形式で、
+    数値の場合は固定の遅延とする.
+
+    Args:
+        path (str): JSONファイルのパス
+        seed (int): 乱数のシード
+
+    Returns:
+        dict: 処理名とLatencyDistributionの辞書
+    """
+    with open(path, encoding='utf-8') as file:
+        profile = json.load(file)
+    distributions = {}
+    for index, (name, value) in enumerate(profile.items()):
+        # 処理ごとに異なる乱数列を使用する
+        stage_seed = None if seed is None else seed + index
+        if isinstance(value, dict):
+            distributions[name] = LatencyDistribution(value['median'], value.get('p95'), stage_seed)
+        else:
+            distributions[name] = LatencyDistribution(value, value, stage_seed)
+    return distributions
+
+
+class FakeBedrockAgentRuntime:
+    """bedrock-agent-runtimeのスタブ."""
+
+    def __init__(self, latency: float = 0.3, result_count: int = 10):
+        self.latency = latency
+        self.result_count = result_count
+        self.call_count = 0
+
+    def retrieve(self, **kwargs):
+        self.call_count += 1
+        wait(self.latency)
+        return {'retrievalResults': build_retrieval_results(self.result_count)}
+
+
+class FakeBedrockRuntime:
+    """bedrock-runtimeのスタブ."""
+
+    def __init__(self, latency: float = 1.0, answer: str = '回答です。[^0]'):
+        self.latency = latency
+        self.answer = answer
+        self.call_count = 0
+
+    def invoke_model(self, **kwargs):
+        self.call_count += 1
+        wait(self.latency)
+        body = json.dumps({'content': [{'type': 'text', 'text': self.answer}]})
+        return {'body': io.BytesIO(body.encode())}
+
+
+class FakeEventStream:
+    """invoke_model_with_response_stream のEventStreamのスタブ.
+
+    最初のトークンまでfirst_token_latency秒、以降token_interval秒ごとにトークンを返す.
+    最後のトークンを返し終えた時刻（time.perf_counter）をfinished_atに、閉じた時刻をclosed_atに記録する.
+    """
+
+    def __init__(self, tokens: list, first_token_latency: float, token_interval: float):
+        self.tokens = tokens
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.finished_at = None
+        self.closed_at = None
+
+    def close(self):
+        self.closed_at = time.perf_counter()
+
+    def __iter__(self):
+        wait(self.first_token_latency)
+        message_start = {'type': 'message_start', 'message': {'usage': {'input_tokens': 3000, 'output_tokens': 1}}}
+        yield {'chunk': {'bytes': json.dumps(message_start).encode()}}
+        for index, token in enumerate(self.tokens):
+            if index:
+                wait(self.token_interval)
+            chunk = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': token}}
+            yield {'chunk': {'bytes': json.dumps(chunk).encode()}}
+        self.finished_at = time.perf_counter()
+        yield {'chunk': {'bytes': json.dumps({'type': 'message_stop'}).encode()}}
+
+
+class FakeStreamingBedrockRuntime(FakeBedrockRuntime):
+    """ストリーミングに対応したbedrock-runtimeのスタブ.
+
+    返したEventStreamはstreamsに保持する.
+    """
+
+    def __init__(self, first_token_latency: float = 0.5, token_interval: float = 0.02,
+                 tokens: list = None):
+        super().__init__(latency=first_token_latency)
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.tokens = tokens or ['就業規則', 'によると', '、', '申請', 'は', '2週間前', 'までに', '行います', '。', '[^0]']
+        self.streams = []
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.call_count += 1
+        stream = FakeEventStream(self.tokens, self.first_token_latency, self.token_interval)
+        self.streams.append(stream)
+        return {'body': stream}
+
+
+class FakeStreamingBody:
+    """botocoreのStreamingBodyのスタブ."""
+
+    def __init__(self, body: bytes):
+        self._stream = io.BytesIO(body)
+
+    def read(self, amt: int = None) -> bytes:
+        return self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakeS3Client:
+    """S3クライアントのスタブ.
+
+    アップロードされたオブジェクトはobjectsに、アップロード中のマルチパートアップロードはmultipart_uploadsに保持する.
+    signerにboto3のS3クライアントを指定すると、プレサインURLはsignerで実際に署名する.
+    """
+
+    def __init__(self, latency: float = 0.0, put_latency: float = 0.0, signer=None):
+        self.latency = latency
+        self.put_latency = put_latency
+        self.signer = signer
+        self.call_count = 0
+        self.calls = Counter()
+        self.objects = {}
+        self.checksums = {}
+        self.multipart_uploads = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.call_count += 1
+            self.calls[operation] += 1
+
+    def generate_presigned_url(self, client_method, Params=None, ExpiresIn=3600, **kwargs):
+        self._call('generate_presigned_url')
+        if self.latency:
+            wait(self.latency)
+        if self.signer is not None:
+            return self.signer.generate_presigned_url(client_method, Params=Params, ExpiresIn=ExpiresIn, **kwargs)
+        return 'https://{0}.s3.amazonaws.com/{1}?X-Amz-Expires={2}&sig={3}'.format(
+            Params['Bucket'], Params['Key'], ExpiresIn, self.call_count)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        self._call('upload_file')
+        with open(Filename, 'rb') as file:
+            body = file.read()
+        if self.put_latency:
+            wait(self.put_latency)
+        self.objects[(Bucket, Key)] = body
+
+    def put_object(self, Bucket, Key, Body=b'', ChecksumSHA256=None, **kwargs):
+        """オブジェクトの書き込み（presigned URLへのPUTの代わりにも使用する）.
+
+        ChecksumSHA256を指定した場合は、内容のSHA-256が一致しない書き込みを拒否する.
+        """
+        self._call('put_object')
+        if self.put_latency:
+            wait(self.put_latency)
+        body = Body if isinstance(Body, bytes) else Body.encode()
+        if ChecksumSHA256 is not None:
+            if base64.b64encode(hashlib.sha256(body).digest()).decode() != ChecksumSHA256:
+                raise ClientError({'Error': {'Code': 'BadDigest', 'Message': 'The SHA256 you specified did not match.'}},
+                                  'PutObject')
+            self.checksums[(Bucket, Key)] = ChecksumSHA256
+        else:
+            self.checksums.pop((Bucket, Key), None)
+        self.objects[(Bucket, Key)] = body
+        return {'ETag': '"{0}"'.format(zlib.crc32(body))}
+
+    def _get_object_body(self, Bucket, Key, operation: str) -> bytes:
+        body = self.objects.get((Bucket, Key))
+        if body is None:
+            code = 'NoSuchKey' if operation == 'GetObject' else '404'
+            raise ClientError({'Error': {'Code': code, 'Message': 'Not Found'}}, operation)
+        return body
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('head_object')
+        body = self._get_object_body(Bucket, Key, 'HeadObject')
+        response = {'ContentLength': len(body)}
+        if kwargs.get('ChecksumMode') == 'ENABLED' and (Bucket, Key) in self.checksums:
+            response['ChecksumSHA256'] = self.checksums[(Bucket, Key)]
+        return response
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call('get_object')
+        body = self._get_object_body(Bucket, Key, 'GetObject')
+        return {'Body': FakeStreamingBody(body), 'ContentLength': len(body)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        self.objects.pop((Bucket, Key), None)
+        self.checksums.pop((Bucket, Key), None)
+        return {}
+
+    def _get_upload(self, Key, UploadId, operation: str) -> dict:
+        upload = self.multipart_uploads.get(UploadId)
+        if upload is None or upload['key'] != Key:
+            raise ClientError({'Error': {'Code': 'NoSuchUpload', 'Message': 'The specified upload does not exist.'}},
+                              operation)
+        return upload
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call('create_multipart_upload')
+        with self._lock:
+            upload_id = 'upload-{0}'.format(len(self.multipart_uploads) + 1)
+            self.multipart_uploads[upload_id] = {'key': Key, 'parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b'', **kwargs):
+        """パートのアップロード（presigned URLへのPUTの代わりにベンチマークから呼び出す）."""
+        self._call('upload_part')
+        upload = self._get_upload(Key, UploadId, 'UploadPart')
+        if self.put_latency:
+            wait(self.put_latency)
+        etag = '"{0}"'.format(zlib.crc32(Body))
+        with self._lock:
+            upload['parts'][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def list_parts(self, Bucket, Key, UploadId, MaxParts=1000, PartNumberMarker=0, **kwargs):
+        self._call('list_parts')
+        upload = self._get_upload(Key, UploadId, 'ListParts')
+        with self._lock:
+            numbers = sorted(number for number in upload['parts'] if number > PartNumberMarker)
+            page = numbers[:MaxParts]
+            parts = [
+                {'PartNumber': number, 'ETag': upload['parts'][number][0], 'Size': len(upload['parts'][number][1])}
+                for number in page
+            ]
+        response = {'Parts': parts, 'IsTruncated': len(numbers) > MaxParts}
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = page[-1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call('complete_multipart_upload')
+        upload = self._get_upload(Key, UploadId, 'CompleteMultipartUpload')
+        bodies = []
+        for part in MultipartUpload['Parts']:
+            etag, body = upload['parts'].get(part['PartNumber'], (None, None))
+            if etag != part['ETag']:
+                raise ClientError({'Error': {'Code': 'InvalidPart', 'Message': 'One or more parts could not be found.'}},
+                                  'CompleteMultipartUpload')
+            bodies.append(body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = b''.join(bodies)
+            self.checksums.pop((Bucket, Key), None)
+            del self.multipart_uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call('abort_multipart_upload')
+        self._get_upload(Key, UploadId, 'AbortMultipartUpload')
+        with self._lock:
+            del self.multipart_uploads[UploadId]
+        return {}
+
+
+class FakeDynamoDBTable:
+    """DynamoDBのテーブル（boto3のTableリソース）のローカル代替.
+
+    スキャンはpage_size件ごとにページングし、Segment/TotalSegmentsによる並列スキャンと
+    ProjectionExpressionに対応する. 操作ごとの呼び出し回数をcallsに記録する.
+    """
+
+    def __init__(self, items: list = None, key: str = 'id', page_size: int = 100, latency: float = 0.0):
+        self.key = key
+        self.page_size = page_size
+        self.latency = latency
+        self.calls = Counter()
+        self.items = {item[key]: dict(item) for item in (items or [])}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            wait(self.latency)
+
+    def _segment_of(self, key_value, total_segments: int) -> int:
+        return zlib.crc32(str(key_value).encode()) % total_segments
+
+    def scan(self, Limit=None, ExclusiveStartKey=None, Segment=0, TotalSegments=1,
+             ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call('scan')
+        with self._lock:
+            keys = sorted(key for key in self.items if self._segment_of(key, TotalSegments) == Segment)
+        if ExclusiveStartKey:
+            keys = [key for key in keys if key > ExclusiveStartKey[self.key]]
+        page_size = min(Limit or self.page_size, self.page_size)
+        page = keys[:page_size]
+
+        attributes = None
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            attributes = [names.get(name.strip(), name.strip()) for name in ProjectionExpression.split(',')]
+        items = []
+        for key in page:
+            item = self.items[key]
+            items.append({name: item[name] for name in attributes if name in item} if attributes else dict(item))
+
+        response = {'Items': items, 'Count': len(items)}
+        if len(keys) > page_size:
+            response['LastEvaluatedKey'] = {self.key: page[-1]}
+        return response
+
+    def get_item(self, Key, **kwargs):
+        self._call('get_item')
+        item = self.items.get(Key[self.key])
+        return {'Item': dict(item)} if item else {}
+
+    def _check_condition(self, item, condition_expression):
+        """attribute_exists / attribute_not_exists の条件のみに対応する."""
+        if not condition_expression:
+            return
+        match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((\w+)\)', condition_expression.strip())
+        exists = item is not None and match.group(2) in item
+        if exists != (match.group(1) == 'attribute_exists'):
+            raise ClientError(
+                {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+                'ConditionCheck',
+            )
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        self._call('put_item')
+        with self._lock:
+            self._check_condition(self.items.get(Item[self.key]), ConditionExpression)
+            self.items[Item[self.key]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, **kwargs):
+        """SET式・ADD式に対応した update_item（項目が存在しない場合は作成する）."""
+        self._call('update_item')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        action, expression = UpdateExpression.strip().split(' ', 1)
+        with self._lock:
+            self._check_condition(self.items.get(Key[self.key]), ConditionExpression)
+            item = self.items.setdefault(Key[self.key], dict(Key))
+            if action == 'SET':
+                for name, value in re.findall(r'([#\w]+)\s*=\s*(:\w+)', expression):
+                    item[names.get(name, name)] = values[value]
+            elif action == 'ADD':
+                for name, value in re.findall(r'([#\w]+)\s+(:\w+)', expression):
+                    attribute = names.get(name, name)
+                    item[attribute] = item.get(attribute, 0) + values[value]
+            return {'Attributes': dict(item)}
+
+    def store(self, item: dict):
+        with self._lock:
+            self.items[item[self.key]] = dict(item)
+
+
+class FakeDynamoDBResource:
+    """DynamoDBのサービスリソースのローカル代替.
+
+    batch_write_itemでは、unprocessed_rateの割合の項目を未処理（UnprocessedItems）として返す.
+    """
+
+    def __init__(self, tables: dict, unprocessed_rate: float = 0.0, latency: float = 0.0):
+        self.tables = tables
+        self.unprocessed_rate = unprocessed_rate
+        self.latency = latency
+        self.calls = Counter()
+        self._random = random.Random(0)
+
+    def Table(self, name: str):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.calls['batch_get_item'] += 1
+        if self.latency:
+            wait(self.latency)
+        assert sum(len(request['Keys']) for request in RequestItems.values()) <= 100
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            responses[table_name] = [
+                dict(table.items[key[table.key]]) for key in request['Keys'] if key[table.key] in table.items
+            ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.calls['batch_write_item'] += 1
+        if self.latency:
+            wait(self.latency)
+        assert sum(len(requests) for requests in RequestItems.values()) <= 25
+        for table_name, requests in RequestItems.items():
+            key = self.tables[table_name].key
+            keys = [request['PutRequest']['Item'][key] for request in requests]
+            if len(keys) != len(set(keys)):
+                raise ClientError({'Error': {'Code': 'ValidationException',
+                                             'Message': 'Provided list of item keys contains duplicates'}},
+                                  'BatchWriteItem')
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if self._random.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(table_name, []).append(request)
+                else:
+                    self.tables[table_name].store(request['PutRequest']['Item'])
+        return {'UnprocessedItems': unprocessed}
+
+
+class FakeLambdaContext:
+    """Lambdaコンテキストのスタブ."""
+
+    function_name = 'benchmark'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = 'arn:aws:lambda:local:123456789012:function:benchmark'
+    aws_request_id = 'benchmark'
+
+
+def build_api_gateway_event(method: str, path: str, body=None, query: dict = None) -> dict:
+    """API Gateway REST APIイベントを生成する.
+
+    Args:
+        method (str): HTTPメソッド
+        path (str): リクエストパス
+        body (dict): リクエストボディ
+        query (dict): クエリ文字列のパラメータ
+
+    Returns:
+        dict: イベント
+    """
+    return {
+        'resource': path,
+        'path': path,
+        'httpMethod': method,
+        'headers': {'Content-Type': 'application/json'},
+        'queryStringParameters': query,
+        'pathParameters': None,
+        'requestContext': {'path': path, 'resourcePath': path, 'httpMethod': method},
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False,
+    }
@@ -0,0 +1,293 @@
+"""検索結果（回答）のキャッシュモジュール.
+
+正規化した検索テキストとセクション・カテゴリをキーに、検索・要約の結果をキャッシュする.
+埋め込みベクトルの類似度による類似質問の検索にも対応する.
+類似検索はスコープごとに正規化したベクトルの行列を保持し、1回の行列積でコサイン類似度を計算する.
+セクションごとの世代番号をキーに含めることで、ドキュメント更新時にセクション単位で無効化する.
+セクションごとの世代番号はバックエンドに保存するため、他のLambda（Ingestion・DocumentUpload）からの無効化は
+同じDynamoDBのテーブルを使用する場合のみ反映される. それ以外のバックエンドでは、Knowledge Baseの世代番号
+（最後に完了した取り込みジョブ）をキーに含めて、再取り込み時に全てのキャッシュを無効化する.
+"""
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from typing import TYPE_CHECKING, Any, Callable, Union
+
+from cache import TTLCache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def normalize_query(search_text: str) -> str:
+    """検索テキストを正規化する（全角・半角の統一、空白の圧縮、小文字化）.
+
+    Args:
+        search_text (str): 検索テキスト
+
+    Returns:
+        str: 正規化した検索テキスト
+    """
+    normalized = unicodedata.normalize('NFKC', search_text or '')
+    return ' '.join(normalized.split()).lower()
+
+
+class InMemoryCacheBackend:
+    """プロセス内のキャッシュバックエンド.
+
+    Lambdaのウォームスタート間で共有される. テスト時のローカル代替としても使用する.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self._values = TTLCache(max_size=max_size)
+        self._counters: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Union[str, None]:
+        return self._values.get(key)
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self._values.set(key, value, ttl)
+
+    def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def increment(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class DynamoDBCacheBackend:
+    """DynamoDBのキャッシュバックエンド.
+
+    パーティションキー `cache_key`（文字列）のテーブルを使用する.
+    `expires_at` をテーブルのTTL属性に設定しておくと、期限切れの項目は自動で削除される.
+    """
+
+    def __init__(self, client, table_name: str):
+        """初期化.
+
+        Args:
+            client: boto3のDynamoDBクライアント
+            table_name (str): テーブル名
+        """
+        self.client = client
+        self.table_name = table_name
+
+    def get(self, key: str) -> Union[str, None]:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'cache_key': {'S': key}},
+        ).get('Item')
+        if not item or int(item['expires_at']['N']) <= time.time():
+            return None
+        return item['value']['S']
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'cache_key': {'S': key},
+                'value': {'S': value},
+                'expires_at': {'N': str(int(time.time() + ttl))},
+            },
+        )
+
+    def get_counter(self, key: str) -> int:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'cache_key': {'S': key}},
+        ).get('Item')
+        return int(item['counter']['N']) if item else 0
+
+    def increment(self, key: str) -> int:
+        response = self.client.update_item(
+            TableName=self.table_name,
+            Key={'cache_key': {'S': key}},
+            UpdateExpression='ADD #counter :one',
+            ExpressionAttributeNames={'#counter': 'counter'},
+            ExpressionAttributeValues={':one': {'N': '1'}},
+            ReturnValues='UPDATED_NEW',
+        )
+        return int(response['Attributes']['counter']['N'])
+
+
+class RedisCacheBackend:
+    """Redis互換（GET/SET EX/INCR）のキャッシュバックエンド."""
+
+    def __init__(self, client):
+        """初期化.
+
+        Args:
+            client: redis-py互換のクライアント
+        """
+        self.client = client
+
+    def get(self, key: str) -> Union[str, None]:
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.client.set(key, value, ex=int(ttl))
+
+    def get_counter(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def increment(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+
+def normalize_vector(vector: list) -> 'np.ndarray':
+    """ベクトルをL2ノルムで正規化する（正規化したベクトル同士の内積がコサイン類似度になる）.
+
+    Args:
+        vector (list): ベクトル
+
+    Returns:
+        np.ndarray: 正規化したベクトル. ノルムが0の場合はそのまま返す
+    """
+    # numpyは類似検索を使用する場合のみimportする（コールドスタートで読み込まない）
+    import numpy as np
+
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class AnswerCache:
+    """検索結果のキャッシュ.
+
+    完全一致は正規化した検索テキスト・セクション・カテゴリで判定する.
+    embedを指定した場合、完全一致しない検索テキストも埋め込みベクトルの類似度が
+    similarity_threshold以上であればキャッシュを返す.
+    類似検索用のベクトルはプロセス内にのみ保持する. スコープごとの行列は、そのスコープに
+    キャッシュを設定した時に破棄し、次の類似検索で作り直す.
+    """
+
+    def __init__(self, backend, ttl: int = 1800, embed: Union[Callable[[str], list], None] = None,
+                 similarity_threshold: float = 0.95, max_semantic_entries: int = 1000,
+                 knowledge_base_generation: Union[Callable[[], str], None] = None):
+        """初期化.
+
+        Args:
+            backend: キャッシュバックエンド（InMemoryCacheBackend / DynamoDBCacheBackend / RedisCacheBackend）
+            ttl (int): 有効期限（秒）
+            embed (Callable): テキストを埋め込みベクトルに変換する関数. 未指定の場合は類似検索しない
+            similarity_threshold (float): 類似検索でキャッシュを返すコサイン類似度のしきい値
+            max_semantic_entries (int): 類似検索用に保持するベクトルの最大件数
+            knowledge_base_generation (Callable): Knowledge Baseの世代番号を返す関数. 変わると全てのキャッシュを無効化する
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.knowledge_base_generation = knowledge_base_generation
+        self._vectors = TTLCache(max_size=max_semantic_entries, ttl=ttl)
+        self._embeddings = TTLCache(max_size=max_semantic_entries, ttl=ttl)
+        self._matrices = TTLCache(max_size=max_semantic_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _scope(self, section_name: str, categories: list) -> str:
+        # セクションのみ・カテゴリのみの指定はフィルター無しで全セクションを検索するため、全体の世代番号を使用する
+        generation_section = section_name if section_name and categories else ''
+        generation = self.backend.get_counter(self._generation_key(generation_section))
+        knowledge_base_generation = self.knowledge_base_generation() if self.knowledge_base_generation else ''
+        return json.dumps([section_name or '', sorted(categories or []), generation, knowledge_base_generation],
+                          ensure_ascii=False)
+
+    @staticmethod
+    def _generation_key(section_name: str) -> str:
+        return 'generation#{0}'.format(section_name or '')
+
+    @staticmethod
+    def _answer_key(scope: str, normalized_text: str) -> str:
+        digest = hashlib.sha256('{0}\n{1}'.format(scope, normalized_text).encode()).hexdigest()
+        return 'answer#{0}'.format(digest)
+
+    def get(self, search_text: str, section_name: str, categories: list) -> Union[Any, None]:
+        """キャッシュから検索結果を取得する.
+
+        Args:
+            search_text (str): 検索テキスト
+            section_name (str): セクション名
+            categories (list): カテゴリのリスト
+
+        Returns:
+            Any: キャッシュされた検索結果. 存在しない場合はNone
+        """
+        scope = self._scope(section_name, categories)
+        normalized_text = normalize_query(search_text)
+        value = self.backend.get(self._answer_key(scope, normalized_text))
+        if value is None and self.embed:
+            similar_key = self._find_similar_key(scope, normalized_text)
+            if similar_key:
+                value = self.backend.get(similar_key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, search_text: str, section_name: str, categories: list, result: Any) -> None:
+        """検索結果をキャッシュに設定する.
+
+        Args:
+            search_text (str): 検索テキスト
+            section_name (str): セクション名
+            categories (list): カテゴリのリスト
+            result (Any): JSONに変換可能な検索結果
+        """
+        scope = self._scope(section_name, categories)
+        normalized_text = normalize_query(search_text)
+        answer_key = self._answer_key(scope, normalized_text)
+        self.backend.set(answer_key, json.dumps(result, ensure_ascii=False), self.ttl)
+        if self.embed:
+            self._vectors.set(answer_key, (scope, self._embed(normalized_text)))
+            with self._lock:
+                self._matrices.delete(scope)
+
+    def invalidate_section(self, section_name: str) -> None:
+        """セクションの世代番号を更新し、そのセクションのキャッシュを無効化する.
+
+        フィルター無しの検索結果には全セクションのドキュメントが含まれるため、併せて無効化する.
+
+        Args:
+            section_name (str): セクション名
+        """
+        self.backend.increment(self._generation_key(section_name))
+        if section_name:
+            self.backend.increment(self._generation_key(''))
+
+    def _embed(self, normalized_text: str) -> 'np.ndarray':
+        vector = self._embeddings.get(normalized_text)
+        if vector is None:
+            vector = normalize_vector(self.embed(normalized_text))
+            self._embeddings.set(normalized_text, vector)
+        return vector
+
+    def _get_matrix(self, scope: str) -> tuple:
+        """スコープのキーのリストと、正規化したベクトルの行列（件数×次元）を取得する."""
+        import numpy as np
+
+        with self._lock:
+            entry = self._matrices.get(scope)
+            if entry is None:
+                candidates = [(key, vector) for key, (entry_scope, vector) in self._vectors.items()
+                              if entry_scope == scope]
+                matrix = np.stack([vector for _, vector in candidates]) if candidates else None
+                entry = ([key for key, _ in candidates], matrix)
+                self._matrices.set(scope, entry)
+            return entry
+
+    def _find_similar_key(self, scope: str, normalized_text: str) -> Union[str, None]:
+        import numpy as np
+
+        keys, matrix = self._get_matrix(scope)
+        if not keys:
+            return None
+        similarities = matrix @ self._embed(normalized_text)
+        positions = np.flatnonzero(similarities >= self.similarity_threshold)
+        # 類似度の高い順に、有効期限切れ・削除済みでないキーを返す
+        for position in positions[np.argsort(-similarities[positions])]:
+            if self._vectors.get(keys[position]) is not None:
+                return keys[position]
+        return None
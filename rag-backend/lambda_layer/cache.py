@@ -0,0 +1,114 @@
+"""TTL付きLRUキャッシュのユーティリティモジュール."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Union
+
+_MISSING = object()
+
+
+class TTLCache:
+    """有効期限（TTL）と最大件数を持つLRUキャッシュ.
+
+    モジュールスコープで生成することで、Lambdaのウォームスタート間で共有できる.
+    複数スレッドから同時に利用できる.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600,
+                 clock: Callable[[], float] = time.monotonic):
+        """初期化.
+
+        Args:
+            max_size (int): 保持する最大件数. 超えた場合は最も古く使われたものから削除する
+            ttl (float): デフォルトの有効期限（秒）
+            clock (Callable): 現在時刻（秒）を返す関数
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """キャッシュから値を取得する.
+
+        Args:
+            key (Hashable): キー
+            default (Any): キャッシュに存在しない場合の値
+
+        Returns:
+            Any: キャッシュされた値
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Union[float, None] = None) -> None:
+        """キャッシュに値を設定する.
+
+        Args:
+            key (Hashable): キー
+            value (Any): 値
+            ttl (float): 有効期限（秒）. 未指定の場合はデフォルトの有効期限
+        """
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """キャッシュから値を削除する.
+
+        Args:
+            key (Hashable): キー
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """キャッシュを全て削除する."""
+        with self._lock:
+            self._entries.clear()
+
+    def items(self) -> list:
+        """有効期限内のキーと値の一覧を取得する（LRUの順序は更新しない）.
+
+        Returns:
+            list: (キー, 値) のリスト
+        """
+        now = self.clock()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def stats(self) -> dict:
+        """キャッシュの統計情報を取得する.
+
+        Returns:
+            dict: 件数・ヒット数・ミス数・削除数
+        """
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
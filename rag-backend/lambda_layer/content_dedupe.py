@@ -0,0 +1,232 @@
+"""アップロードされたドキュメントを内容のハッシュ（SHA-256）で重複排除するモジュール.
+
+同じ内容のドキュメントは最初にアップロードされたキー（正規のキー）のみを取り込み、
+2回目以降のアップロードは正規のキーのメタデータにセクション・カテゴリ（スコープ）を追加する.
+複数のスコープを持つドキュメントのメタデータには、section・categoryに加えて
+sections・categories・scopes（セクションとカテゴリのJSON配列の文字列）のリストを設定し、検索フィルターはこれらも参照する.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import threading
+from typing import Iterable, Tuple, Union
+
+from botocore.exceptions import ClientError
+
+# ストリームから読み込む際の1回あたりのバイト数
+CHUNK_SIZE = 1024 * 1024
+
+
+def normalize_content_hash(value: str) -> str:
+    """クライアントから受け取ったSHA-256を16進数の小文字に変換する.
+
+    Args:
+        value (str): 16進数（64文字）、またはBase64（S3のChecksumSHA256と同じ形式）のSHA-256
+
+    Returns:
+        str: 16進数の小文字のSHA-256
+
+    Raises:
+        ValueError: SHA-256として不正な場合
+    """
+    value = (value or '').strip()
+    if len(value) == 64:
+        try:
+            return bytes.fromhex(value).hex()
+        except ValueError:
+            pass
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        digest = b''
+    if len(digest) != hashlib.sha256().digest_size:
+        raise ValueError('contentHashにはSHA-256（16進数またはBase64）を指定してください')
+    return digest.hex()
+
+
+def to_checksum_sha256(content_hash: str) -> str:
+    """16進数のSHA-256をS3のChecksumSHA256（Base64）に変換する."""
+    return base64.b64encode(bytes.fromhex(content_hash)).decode()
+
+
+def compute_content_hash(chunks: Iterable[bytes]) -> str:
+    """ストリームから読み込んだバイト列のSHA-256を計算する.
+
+    Args:
+        chunks (Iterable[bytes]): バイト列（StreamingBody.iter_chunksなど）
+
+    Returns:
+        str: 16進数のSHA-256
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_scope(section_name: str, category_name: str) -> str:
+    """セクション・カテゴリをスコープの文字列（JSON配列）に変換する.
+
+    区切り文字を使わないため、セクション名・カテゴリ名に/などが含まれていても元に戻せる.
+    """
+    return json.dumps([section_name, category_name], ensure_ascii=False)
+
+
+def parse_scope(scope: str) -> Tuple[str, str]:
+    """スコープの文字列をセクション・カテゴリに変換する."""
+    section_name, category_name = json.loads(scope)
+    return section_name, category_name
+
+
+def build_metadata_attributes(section_name: str, category_name: str, scopes: Iterable[str] = ()) -> dict:
+    """メタデータの属性を作成する.
+
+    Args:
+        section_name (str): ドキュメントをアップロードしたセクション
+        category_name (str): ドキュメントをアップロードしたカテゴリ
+        scopes (Iterable[str]): 重複排除で同じ内容がアップロードされた全てのスコープ
+
+    Returns:
+        dict: section・category と、複数のスコープがある場合は sections・categories・scopes
+    """
+    attributes = {'section': section_name, 'category': category_name}
+    scopes = sorted(set(scopes) | {format_scope(section_name, category_name)})
+    if len(scopes) > 1:
+        pairs = [parse_scope(scope) for scope in scopes]
+        attributes['sections'] = sorted({section for section, _ in pairs})
+        attributes['categories'] = sorted({category for _, category in pairs})
+        attributes['scopes'] = scopes
+    return attributes
+
+
+class InMemoryContentHashIndex:
+    """プロセス内のハッシュのインデックス.
+
+    コールドスタートで消えるため、ローカルでのテスト時に使用する.
+    """
+
+    def __init__(self):
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+
+    def register(self, content_hash: str, file_key: str, scope: str, now: float) -> Tuple[bool, dict]:
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                return False, dict(entry, scopes=set(entry['scopes']))
+            entry = {'canonicalKey': file_key, 'canonicalScope': scope, 'scopes': {scope}, 'createdAt': now}
+            self._entries[content_hash] = entry
+            return True, dict(entry, scopes=set(entry['scopes']))
+
+    def get(self, content_hash: str) -> Union[dict, None]:
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            return dict(entry, scopes=set(entry['scopes'])) if entry else None
+
+    def add_scope(self, content_hash: str, scope: str) -> dict:
+        with self._lock:
+            entry = self._entries[content_hash]
+            entry['scopes'].add(scope)
+            return dict(entry, scopes=set(entry['scopes']))
+
+    def replace_canonical(self, content_hash: str, old_key: str, file_key: str, scope: str, now: float) -> bool:
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is None or entry['canonicalKey'] != old_key:
+                return False
+            entry.update(canonicalKey=file_key, canonicalScope=scope, createdAt=now)
+            entry['scopes'].add(scope)
+            return True
+
+
+class DynamoDBContentHashIndex:
+    """DynamoDBのハッシュのインデックス.
+
+    パーティションキー `content_hash`（文字列）のテーブルを使用する.
+    スコープは文字列セットに追加するため、同時に同じ内容がアップロードされても失われない.
+    """
+
+    def __init__(self, client, table_name: str):
+        """初期化.
+
+        Args:
+            client: boto3のDynamoDBクライアント
+            table_name (str): テーブル名
+        """
+        self.client = client
+        self.table_name = table_name
+
+    @staticmethod
+    def _to_entry(item: dict) -> dict:
+        return {
+            'canonicalKey': item['canonical_key']['S'],
+            'canonicalScope': item['canonical_scope']['S'],
+            'scopes': set(item['scopes']['SS']),
+            'createdAt': float(item['created_at']['N']),
+        }
+
+    def register(self, content_hash: str, file_key: str, scope: str, now: float) -> Tuple[bool, dict]:
+        """ハッシュを正規のキーとして登録する.
+
+        Returns:
+            Tuple[bool, dict]: 登録したかどうかと、登録済みの場合は既存のエントリ
+        """
+        item = {
+            'content_hash': {'S': content_hash},
+            'canonical_key': {'S': file_key},
+            'canonical_scope': {'S': scope},
+            'scopes': {'SS': [scope]},
+            'created_at': {'N': repr(now)},
+        }
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=item,
+                ConditionExpression='attribute_not_exists(content_hash)',
+            )
+            return True, self._to_entry(item)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+        return False, self.get(content_hash)
+
+    def get(self, content_hash: str) -> Union[dict, None]:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'content_hash': {'S': content_hash}},
+            ConsistentRead=True,
+        ).get('Item')
+        return self._to_entry(item) if item else None
+
+    def add_scope(self, content_hash: str, scope: str) -> dict:
+        response = self.client.update_item(
+            TableName=self.table_name,
+            Key={'content_hash': {'S': content_hash}},
+            UpdateExpression='ADD scopes :scope',
+            ExpressionAttributeValues={':scope': {'SS': [scope]}},
+            ReturnValues='ALL_NEW',
+        )
+        return self._to_entry(response['Attributes'])
+
+    def replace_canonical(self, content_hash: str, old_key: str, file_key: str, scope: str, now: float) -> bool:
+        """正規のキーを置き換える（正規のキーがold_keyのままの場合のみ）. 追加済みのスコープは引き継ぐ."""
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'content_hash': {'S': content_hash}},
+                UpdateExpression='SET canonical_key = :key, canonical_scope = :scope, created_at = :now ADD scopes :scopes',
+                ConditionExpression='canonical_key = :old_key',
+                ExpressionAttributeValues={
+                    ':key': {'S': file_key},
+                    ':scope': {'S': scope},
+                    ':scopes': {'SS': [scope]},
+                    ':now': {'N': repr(now)},
+                    ':old_key': {'S': old_key},
+                },
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+        return False
@@ -0,0 +1,81 @@
+"""プロンプトに含めるドキュメントをトークン数の上限内に収めるモジュール."""
+import math
+from typing import Any, Callable, Tuple
+
+# 重複判定に使用する文字n-gramの長さ
+SHINGLE_SIZE = 5
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する.
+
+    日本語などの全角文字は1文字あたり1トークン、それ以外は4文字あたり1トークンとして数える.
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        int: 概算のトークン数
+    """
+    wide_count = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide_count + math.ceil((len(text) - wide_count) / 4)
+
+
+def _shingles(text: str) -> set:
+    normalized = ''.join(text.split())
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[index:index + SHINGLE_SIZE] for index in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def pack_documents(documents: list, token_budget: int,
+                   get_text: Callable[[Any], str], get_score: Callable[[Any], float],
+                   overlap_threshold: float = 0.8) -> Tuple[list, dict]:
+    """スコアの高い順にドキュメントを選び、トークン数の上限内に収める.
+
+    採用済みのドキュメントとテキストの大部分が重複するドキュメント
+    （チャンクのオーバーラップなど）は除外する.
+
+    Args:
+        documents (list): ドキュメントのリスト
+        token_budget (int): トークン数の上限. 0以下の場合は上限なし
+        get_text (Callable): ドキュメントからテキストを取得する関数
+        get_score (Callable): ドキュメントからスコアを取得する関数
+        overlap_threshold (float): 重複とみなす割合（採用済みのドキュメントに含まれる文字n-gramの割合）
+
+    Returns:
+        Tuple[list, dict]: 採用したドキュメント（スコアの高い順）と、採用・除外の件数とトークン数
+    """
+    packed = []
+    packed_shingles = []
+    stats = {
+        'total_chunks': len(documents),
+        'packed_chunks': 0,
+        'packed_tokens': 0,
+        'dropped_chunks': 0,
+        'dropped_tokens': 0,
+        'duplicate_chunks': 0,
+    }
+
+    for document in sorted(documents, key=get_score, reverse=True):
+        text = get_text(document)
+        tokens = estimate_tokens(text)
+
+        shingles = _shingles(text)
+        if shingles and any(len(shingles & other) >= overlap_threshold * len(shingles) for other in packed_shingles):
+            stats['duplicate_chunks'] += 1
+            stats['dropped_chunks'] += 1
+            stats['dropped_tokens'] += tokens
+            continue
+
+        if token_budget > 0 and stats['packed_tokens'] + tokens > token_budget:
+            stats['dropped_chunks'] += 1
+            stats['dropped_tokens'] += tokens
+            continue
+
+        packed.append(document)
+        packed_shingles.append(shingles)
+        stats['packed_chunks'] += 1
+        stats['packed_tokens'] += tokens
+
+    return packed, stats
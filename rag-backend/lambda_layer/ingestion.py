@@ -0,0 +1,554 @@
+"""Knowledge Baseの取り込みジョブをまとめて開始するモジュール.
+
+アップロードされたS3のキーを待機中として記録し、一定時間（デバウンス時間）新しいキーが
+追加されなかった時点で、待機中のキーをまとめて1つの取り込みジョブを開始する.
+S3のデータソースの取り込みジョブは前回の取り込みからの差分のみを処理するため、
+アップロードごとや手動での全件の再同期の代わりに、まとめた単位で差分を取り込む.
+"""
+import hashlib
+import itertools
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from urllib.parse import unquote_plus
+
+from botocore.exceptions import ClientError
+
+DOCUMENT_PREFIX = 'docs/'
+METADATA_SUFFIX = '.metadata.json'
+# DynamoDBのbatch_write_itemで1回に書き込める最大件数
+BATCH_WRITE_SIZE = 25
+# 未処理の項目を再送する最大回数
+BATCH_WRITE_MAX_RETRIES = 8
+# 取り込みジョブの終了状態
+TERMINAL_STATUSES = ('COMPLETE', 'FAILED', 'STOPPED')
+
+
+def get_document_key(key: str) -> Union[str, None]:
+    """S3のキーから取り込み対象のドキュメントのキーを返す.
+
+    メタデータファイルのキーはドキュメントのキーに変換する. docs/配下以外のキーはNoneを返す.
+
+    Args:
+        key (str): S3のキー
+
+    Returns:
+        str: ドキュメントのキー
+    """
+    if not key.startswith(DOCUMENT_PREFIX) or key.endswith('/'):
+        return None
+    return key[:-len(METADATA_SUFFIX)] if key.endswith(METADATA_SUFFIX) else key
+
+
+def get_s3_objects(records: list) -> List[Tuple[str, str]]:
+    """S3のイベント（SQS経由を含む）のレコードからバケット名とオブジェクトのキーを取得する.
+
+    Args:
+        records (list): イベントのRecords
+
+    Returns:
+        List[Tuple[str, str]]: (バケット名, S3のキー) のリスト
+    """
+    objects = []
+    for record in records:
+        if record.get('eventSource') == 'aws:sqs':
+            objects.extend(get_s3_objects(json.loads(record['body']).get('Records', [])))
+        elif record.get('eventSource') == 'aws:s3':
+            objects.append((record['s3'].get('bucket', {}).get('name', ''), unquote_plus(record['s3']['object']['key'])))
+    return objects
+
+
+def get_s3_keys(records: list) -> List[str]:
+    """S3のイベント（SQS経由を含む）のレコードからオブジェクトのキーを取得する."""
+    return [key for _, key in get_s3_objects(records)]
+
+
+def read_shared_sections(s3_client, objects: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """メタデータファイルを読み込み、重複排除で共有されたドキュメントを参照する全てのセクションを返す.
+
+    共有されたドキュメントのメタデータファイルは正規のキー（1つのセクション）の配下にあるため、
+    キーからは他のセクションが分からない. 削除済みなどで読み込めないメタデータファイルは無視する.
+
+    Args:
+        s3_client: boto3のS3クライアント
+        objects (Iterable[Tuple[str, str]]): (バケット名, S3のキー) のリスト
+
+    Returns:
+        Dict[str, List[str]]: ドキュメントのキーごとのセクション（複数のセクションから参照される場合のみ）
+    """
+    sections = {}
+    for bucket, key in objects:
+        document_key = get_document_key(key)
+        if not document_key or not key.endswith(METADATA_SUFFIX):
+            continue
+        try:
+            body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                continue
+            raise
+        shared = json.loads(body).get('metadataAttributes', {}).get('sections') or []
+        if len(shared) > 1:
+            sections[document_key] = sorted(shared)
+    return sections
+
+
+def get_section_name(key: str) -> str:
+    """ドキュメントのキー（docs/{セクション名}/{ファイル名}）からセクション名を返す."""
+    return key.split('/')[1]
+
+
+class InMemoryIngestionStore:
+    """プロセス内の待機中のキー・取り込みジョブの保存先.
+
+    コールドスタートで消えるため、ローカルでのテスト時に使用する.
+    """
+
+    def __init__(self):
+        self._pending: dict = {}
+        self._jobs: dict = {}
+        self._job_keys: dict = {}
+        self._lock = threading.Lock()
+
+    def add_pending(self, keys: Iterable[str], now: float, sections: Union[Dict[str, List[str]], None] = None,
+                    attempts: Union[Dict[str, int], None] = None) -> None:
+        with self._lock:
+            for key in keys:
+                entry = self._pending.get(key)
+                self._pending[key] = {
+                    'key': key,
+                    'added_at': entry['added_at'] if entry else now,
+                    'updated_at': now,
+                    'sections': sorted(set(entry['sections'] if entry else []) | set((sections or {}).get(key, []))),
+                    'attempts': (attempts or {}).get(key, 0),
+                }
+
+    def list_pending(self) -> list:
+        with self._lock:
+            return [dict(entry, sections=list(entry['sections'])) for entry in self._pending.values()]
+
+    def remove_pending(self, entries: list) -> None:
+        with self._lock:
+            for entry in entries:
+                current = self._pending.get(entry['key'])
+                # 取り込みジョブの開始後に再度アップロードされたキーは残す
+                if current is not None and current['updated_at'] <= entry['updated_at']:
+                    del self._pending[entry['key']]
+
+    def put_job(self, job: dict) -> None:
+        with self._lock:
+            if 'keys' in job:
+                self._job_keys[job['ingestionJobId']] = dict(job['keys'])
+            self._jobs[job['ingestionJobId']] = summarize_job(job)
+
+    def get_job_keys(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._job_keys.get(job_id, {}))
+
+    def get_job(self, job_id: str) -> Union[dict, None]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self, limit: int) -> list:
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job['startedAt'], reverse=True)
+            return [dict(job) for job in jobs[:limit]]
+
+
+class DynamoDBIngestionStore:
+    """DynamoDBの待機中のキー・取り込みジョブの保存先.
+
+    パーティションキー `pk`（文字列）・ソートキー `sk`（文字列）のテーブルを使用する.
+    待機中のキーは pk=pending、取り込みジョブは pk=job に保存する.
+    取り込みジョブの対象のキーは、項目の上限（400KB）を超えないよう pk=job#{取り込みジョブのID} に1キー1項目で保存する.
+    `expires_at` をテーブルのTTL属性に設定しておくと、古い取り込みジョブは自動で削除される.
+    """
+
+    def __init__(self, client, table_name: str, job_ttl: int = 7 * 24 * 3600,
+                 max_retries: int = BATCH_WRITE_MAX_RETRIES):
+        """初期化.
+
+        Args:
+            client: boto3のDynamoDBクライアント
+            table_name (str): テーブル名
+            job_ttl (int): 取り込みジョブを保持する期間（秒）
+            max_retries (int): batch_write_itemの未処理の項目を再送する最大回数
+        """
+        self.client = client
+        self.table_name = table_name
+        self.job_ttl = job_ttl
+        self.max_retries = max_retries
+
+    def _query(self, partition: str) -> list:
+        items = []
+        query_kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'pk = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': partition}},
+            'ConsistentRead': True,
+        }
+        while True:
+            response = self.client.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def add_pending(self, keys: Iterable[str], now: float, sections: Union[Dict[str, List[str]], None] = None,
+                    attempts: Union[Dict[str, int], None] = None) -> None:
+        for key in keys:
+            update_expression = 'SET added_at = if_not_exists(added_at, :now), updated_at = :now, attempts = :attempts'
+            values = {':now': {'N': repr(now)}, ':attempts': {'N': str((attempts or {}).get(key, 0))}}
+            if (sections or {}).get(key):
+                update_expression += ' ADD sections :sections'
+                values[':sections'] = {'SS': sections[key]}
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'pk': {'S': 'pending'}, 'sk': {'S': key}},
+                UpdateExpression=update_expression,
+                ExpressionAttributeValues=values,
+            )
+
+    def list_pending(self) -> list:
+        return [
+            {'key': item['sk']['S'], 'added_at': float(item['added_at']['N']),
+             'updated_at': float(item['updated_at']['N']), 'sections': sorted(item.get('sections', {}).get('SS', [])),
+             'attempts': int(item.get('attempts', {}).get('N', '0'))}
+            for item in self._query('pending')
+        ]
+
+    def remove_pending(self, entries: list) -> None:
+        for entry in entries:
+            try:
+                # 取り込みジョブの開始後に再度アップロードされたキーは残す
+                self.client.delete_item(
+                    TableName=self.table_name,
+                    Key={'pk': {'S': 'pending'}, 'sk': {'S': entry['key']}},
+                    ConditionExpression='updated_at <= :updated_at',
+                    ExpressionAttributeValues={':updated_at': {'N': repr(entry['updated_at'])}},
+                )
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+
+    def put_job(self, job: dict) -> None:
+        """取り込みジョブを保存する. keysを含む場合は、取り込みジョブより先に対象のキーを保存する."""
+        expires_at = {'N': str(int(time.time() + self.job_ttl))}
+        if 'keys' in job:
+            self._put_job_keys(job['ingestionJobId'], job['keys'], expires_at)
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'pk': {'S': 'job'},
+                'sk': {'S': job['ingestionJobId']},
+                'job': {'S': json.dumps(summarize_job(job), ensure_ascii=False)},
+                'expires_at': expires_at,
+            },
+        )
+
+    def _put_job_keys(self, job_id: str, keys: Dict[str, int], expires_at: dict) -> None:
+        requests = [
+            {'PutRequest': {'Item': {'pk': {'S': 'job#' + job_id}, 'sk': {'S': key},
+                                     'attempts': {'N': str(attempts)}, 'expires_at': expires_at}}}
+            for key, attempts in sorted(keys.items())
+        ]
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            request_items = {self.table_name: requests[start:start + BATCH_WRITE_SIZE]}
+            for attempt in range(self.max_retries + 1):
+                request_items = self.client.batch_write_item(RequestItems=request_items).get('UnprocessedItems')
+                if not request_items:
+                    break
+                if attempt < self.max_retries:
+                    # 未処理の項目は指数バックオフで再送する
+                    time.sleep(min(0.05 * 2 ** attempt, 2.0))
+            else:
+                raise RuntimeError('取り込みジョブ {0} の対象のキーのうち {1} 件を保存できませんでした'.format(
+                    job_id, len(request_items.get(self.table_name, []))))
+
+    def get_job_keys(self, job_id: str) -> Dict[str, int]:
+        return {item['sk']['S']: int(item.get('attempts', {}).get('N', '0')) for item in self._query('job#' + job_id)}
+
+    def get_job(self, job_id: str) -> Union[dict, None]:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'pk': {'S': 'job'}, 'sk': {'S': job_id}},
+            ConsistentRead=True,
+        ).get('Item')
+        return json.loads(item['job']['S']) if item else None
+
+    def list_jobs(self, limit: int) -> list:
+        jobs = [json.loads(item['job']['S']) for item in self._query('job')]
+        return sorted(jobs, key=lambda job: job['startedAt'], reverse=True)[:limit]
+
+
+class IngestionCoordinator:
+    """アップロードされたキーをデバウンス時間ごとにまとめ、1つの取り込みジョブを開始する.
+
+    最後のキーの追加からdebounce_seconds秒経過するか、最初のキーの追加からmax_wait_seconds秒経過すると
+    flushで取り込みジョブを開始する. 実行中の取り込みジョブがある場合は、その完了後にまとめて開始する.
+    失敗した取り込みジョブのキーは待機中に戻し、max_attempts回失敗したキーは取り込みを諦めてon_abandonで通知する.
+    """
+
+    def __init__(self, client, knowledge_base_id: str, data_source_id: str, store,
+                 debounce_seconds: float = 60, max_wait_seconds: float = 600,
+                 on_complete: Union[Callable[[dict], None], None] = None,
+                 max_attempts: int = 3,
+                 on_abandon: Union[Callable[[dict, List[str]], None], None] = None,
+                 clock: Callable[[], float] = time.time):
+        """初期化.
+
+        Args:
+            client: boto3のbedrock-agentクライアント（またはLocalIngestionClient）
+            knowledge_base_id (str): Knowledge BaseのID
+            data_source_id (str): データソースのID
+            store: 保存先（InMemoryIngestionStore / DynamoDBIngestionStore）
+            debounce_seconds (float): 最後のキーの追加から取り込みジョブを開始するまでの時間（秒）
+            max_wait_seconds (float): 最初のキーの追加から取り込みジョブを開始するまでの最大の時間（秒）
+            on_complete (Callable): 取り込みジョブが完了した際に呼び出す関数
+            max_attempts (int): 1つのキーの取り込みを試行する最大回数
+            on_abandon (Callable): 取り込みを諦めたキーがある場合に、取り込みジョブとキーを引数に呼び出す関数
+            clock (Callable): 現在時刻（エポック秒）を返す関数
+        """
+        self.client = client
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.store = store
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.on_complete = on_complete
+        self.max_attempts = max_attempts
+        self.on_abandon = on_abandon
+        self.clock = clock
+
+    def add(self, keys: Iterable[str], sections: Union[Dict[str, List[str]], None] = None) -> int:
+        """S3のキーを待機中に追加する.
+
+        Args:
+            keys (Iterable[str]): S3のキー（メタデータファイル・docs/配下以外のキーを含んでもよい）
+            sections (Dict[str, List[str]]): ドキュメントのキーごとの、キー以外に参照するセクション
+                （read_shared_sectionsの結果）. 取り込みジョブの完了時にこれらのセクションも無効化する
+
+        Returns:
+            int: 追加したドキュメントの数
+        """
+        document_keys = {document_key for document_key in map(get_document_key, keys) if document_key}
+        if document_keys:
+            self.store.add_pending(sorted(document_keys), self.clock(), sections)
+        return len(document_keys)
+
+    def get_flush_at(self, pending: list) -> Union[float, None]:
+        """待機中のキーの取り込みジョブを開始できる時刻を返す."""
+        if not pending:
+            return None
+        return min(max(entry['updated_at'] for entry in pending) + self.debounce_seconds,
+                   min(entry['added_at'] for entry in pending) + self.max_wait_seconds)
+
+    def refresh(self, job: dict) -> dict:
+        """取り込みジョブの状態を取得して保存する.
+
+        取り込みジョブが完了した場合はon_completeを呼び出し、失敗した場合は対象のキーを待機中に戻す.
+        max_attempts回失敗したキーは待機中に戻さず、取り込みジョブのabandonedKeyCountに件数を記録する.
+
+        Args:
+            job (dict): 保存している取り込みジョブ
+
+        Returns:
+            dict: 更新した取り込みジョブ
+        """
+        if job['status'] in TERMINAL_STATUSES:
+            return job
+        response = self.client.get_ingestion_job(
+            knowledgeBaseId=self.knowledge_base_id,
+            dataSourceId=self.data_source_id,
+            ingestionJobId=job['ingestionJobId'],
+        )['ingestionJob']
+        if response['status'] == job['status']:
+            return job
+
+        job = dict(summarize_job(job), status=response['status'], updatedAt=self.clock(),
+                   statistics=response.get('statistics', {}), failureReasons=response.get('failureReasons', []))
+        abandoned = []
+        if job['status'] in ('FAILED', 'STOPPED'):
+            attempts = {key: count + 1 for key, count in self.store.get_job_keys(job['ingestionJobId']).items()}
+            retry = {key: count for key, count in attempts.items() if count < self.max_attempts}
+            abandoned = sorted(key for key in attempts if key not in retry)
+            job['abandonedKeyCount'] = len(abandoned)
+            self.store.add_pending(sorted(retry), self.clock(), attempts=retry)
+        self.store.put_job(job)
+        if job['status'] == 'COMPLETE' and self.on_complete is not None:
+            self.on_complete(job)
+        elif abandoned and self.on_abandon is not None:
+            self.on_abandon(job, abandoned)
+        return job
+
+    def active_job(self) -> Union[dict, None]:
+        """実行中の取り込みジョブを返す（ない場合はNone）."""
+        jobs = self.store.list_jobs(1)
+        if not jobs:
+            return None
+        job = self.refresh(jobs[0])
+        return job if job['status'] not in TERMINAL_STATUSES else None
+
+    def flush(self, force: bool = False) -> Union[dict, None]:
+        """取り込みジョブを開始できる場合は、待機中の全てのキーをまとめて取り込みジョブを開始する.
+
+        Args:
+            force (bool): デバウンス時間の経過を待たずに開始するかどうか
+
+        Returns:
+            dict: 開始した取り込みジョブ（開始しなかった場合はNone）
+        """
+        pending = self.store.list_pending()
+        if not pending:
+            return None
+        now = self.clock()
+        if not force and now < self.get_flush_at(pending):
+            return None
+        if self.active_job() is not None:
+            return None
+
+        keys = sorted(entry['key'] for entry in pending)
+        # 同じ待機中のキーで重複して開始しないよう、キーと最終更新時刻からclientTokenを作成する
+        window_id = hashlib.sha256(json.dumps(
+            [keys, max(entry['updated_at'] for entry in pending)]).encode()).hexdigest()
+        try:
+            response = self.client.start_ingestion_job(
+                knowledgeBaseId=self.knowledge_base_id,
+                dataSourceId=self.data_source_id,
+                clientToken=window_id,
+                description='{0} documents'.format(len(keys)),
+            )['ingestionJob']
+        except ClientError as e:
+            # 手動での同期など、他の取り込みジョブが実行中の場合は次回に開始する
+            if e.response.get('Error', {}).get('Code') == 'ConflictException':
+                return None
+            raise
+
+        job = {
+            'ingestionJobId': response['ingestionJobId'],
+            'status': response['status'],
+            'windowId': window_id,
+            'keyCount': len(keys),
+            'keys': {entry['key']: entry['attempts'] for entry in pending},
+            'sections': sorted({get_section_name(entry['key']) for entry in pending}
+                               | {section for entry in pending for section in entry['sections']}),
+            'firstAddedAt': min(entry['added_at'] for entry in pending),
+            'startedAt': now,
+            'updatedAt': now,
+            'statistics': {},
+            'failureReasons': [],
+        }
+        self.store.put_job(job)
+        self.store.remove_pending(pending)
+        return job
+
+    def get_job_keys(self, job_id: str) -> Dict[str, int]:
+        """取り込みジョブの対象のキーと、それぞれのこれまでに失敗した回数を返す."""
+        return self.store.get_job_keys(job_id)
+
+    def get_job(self, job_id: str) -> Union[dict, None]:
+        """取り込みジョブを状態を更新して返す（存在しない場合はNone）."""
+        job = self.store.get_job(job_id)
+        return self.refresh(job) if job else None
+
+    def status(self, limit: int = 20) -> dict:
+        """待機中のキーと、直近の取り込みジョブの状態を返す.
+
+        Args:
+            limit (int): 返す取り込みジョブの最大数
+
+        Returns:
+            dict: 待機中のキーの数・開始予定時刻と、実行中・直近の取り込みジョブ
+        """
+        active = self.active_job()
+        pending = self.store.list_pending()
+        jobs = self.store.list_jobs(limit)
+        return {
+            'pending': {
+                'count': len(pending),
+                'sections': sorted({get_section_name(entry['key']) for entry in pending}
+                                   | {section for entry in pending for section in entry['sections']}),
+                'flushAt': self.get_flush_at(pending),
+            },
+            'activeJob': summarize_job(active) if active else None,
+            'jobs': [summarize_job(job) for job in jobs],
+        }
+
+
+def summarize_job(job: dict) -> dict:
+    """取り込みジョブから対象のキーの一覧を除いて返す."""
+    return {name: value for name, value in job.items() if name != 'keys'}
+
+
+class LocalIngestionClient:
+    """bedrock-agentの取り込みジョブのAPIのローカル代替.
+
+    取り込みジョブは開始からduration秒後にfinal_status（既定はCOMPLETE）になる. 実行中の取り込みジョブがある場合の開始は
+    ConflictExceptionとし、同じclientTokenでの開始は同じ取り込みジョブを返す.
+    """
+
+    def __init__(self, duration: float = 30.0, clock: Callable[[], float] = time.time,
+                 final_status: str = 'COMPLETE'):
+        """初期化.
+
+        Args:
+            duration (float): 取り込みジョブの所要時間（秒）
+            clock (Callable): 現在時刻（エポック秒）を返す関数
+            final_status (str): 取り込みジョブの終了時の状態（失敗時の動作の確認にはFAILEDを指定する）
+        """
+        self.duration = duration
+        self.final_status = final_status
+        self.clock = clock
+        self.jobs: dict = {}
+        self._tokens: dict = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _describe(self, job: dict) -> dict:
+        elapsed = self.clock() - job['startedAt']
+        status = self.final_status if elapsed >= self.duration else 'IN_PROGRESS' if elapsed > 0 else 'STARTING'
+        return dict(job, status=status, updatedAt=self.clock())
+
+    def start_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, clientToken: str = None,
+                            description: str = '', **kwargs) -> dict:
+        with self._lock:
+            if clientToken in self._tokens:
+                return {'ingestionJob': self._describe(self.jobs[self._tokens[clientToken]])}
+            if any(self._describe(job)['status'] not in TERMINAL_STATUSES for job in self.jobs.values()):
+                raise ClientError({'Error': {'Code': 'ConflictException',
+                                             'Message': 'An ingestion job is already in progress.'}},
+                                  'StartIngestionJob')
+            job_id = 'LOCAL{0:08d}'.format(next(self._ids))
+            self.jobs[job_id] = {
+                'knowledgeBaseId': knowledgeBaseId,
+                'dataSourceId': dataSourceId,
+                'ingestionJobId': job_id,
+                'description': description,
+                'startedAt': self.clock(),
+                'statistics': {},
+            }
+            if clientToken:
+                self._tokens[clientToken] = job_id
+            return {'ingestionJob': self._describe(self.jobs[job_id])}
+
+    def get_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, ingestionJobId: str, **kwargs) -> dict:
+        with self._lock:
+            job = self.jobs.get(ingestionJobId)
+            if job is None:
+                raise ClientError({'Error': {'Code': 'ResourceNotFoundException',
+                                             'Message': 'The ingestion job does not exist.'}},
+                                  'GetIngestionJob')
+            return {'ingestionJob': self._describe(job)}
+
+    def list_ingestion_jobs(self, knowledgeBaseId: str, dataSourceId: str, filters: list = None,
+                            maxResults: int = 100, **kwargs) -> dict:
+        with self._lock:
+            jobs = sorted((self._describe(job) for job in self.jobs.values()),
+                          key=lambda job: job['startedAt'], reverse=True)
+        statuses = [value for condition in filters or [] if condition['attribute'] == 'STATUS'
+                    for value in condition['values']]
+        if statuses:
+            jobs = [job for job in jobs if job['status'] in statuses]
+        return {'ingestionJobSummaries': jobs[:maxResults]}
@@ -0,0 +1,39 @@
+"""複数の検索結果を順位に基づいて統合するモジュール."""
+from typing import Any, Callable, Hashable, List, Tuple, Union
+
+# Reciprocal Rank Fusionの定数（上位の順位の差を緩和する）
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(result_lists: List[list], key: Callable[[Any], Hashable],
+                           k: int = RRF_K, top_k: Union[int, None] = None) -> List[Tuple[float, Any]]:
+    """Reciprocal Rank Fusionで複数の検索結果を1つの順位に統合する.
+
+    各検索結果で順位rの項目に 1 / (k + r) を加算し、合計の高い順に並べる.
+    keyが同じ項目は1つにまとめ、最初に出現したものを返す.
+
+    Args:
+        result_lists (list): 検索結果（順位の高い順のリスト）のリスト
+        key (Callable): 同じ項目を判定するためのキーを返す関数
+        k (int): 順位に加算する定数
+        top_k (int): 返す最大件数. 未指定の場合は全件
+
+    Returns:
+        list: (統合スコア, 項目) のリスト（統合スコアの高い順）
+    """
+    scores: dict = {}
+    items: dict = {}
+    for results in result_lists:
+        seen = set()
+        for rank, item in enumerate(results, start=1):
+            item_key = key(item)
+            # 同じ検索結果内での重複は、最も高い順位のみを数える
+            if item_key in seen:
+                continue
+            seen.add(item_key)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+
+    fused = sorted(((score, items[item_key]) for item_key, score in scores.items()),
+                   key=lambda entry: entry[0], reverse=True)
+    return fused[:top_k] if top_k is not None else fused
@@ -0,0 +1,163 @@
+"""検索結果を生成の前に並べ替える（リランキング）モジュール.
+
+BM25による語彙的なスコアと、クロスエンコーダーによるスコアに対応する.
+スコアの計算はNumPyでまとめて行う.
+"""
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Callable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+# 英数字の単語、または英数字以外の文字（空白・記号を除く）の連続
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[^\W\da-z_]+')
+
+
+def tokenize(text: str) -> list:
+    """テキストをBM25用のトークンに分割する.
+
+    英数字は単語単位、日本語などは形態素解析を使わず文字のbigramに分割する.
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        list: トークンのリスト
+    """
+    tokens = []
+    for chunk in _TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if chunk.isascii() or len(chunk) == 1:
+            tokens.append(chunk)
+        else:
+            tokens.extend(chunk[index:index + 2] for index in range(len(chunk) - 1))
+    return tokens
+
+
+class BM25Reranker:
+    """検索テキストとチャンクのテキストのBM25スコアで並べ替える."""
+
+    name = 'bm25'
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """初期化.
+
+        Args:
+            k1 (float): 単語の出現回数の影響を抑える係数
+            b (float): テキストの長さによる補正の強さ
+        """
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, texts: Sequence[str]) -> np.ndarray:
+        """検索テキストに対する各テキストのスコアを計算する.
+
+        Args:
+            query (str): 検索テキスト
+            texts (Sequence[str]): テキストのリスト
+
+        Returns:
+            np.ndarray: テキストごとのスコア
+        """
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not texts or not query_terms:
+            return np.zeros(len(texts))
+
+        # 検索テキストに含まれる単語のみを列とする出現回数の行列（テキスト数 x 単語数）
+        term_index = {term: index for index, term in enumerate(query_terms)}
+        term_frequencies = np.zeros((len(texts), len(query_terms)))
+        lengths = np.zeros(len(texts))
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                column = term_index.get(term)
+                if column is not None:
+                    term_frequencies[row, column] = count
+
+        document_frequencies = np.count_nonzero(term_frequencies, axis=0)
+        idf = np.log1p((len(texts) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        average_length = lengths.mean() or 1.0
+        normalizer = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        weights = term_frequencies * (self.k1 + 1) / (term_frequencies + normalizer[:, np.newaxis])
+        return weights @ idf
+
+
+class CrossEncoderReranker:
+    """クロスエンコーダー（検索テキストとテキストの組を入力とするモデル）のスコアで並べ替える.
+
+    predictには sentence_transformers.CrossEncoder.predict と同じく、
+    (検索テキスト, テキスト) のリストを受け取りスコアの配列を返す関数を指定する.
+    """
+
+    name = 'cross-encoder'
+
+    def __init__(self, predict: Callable[[List[Tuple[str, str]]], Sequence[float]], batch_size: int = 32):
+        """初期化.
+
+        Args:
+            predict (Callable): (検索テキスト, テキスト) のリストからスコアを計算する関数
+            batch_size (int): 1回のpredictに渡す組の最大数
+        """
+        self.predict = predict
+        self.batch_size = batch_size
+
+    def score(self, query: str, texts: Sequence[str]) -> np.ndarray:
+        """検索テキストに対する各テキストのスコアを計算する.
+
+        Args:
+            query (str): 検索テキスト
+            texts (Sequence[str]): テキストのリスト
+
+        Returns:
+            np.ndarray: テキストごとのスコア
+        """
+        pairs = [(query, text) for text in texts]
+        scores = [
+            np.asarray(self.predict(pairs[start:start + self.batch_size]), dtype=float).reshape(-1)
+            for start in range(0, len(pairs), self.batch_size)
+        ]
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread > 0 else np.zeros_like(values)
+
+
+def rerank(reranker, query: str, documents: list, get_text: Callable[[Any], str],
+           top_k: Union[int, None] = None, weight: float = 1.0) -> Tuple[list, dict]:
+    """ドキュメントをリランカーのスコアで並べ替え、上位top_k件を返す.
+
+    weightが1未満の場合は、元の順位によるスコアとリランカーのスコアを
+    それぞれ0〜1に正規化して重み付けで合算する.
+
+    Args:
+        reranker: scoreメソッドを持つリランカー（BM25Reranker / CrossEncoderReranker）
+        query (str): 検索テキスト
+        documents (list): 検索結果の順位の高い順のドキュメント
+        get_text (Callable): ドキュメントからテキストを取得する関数
+        top_k (int): 返す最大件数. 未指定の場合は全件
+        weight (float): リランカーのスコアの重み（0〜1）
+
+    Returns:
+        Tuple[list, dict]: 並べ替えたドキュメントと、件数・所要時間
+    """
+    started = time.perf_counter()
+    if documents:
+        scores = reranker.score(query, [get_text(document) for document in documents])
+        if weight < 1:
+            prior = 1 - np.arange(len(documents)) / len(documents)
+            scores = weight * _min_max(scores) + (1 - weight) * prior
+        # 同じスコアの場合は元の順位を維持する
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        reranked = [documents[index] for index in order]
+    else:
+        reranked = []
+    return reranked, {
+        'reranker': reranker.name,
+        'candidates': len(documents),
+        'kept': len(reranked),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -0,0 +1,261 @@
+"""Knowledge Baseの検索フィルターを事前に組み立てるモジュール.
+
+MasterDataのセクション・カテゴリを読み込み、検索対象のセクション・カテゴリが存在するかを
+Knowledge Baseに問い合わせる前に確認する.
+組み立てたフィルターは (セクション, カテゴリの集合) ごとに再利用する.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Tuple, Union
+
+from content_dedupe import format_scope
+
+# MasterDataのテーブルでセクション以外の管理用項目に使用するIDの接頭辞
+META_ID_PREFIX = 'meta#'
+CATALOG_VERSION_ID = 'meta#catalog_version'
+# Knowledge BaseのフィルターのorAll・andAllに指定できる条件の最大数（最小は2）
+MAX_FILTER_MEMBERS = 5
+
+_MISSING = object()
+
+
+class UnknownFilterError(ValueError):
+    """存在しないセクション・カテゴリが指定された場合の例外."""
+
+    def __init__(self, section_name: str, categories: list):
+        self.section_name = section_name
+        self.categories = categories
+        super().__init__('存在しないセクション・カテゴリが指定されました: section={0}, categories={1}'.format(
+            section_name, categories))
+
+
+def load_sections_from_table(table) -> Tuple[int, list]:
+    """MasterDataのテーブルから版数とセクション・カテゴリを読み込む.
+
+    版数はスキャンより前に取得し、スキャン中に保存された場合も次回の確認で再読み込みされるようにする.
+
+    Args:
+        table: MasterDataのDynamoDBテーブル（boto3のTableリソース）
+
+    Returns:
+        Tuple[int, list]: 版数と、sectionName・categoriesを持つセクションのリスト
+    """
+    version = load_version_from_table(table)
+    sections = []
+    scan_kwargs = {
+        'ProjectionExpression': '#id, #sectionName, #categories',
+        'ExpressionAttributeNames': {'#id': 'id', '#sectionName': 'sectionName', '#categories': 'categories'},
+    }
+    while True:
+        response = table.scan(**scan_kwargs)
+        sections.extend(
+            item for item in response.get('Items', [])
+            if not str(item.get('id', '')).startswith(META_ID_PREFIX)
+        )
+        if 'LastEvaluatedKey' not in response:
+            return version, sections
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def load_version_from_table(table) -> int:
+    """MasterDataのテーブルから版数を取得する.
+
+    Args:
+        table: MasterDataのDynamoDBテーブル（boto3のTableリソース）
+
+    Returns:
+        int: 版数（MasterDataが一度も保存されていない場合は0）
+    """
+    item = table.get_item(Key={'id': CATALOG_VERSION_ID}).get('Item')
+    return int(item['version']) if item else 0
+
+
+def load_sections_from_file(path: str) -> list:
+    """JSONファイルからセクション・カテゴリを読み込む.
+
+    MasterDataの GET /masterdata/sections-categories のレスポンス（{"results": [...]}）
+    またはセクションの配列を受け付ける.
+
+    Args:
+        path (str): JSONファイルのパス
+
+    Returns:
+        list: sectionName・categoriesを持つセクションのリスト
+    """
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    return data.get('results', []) if isinstance(data, dict) else data
+
+
+class FilterRegistry:
+    """セクション・カテゴリの検証と、検索フィルターの組み立てを行う.
+
+    セクション・カテゴリを読み込むまでは検証を行わず、全ての指定をそのまま受け付ける.
+    組み立て済みのフィルターは、任意の指定で増え続けないよう最大max_size件のLRUで保持する.
+    モジュールスコープで生成することで、Lambdaのウォームスタート間で共有できる.
+    """
+
+    def __init__(self, sections: Union[Iterable[Dict[str, Any]], None] = None, version: Union[int, None] = None,
+                 shared: bool = False, max_size: int = 1024):
+        """初期化.
+
+        Args:
+            sections (Iterable): sectionName・categoriesを持つセクション. 未指定の場合は検証しない
+            version (int): セクション・カテゴリの版数
+            shared (bool): 重複排除で複数のセクション・カテゴリに共有されたドキュメントも対象にするかどうか
+            max_size (int): 組み立て済みのフィルターを保持する最大件数
+        """
+        self.shared = shared
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._catalog: Union[Dict[str, frozenset], None] = None
+        self._filters: OrderedDict = OrderedDict()
+        self.version = None
+        if sections is not None:
+            self.load(sections, version)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._catalog is not None
+
+    def load(self, sections: Iterable[Dict[str, Any]], version: Union[int, None] = None) -> None:
+        """セクション・カテゴリを読み込み、組み立て済みのフィルターを破棄する.
+
+        Args:
+            sections (Iterable): sectionName・categoriesを持つセクション
+            version (int): セクション・カテゴリの版数
+        """
+        catalog = {}
+        for section in sections:
+            section_name = section.get('sectionName', '')
+            if section_name:
+                catalog[section_name] = catalog.get(section_name, frozenset()) | frozenset(section.get('categories') or [])
+        with self._lock:
+            self._catalog = catalog
+            self._filters = OrderedDict()
+            self.version = version
+
+    def validate(self, section_name: str, categories: list) -> Tuple[str, tuple]:
+        """セクション・カテゴリが存在するかを確認する.
+
+        存在しないカテゴリは `in` フィルターに一致しないため取り除く.
+
+        Args:
+            section_name (str): セクション名
+            categories (list): カテゴリのリスト
+
+        Returns:
+            Tuple[str, tuple]: セクション名と、存在するカテゴリ（昇順）
+
+        Raises:
+            UnknownFilterError: セクション、または全てのカテゴリが存在しない場合
+        """
+        return _validate(self._catalog, section_name, categories)
+
+    def compile(self, section_name: str, categories: list) -> Union[dict, None]:
+        """セクション・カテゴリから検索フィルターを組み立てる.
+
+        同じセクション・カテゴリの集合に対しては同じオブジェクトを返すため、変更しないこと.
+
+        Args:
+            section_name (str): セクション名
+            categories (list): カテゴリのリスト
+
+        Returns:
+            dict: retrievalConfigurationのfilter. セクション・カテゴリが未指定の場合はNone
+
+        Raises:
+            UnknownFilterError: セクション、または全てのカテゴリが存在しない場合
+        """
+        key = (section_name or '', frozenset(categories or []))
+        with self._lock:
+            catalog, filters = self._catalog, self._filters
+            retrieval_filter = filters.get(key, _MISSING)
+            if retrieval_filter is not _MISSING:
+                filters.move_to_end(key)
+        if retrieval_filter is not _MISSING:
+            return retrieval_filter
+
+        # 組み立て中にloadされた場合、古いセクション・カテゴリによる結果は破棄済みのfiltersにのみ保存される
+        section_name, valid_categories = _validate(catalog, section_name, categories)
+        retrieval_filter = build_filter(section_name, list(valid_categories), self.shared)
+        with self._lock:
+            filters[key] = retrieval_filter
+            filters.move_to_end(key)
+            while len(filters) > self.max_size:
+                filters.popitem(last=False)
+        return retrieval_filter
+
+
+def _validate(catalog: Union[Dict[str, frozenset], None], section_name: str, categories: list) -> Tuple[str, tuple]:
+    requested = tuple(sorted(set(categories or [])))
+    if catalog is None:
+        return section_name or '', requested
+
+    if section_name:
+        if section_name not in catalog:
+            raise UnknownFilterError(section_name, list(requested))
+        known_categories = catalog[section_name]
+    else:
+        known_categories = frozenset().union(*catalog.values())
+    valid = tuple(category for category in requested if category in known_categories)
+    if requested and not valid:
+        raise UnknownFilterError(section_name, list(requested))
+    return section_name or '', valid
+
+
+def or_all(filters: list) -> dict:
+    """条件のいずれかに一致するフィルターを作成する.
+
+    orAllに指定できる条件はMAX_FILTER_MEMBERS個までのため、超える場合はorAllを入れ子にする.
+
+    Args:
+        filters (list): 条件のリスト（1つ以上）
+
+    Returns:
+        dict: 条件が1つの場合はその条件、それ以外はorAll
+    """
+    while len(filters) > MAX_FILTER_MEMBERS:
+        filters = [
+            filters[start] if start + 1 == len(filters) else {'orAll': filters[start:start + MAX_FILTER_MEMBERS]}
+            for start in range(0, len(filters), MAX_FILTER_MEMBERS)
+        ]
+    return filters[0] if len(filters) == 1 else {'orAll': filters}
+
+
+def build_filter(section_name: str, categories: list, shared: bool = False) -> Union[dict, None]:
+    """セクション・カテゴリから検索フィルターを作成する.
+
+    sharedの場合は、重複排除で他のセクション・カテゴリからも参照されるドキュメント
+    （メタデータのsections・categories・scopesのリスト）にも一致させる.
+    listContainsは値を1つしか指定できないため、カテゴリごとの条件をorAll（入れ子）でまとめる.
+
+    Args:
+        section_name (str): セクション名
+        categories (list): カテゴリのリスト
+        shared (bool): 共有されたドキュメントにも一致させるかどうか
+
+    Returns:
+        dict: retrievalConfigurationのfilter. セクション・カテゴリが未指定の場合はNone
+    """
+    if section_name and categories:
+        retrieval_filter = {
+            'andAll': [
+                {'equals': {'key': 'section', 'value': section_name}},
+                {'in': {'key': 'category', 'value': categories}},
+            ],
+        }
+        shared_filters = [
+            {'listContains': {'key': 'scopes', 'value': format_scope(section_name, category)}}
+            for category in categories
+        ]
+    elif categories:
+        retrieval_filter = {'in': {'key': 'category', 'value': categories}}
+        shared_filters = [{'listContains': {'key': 'categories', 'value': category}} for category in categories]
+    elif section_name:
+        retrieval_filter = {'equals': {'key': 'section', 'value': section_name}}
+        shared_filters = [{'listContains': {'key': 'sections', 'value': section_name}}]
+    else:
+        return None
+    return or_all([retrieval_filter, *shared_filters]) if shared else retrieval_filter
@@ -0,0 +1,158 @@
+"""処理ごとの所要時間を計測するモジュール.
+
+リクエストの開始時にstartを呼び出すと、以降のspan・timedで計測した所要時間がそのリクエストに記録される.
+計測が無効な場合（startを呼び出さない、またはenabled=Falseの場合）は何もしないオブジェクトを返すため、
+計測のコストはほぼ発生しない.
+"""
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable
+
+
+class _NullSpan:
+    """計測が無効な場合のspan."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Span:
+    """所要時間を計測し、終了時にTimingsに記録するspan."""
+
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings: 'Timings', name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class NullTimings:
+    """計測が無効な場合のTimings."""
+
+    enabled = False
+
+    def span(self, name: str):
+        return _NULL_SPAN
+
+    def add(self, name: str, seconds: float) -> None:
+        pass
+
+    def as_log_fields(self) -> dict:
+        return {}
+
+    def server_timing(self) -> str:
+        return ''
+
+
+class Timings:
+    """1リクエスト分の処理ごとの所要時間.
+
+    複数のスレッドから同じ処理の所要時間を記録でき、処理ごとに回数・合計・最大を保持する.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages: dict = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str) -> _Span:
+        """withブロックの所要時間をnameの処理として記録するspanを返す."""
+        return _Span(self, name)
+
+    def add(self, name: str, seconds: float) -> None:
+        """nameの処理の所要時間を記録する."""
+        with self._lock:
+            count, total, longest = self._stages.get(name, (0, 0.0, 0.0))
+            self._stages[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def as_log_fields(self) -> dict:
+        """構造化ログのフィールド（ミリ秒）を返す.
+
+        Returns:
+            dict: {処理名}_ms（合計）・{処理名}_count・{処理名}_max_ms と、開始からの経過時間 total_ms
+        """
+        fields = {'total_ms': round((time.perf_counter() - self.started) * 1000, 1)}
+        with self._lock:
+            for name, (count, total, longest) in self._stages.items():
+                fields['{0}_ms'.format(name)] = round(total * 1000, 1)
+                fields['{0}_count'.format(name)] = count
+                fields['{0}_max_ms'.format(name)] = round(longest * 1000, 1)
+        return fields
+
+    def server_timing(self) -> str:
+        """Server-Timingヘッダーの値を返す（durは処理ごとの合計、descは回数）."""
+        with self._lock:
+            metrics = [
+                '{0};desc="{1} calls";dur={2:.1f}'.format(name, count, total * 1000)
+                for name, (count, total, _) in self._stages.items()
+            ]
+        metrics.append('total;dur={0:.1f}'.format((time.perf_counter() - self.started) * 1000))
+        return ', '.join(metrics)
+
+
+_NULL_SPAN = _NullSpan()
+NULL_TIMINGS = NullTimings()
+_current_timings: contextvars.ContextVar = contextvars.ContextVar('timings', default=NULL_TIMINGS)
+
+
+def start(enabled: bool):
+    """リクエストの計測を開始する.
+
+    Args:
+        enabled (bool): 計測するかどうか
+
+    Returns:
+        Timings: 現在のリクエストのTimings（無効な場合はNULL_TIMINGS）
+    """
+    timings = Timings() if enabled else NULL_TIMINGS
+    _current_timings.set(timings)
+    return timings
+
+
+def current():
+    """現在のリクエストのTimingsを返す."""
+    return _current_timings.get()
+
+
+def span(name: str):
+    """現在のリクエストにnameの処理の所要時間を記録するspanを返す."""
+    return _current_timings.get().span(name)
+
+
+def timed(name: str) -> Callable:
+    """関数の所要時間をnameの処理として記録するデコレーター."""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            timings = _current_timings.get()
+            if not timings.enabled:
+                return function(*args, **kwargs)
+            with timings.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor, function: Callable, *args, **kwargs):
+    """現在のリクエストのTimingsを引き継いで、executorで関数を実行する.
+
+    ThreadPoolExecutorはcontextvarsを引き継がないため、計測が有効な場合のみコンテキストをコピーして渡す.
+    """
+    if not _current_timings.get().enabled:
+        return executor.submit(function, *args, **kwargs)
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)